@@ -1,6 +1,8 @@
+import os
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    # Development server; production serves wsgi.py with gunicorn
+    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
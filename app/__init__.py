@@ -1,47 +1,88 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
-from flasgger import Swagger
 from config import Config
 
 db = SQLAlchemy()
 csrf = CSRFProtect()
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if test_config:
+        app.config.update(test_config)
     
     # Initialize extensions
     db.init_app(app)
     csrf.init_app(app)
     
-    # Swagger setup
-    swagger = Swagger(app, template={
-        "swagger": "2.0",
-        "info": {
-            "title": "Toilet Finder API",
-            "description": "API documentation for public toilet data",
-            "version": "1.0"
-        },
-        "basePath": "/",
-        "schemes": ["http"]
-    })
+    # SQLite journal/cache PRAGMAs on every pooled connection
+    from app.utils.sqlite import init_sqlite_pragmas
+    with app.app_context():
+        init_sqlite_pragmas(app, db.engine)
+    
+    # Request, SQL and cache metrics for /metrics. Registered before the
+    # other response hooks so it sees the final response
+    from app.utils.metrics import init_metrics
+    init_metrics(app)
+    
+    # Bounded pool for password hashing
+    from app.utils.password_hashing import init_password_hasher
+    init_password_hasher(app)
+    
+    # Optional single writer committing reviews and toilets in batches
+    from app.utils.group_commit import init_group_commit
+    init_group_commit(app)
+    
+    # Per-request SQL statement counting
+    from app.utils.query_counter import init_query_counter
+    init_query_counter(app)
+    
+    # Serialized API responses cached per dataset version
+    from app.utils.response_cache import init_response_cache
+    init_response_cache(app)
+    
+    # gzip/brotli compression of text responses
+    from app.utils.compression import init_compression
+    init_compression(app)
     
     # Register blueprints
     from app.views.auth import auth_bp
     from app.views.main import main_bp
     from app.views.api import api_bp
+    from app.views.metrics import metrics_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(metrics_bp)
     
     # Error handlers
     from app.views.errors import errors_bp
     app.register_blueprint(errors_bp)
     
-    # Create tables
+    # Swagger UI and spec, built on the first /apidocs request
+    from app.utils.api_docs import init_api_docs
+    init_api_docs(app)
+    
+    # Create or migrate tables unless the schema version says they are up to date
+    from app.models.schema import SCHEMA_VERSION, ensure_schema
     with app.app_context():
-        db.create_all()
+        schema_version = ensure_schema()
+    
+    # CLI commands
+    from app.commands import register_commands
+    register_commands(app)
+    
+    # On an outdated database the indexes are built on first use and the
+    # snapshot publisher waits, both until `flask db-upgrade` has run
+    if schema_version >= SCHEMA_VERSION:
+        # Build the in-memory nearest-toilet index
+        from app.utils.toilet_index import init_toilet_index
+        init_toilet_index(app)
+    
+    # Static snapshot of all toilets for the map, republished on changes
+    from app.utils.snapshot import init_snapshot_publisher
+    init_snapshot_publisher(app)
     
     return app
\ No newline at end of file
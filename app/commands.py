@@ -0,0 +1,167 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+@click.command('rebuild-aggregates')
+@with_appcontext
+def rebuild_aggregates_command():
+    """Recompute stored rating aggregates for every toilet."""
+    from app.utils.aggregates import rebuild_aggregates
+    from app.utils.toilet_index import init_toilet_index
+
+    changed = rebuild_aggregates()
+    # In-memory indexes hold consensus values, so refresh them as well
+    init_toilet_index(current_app._get_current_object())
+    click.echo(f'Rebuilt aggregates, {changed} toilet(s) updated')
+
+@click.command('check-aggregates')
+@with_appcontext
+def check_aggregates_command():
+    """Compare stored rating aggregates against a full recompute."""
+    from app.utils.aggregates import check_aggregates, describe_mismatch
+
+    mismatches = check_aggregates()
+    for toilet_id, stored, expected in mismatches:
+        click.echo(f'Toilet {toilet_id}: {describe_mismatch(stored, expected)}')
+
+    if mismatches:
+        click.echo(f'{len(mismatches)} toilet(s) with stale aggregates, run "flask rebuild-aggregates"')
+        raise SystemExit(1)
+    click.echo('All aggregates are consistent')
+
+@click.command('compact-changes')
+@click.option('--keep', default=10000, show_default=True,
+              help='Number of most recent dataset versions to keep in the change log.')
+@with_appcontext
+def compact_changes_command(keep):
+    """Delete old entries from the toilet change log."""
+    from app.models.dataset import compact_changes
+
+    removed = compact_changes(keep)
+    click.echo(f'Removed {removed} change log entries')
+
+@click.command('prune-idempotency-keys')
+@click.option('--days', default=30, show_default=True,
+              help='Keep the keys of batch submissions made in this many days.')
+@with_appcontext
+def prune_idempotency_keys_command(days):
+    """Delete old idempotency keys of batch submissions."""
+    from app.models.idempotency import prune_idempotency_keys
+
+    removed = prune_idempotency_keys(days)
+    click.echo(f'Removed {removed} idempotency key(s)')
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from the toilet and review tables."""
+    from app import db
+    from app.models.search import rebuild_search_index, search_supported
+
+    connection = db.session.connection()
+    if not search_supported(connection):
+        raise click.UsageError('This database has no full-text index; search falls back to LIKE')
+    indexed = rebuild_search_index(connection)
+    db.session.commit()
+    click.echo(f'Indexed {indexed} descriptions and comments')
+
+@click.command('import-toilets')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', required=True, help='Username the imported toilets are credited to.')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'geojson']),
+              help='File format, guessed from the extension by default.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per insert and transaction.')
+@click.option('--dedupe-radius', default=10.0, show_default=True,
+              help='Skip points within this many meters of a known toilet, 0 to disable.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted import.')
+@with_appcontext
+def import_toilets_command(path, username, file_format, batch_size, dedupe_radius, restart):
+    """Bulk import toilets from a CSV or GeoJSON (including OSM) file."""
+    from app.models.user import User
+    from app.utils.importer import detect_format, import_toilets, load_checkpoint
+    from app.utils.toilet_index import init_toilet_index
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f'no user named {username}', param_hint='--user')
+
+    resume_at = 0 if restart else load_checkpoint(path)
+    if resume_at:
+        click.echo(f'Resuming after record {resume_at}')
+
+    def progress(stats):
+        click.echo(f"{stats['records']} records, {stats['imported']} imported, "
+                   f"{stats['rows_per_second']:.0f} rows/s")
+
+    try:
+        file_format = file_format or detect_format(path)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    stats = import_toilets(path, user.id, file_format=file_format, batch_size=batch_size,
+                           dedupe_radius_m=dedupe_radius, resume=not restart, progress=progress)
+    # Build the in-memory indexes once, now that every row is in
+    init_toilet_index(current_app._get_current_object())
+
+    for error in stats['errors']:
+        click.echo(f'Skipped {error}')
+    click.echo(f"Imported {stats['imported']} toilet(s): {stats['duplicates']} duplicate(s), "
+               f"{stats['invalid']} invalid record(s), {stats['rows_per_second']:.0f} rows/s")
+
+@click.command('export-toilets')
+@click.option('--format', 'output_format', type=click.Choice(['ndjson', 'geojson']), default='ndjson',
+              show_default=True)
+@click.option('--output', type=click.File('w'), default='-', help='File to write, stdout by default.')
+@with_appcontext
+def export_toilets_command(output_format, output):
+    """Write every toilet as NDJSON or a GeoJSON FeatureCollection."""
+    from app.utils.export import export_toilets
+
+    for chunk in export_toilets(output_format):
+        output.write(chunk)
+
+@click.command('publish-snapshot')
+@click.option('--force', is_flag=True, help='Publish even if the current version already has a snapshot.')
+@with_appcontext
+def publish_snapshot_command(force):
+    """Write the static toilet snapshot loaded by the map."""
+    from app.utils.snapshot import publish_snapshot
+
+    manifest = publish_snapshot(force=force)
+    click.echo(f"Snapshot {manifest['file']}: {manifest['count']} toilet(s) at version {manifest['version']}")
+
+@click.command('db-upgrade')
+@click.option('--to', 'target', type=int, help='Schema version to stop at, the latest by default.')
+@click.option('--list', 'list_only', is_flag=True, help='Only list the pending migrations.')
+@with_appcontext
+def db_upgrade_command(target, list_only):
+    """Apply pending schema migrations."""
+    from app.migrations import pending_migrations, upgrade
+    from app.models.schema import SCHEMA_VERSION, get_schema_version
+    from app.utils.toilet_index import init_toilet_index
+
+    target = SCHEMA_VERSION if target is None else target
+    if list_only:
+        for migration in pending_migrations():
+            if migration.version <= target:
+                click.echo(f'{migration.version:03d} {migration.description}')
+        return
+
+    applied = upgrade(target, progress=lambda migration: click.echo(
+        f'Applying {migration.version:03d} {migration.description}'
+    ))
+    if applied:
+        # Migrations may backfill values the in-memory indexes hold
+        init_toilet_index(current_app._get_current_object())
+    click.echo(f'Database at schema version {get_schema_version()}')
+
+def register_commands(app):
+    app.cli.add_command(rebuild_aggregates_command)
+    app.cli.add_command(check_aggregates_command)
+    app.cli.add_command(compact_changes_command)
+    app.cli.add_command(prune_idempotency_keys_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(import_toilets_command)
+    app.cli.add_command(export_toilets_command)
+    app.cli.add_command(publish_snapshot_command)
+    app.cli.add_command(db_upgrade_command)
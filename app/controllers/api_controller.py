@@ -1,51 +1,255 @@
 from flask import session, jsonify
+from sqlalchemy.orm import joinedload
 from app.models.toilet import Toilet
-from app.models.user import User
+from app.models.review import Review
+from app.utils.geo import bbox_center, haversine_km, parse_bbox
+from app.utils.pagination import keyset_page, parse_limit, sort_order, sorted_keyset_page
+from app.utils.clusters import MAX_CLUSTER_ZOOM
+from app.utils.compact import encode_compact
+from app.utils.export import EXPORT_FORMATS, export_toilets
+from app.models.dataset import get_changed_toilet_ids
+from app.utils.batch import MAX_BATCH_ITEMS, submit_batch
+from app.utils.search import search_toilets
+from app.utils.toilet_index import get_cluster_index, get_nearest_index, refresh_toilet_indexes
+from app.utils.validators import MAX_ID, parse_int, validate_coordinates
+
+# Upper bound for the k parameter of the nearest toilets endpoint
+MAX_NEAREST_RESULTS = 50
+
+# Values of the format parameter of the toilet list
+TOILET_LIST_FORMATS = ('json', 'compact')
+
+# Values of the sort parameter of the toilet list; id is the default
+TOILET_LIST_SORTS = ('id', 'distance', 'rating')
+
+# Largest delta the change feed returns before telling clients to reload
+MAX_CHANGED_TOILETS = 1000
+
+# Deepest zoom level Leaflet's default tile layers go to
+MAX_MAP_ZOOM = 22
+
+# Default and largest number of search results
+SEARCH_RESULTS = 20
+MAX_SEARCH_RESULTS = 100
+
+# Page sizes used when a client sends a cursor without a limit
+TOILETS_PAGE_SIZE = 500
+REVIEWS_PAGE_SIZE = 20
+
+def _is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def _author_name(item):
+    # Use username if the author exists, otherwise "Unknown"
+    return item.author.username if item.author else "Unknown"
+
+def _serialize_toilet(toilet):
+    return {
+        'id': toilet.id,
+        'latitude': toilet.latitude,
+        'longitude': toilet.longitude,
+        'description': toilet.description,
+        'accessible': toilet.get_accessibility_consensus(),
+        'has_toilet_paper': toilet.get_toilet_paper_consensus(),
+        'cleanliness': toilet.get_median_cleanliness(),
+        'review_count': toilet.get_review_count(),
+        'author': _author_name(toilet)
+    }
 
 class ApiController:
     @staticmethod
-    def get_toilets():
+    def get_toilets(bbox=None, limit=None, cursor=None, output_format=None, accessible=None,
+                    has_toilet_paper=None, min_cleanliness=None, min_review_count=None, sort=None,
+                    lat=None, lng=None):
         if 'user_id' not in session:
             return {"error": "Authentication required"}, 401
-            
-        toilets = Toilet.query.all()
-        toilet_list = []
         
-        for toilet in toilets:
-            # Find the user
-            user = User.query.get(toilet.user_id)
+        output_format = output_format or 'json'
+        if output_format not in TOILET_LIST_FORMATS:
+            return {"error": f"format must be one of {', '.join(TOILET_LIST_FORMATS)}"}, 400
+        sort = sort or 'id'
+        if sort not in TOILET_LIST_SORTS:
+            return {"error": f"sort must be one of {', '.join(TOILET_LIST_SORTS)}"}, 400
+        
+        # Authors come in through a join; consensus values are stored columns
+        query = Toilet.query.options(joinedload(Toilet.author))
+        try:
+            if bbox:
+                # Only return what is visible in the requested map viewport
+                bbox = parse_bbox(bbox)
+                query = query.filter(Toilet.in_bbox(*bbox))
+            
+            # Attribute filters are indexed comparisons on the stored consensus columns
+            if _is_true(accessible):
+                query = query.filter(Toilet.accessible_consensus.is_(True))
+            if _is_true(has_toilet_paper):
+                query = query.filter(Toilet.toilet_paper_consensus.is_(True))
+            if min_cleanliness:
+                min_cleanliness = parse_int(min_cleanliness, 'min_cleanliness', 1, 5)
+                query = query.filter(Toilet.median_cleanliness >= min_cleanliness)
+            if min_review_count:
+                min_review_count = parse_int(min_review_count, 'min_review_count', 0, MAX_ID)
+                query = query.filter(Toilet.review_count >= min_review_count)
+            
+            origin = None
+            if sort == 'distance':
+                if lat not in (None, '') or lng not in (None, ''):
+                    origin = validate_coordinates(lat, lng)
+                elif bbox:
+                    # The center of the viewport
+                    origin = bbox_center(*bbox)
+                else:
+                    raise ValueError("sort=distance needs lat and lng or a bbox")
             
-            # Set the author name - use username if user exists, otherwise "Unknown"
-            author_name = user.username if user else "Unknown"
+            # Without a limit or cursor the whole (filtered) list is returned
+            page_size = parse_limit(limit, TOILETS_PAGE_SIZE) if limit or cursor else None
+            next_cursor = None
+            if sort == 'id':
+                if page_size:
+                    toilets, next_cursor = keyset_page(query, Toilet.id, page_size, cursor)
+                else:
+                    toilets = query.all()
+            else:
+                if sort == 'distance':
+                    sort_column, descending = Toilet.distance_order(*origin), False
+                else:
+                    sort_column, descending = Toilet.median_cleanliness, True
+                if page_size:
+                    toilets, _, next_cursor = sorted_keyset_page(
+                        query, sort_column, Toilet.id, page_size, cursor, descending)
+                else:
+                    toilets = query.order_by(*sort_order(sort_column, Toilet.id, descending)).all()
+        except ValueError as e:
+            return {"error": str(e)}, 400
             
-            toilet_data = {
-                'id': toilet.id,
-                'latitude': toilet.latitude,
-                'longitude': toilet.longitude,
-                'description': toilet.description,
-                'accessible': toilet.get_accessibility_consensus(),
-                'has_toilet_paper': toilet.get_toilet_paper_consensus(),
-                'cleanliness': toilet.get_median_cleanliness(),
-                'review_count': len(toilet.reviews),
-                'author': author_name
-            }
+        toilet_list = [_serialize_toilet(toilet) for toilet in toilets]
+        if origin:
+            for toilet_data in toilet_list:
+                toilet_data['distance_km'] = round(
+                    haversine_km(origin[0], origin[1], toilet_data['latitude'], toilet_data['longitude']), 3)
+        
+        if output_format == 'compact':
+            # Columnar encoding for bandwidth-constrained clients
+            data = encode_compact(toilet_list, ordered=sort != 'id')
+        else:
+            data = {'toilets': toilet_list}
+        if limit or cursor:
+            data['next_cursor'] = next_cursor
+        return data, 200
+    
+    @staticmethod
+    def get_nearest_toilets(lat, lng, k=5, accessible=False, has_toilet_paper=False, min_cleanliness=None):
+        if 'user_id' not in session:
+            return {"error": "Authentication required"}, 401
+        
+        try:
+            lat, lng = validate_coordinates(lat, lng)
+            k = parse_int(k, 'k', 1, MAX_NEAREST_RESULTS)
+            if min_cleanliness:
+                min_cleanliness = parse_int(min_cleanliness, 'min_cleanliness', 1, 5)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        
+        # Filters are evaluated inside the index search, not on the result
+        refresh_toilet_indexes()
+        matches = get_nearest_index().nearest(
+            lat, lng, k,
+            accessible=_is_true(accessible),
+            has_toilet_paper=_is_true(has_toilet_paper),
+            min_cleanliness=min_cleanliness
+        )
+        
+        query = Toilet.query.options(joinedload(Toilet.author))
+        toilets = {toilet.id: toilet for toilet in
+                   query.filter(Toilet.id.in_([toilet_id for toilet_id, _ in matches]))}
+        toilet_list = []
+        for toilet_id, distance in matches:
+            toilet = toilets.get(toilet_id)
+            if toilet is None:
+                continue
+            
+            toilet_data = _serialize_toilet(toilet)
+            toilet_data['distance_km'] = round(distance, 3)
             toilet_list.append(toilet_data)
         
         return {'toilets': toilet_list}, 200
     
     @staticmethod
-    def get_toilet_details(toilet_id):
+    def get_toilet_clusters(zoom, bbox=None, output_format=None):
+        if 'user_id' not in session:
+            return {"error": "Authentication required"}, 401
+        
+        try:
+            zoom = parse_int(zoom, 'z', 0, MAX_MAP_ZOOM)
+            box = parse_bbox(bbox) if bbox else (-180.0, -90.0, 180.0, 90.0)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        
+        # Close enough in, individual toilets are cheap to draw
+        if zoom > MAX_CLUSTER_ZOOM:
+            data, status = ApiController.get_toilets(bbox, output_format=output_format)
+            data['zoom'] = zoom
+            return data, status
+        
+        refresh_toilet_indexes()
+        return {'zoom': zoom, 'clusters': get_cluster_index().clusters(zoom, *box)}, 200
+    
+    @staticmethod
+    def get_toilet_changes(since):
+        if 'user_id' not in session:
+            return {"error": "Authentication required"}, 401
+        
+        try:
+            since = int(since)
+            if since < 0:
+                raise ValueError
+        except (ValueError, TypeError):
+            return {"error": "since must be a non-negative dataset version"}, 400
+        
+        version, toilet_ids = get_changed_toilet_ids(since, limit=MAX_CHANGED_TOILETS + 1)
+        # The log was compacted past `since` (or the delta is huge): start over
+        if toilet_ids is None or len(toilet_ids) > MAX_CHANGED_TOILETS:
+            return {'version': version, 'reset': True, 'toilets': []}, 200
+        
+        toilets = []
+        if toilet_ids:
+            toilets = Toilet.query.options(joinedload(Toilet.author)).filter(Toilet.id.in_(toilet_ids)).all()
+        
+        return {
+            'version': version,
+            'reset': False,
+            'toilets': [_serialize_toilet(toilet) for toilet in toilets]
+        }, 200
+    
+    @staticmethod
+    def export_toilets(output_format=None):
+        # Returns a generator of body chunks instead of data to serialize
+        if 'user_id' not in session:
+            return {"error": "Authentication required"}, 401
+        
+        output_format = output_format or 'ndjson'
+        if output_format not in EXPORT_FORMATS:
+            return {"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, 400
+        
+        return export_toilets(output_format), 200
+    
+    @staticmethod
+    def get_toilet_details(toilet_id, limit=None, cursor=None):
         if 'user_id' not in session:
             return {"error": "Authentication required"}, 401
 
-        toilet = Toilet.query.get_or_404(toilet_id)
-        user = User.query.get(toilet.user_id)
-        author_name = user.username if user else "Unknown"
+        # One query for the toilet and its author, one for a page of reviews and theirs
+        toilet = Toilet.query.options(joinedload(Toilet.author)).get_or_404(toilet_id)
+        try:
+            reviews, next_cursor = keyset_page(
+                Review.query.options(joinedload(Review.author)).filter(Review.toilet_id == toilet.id),
+                Review.id, parse_limit(limit, REVIEWS_PAGE_SIZE), cursor
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
 
         reviews_data = []
-        for review in toilet.reviews:
-            review_user = User.query.get(review.user_id)
-            reviewer_name = review_user.username if review_user else "Unknown"
+        for review in reviews:
             reviews_data.append({
                 'id': review.id,
                 'accessible': review.accessible,
@@ -53,7 +257,7 @@ class ApiController:
                 'cleanliness': review.cleanliness,
                 'comment': review.comment,
                 'timestamp': review.timestamp.strftime('%Y-%m-%d %H:%M'),
-                'author': reviewer_name
+                'author': _author_name(review)
             })
 
         toilet_data = {
@@ -65,8 +269,50 @@ class ApiController:
             'has_toilet_paper': toilet.get_toilet_paper_consensus(),
             'cleanliness': toilet.get_median_cleanliness(),
             'timestamp': toilet.timestamp.strftime('%Y-%m-%d %H:%M'),
-            'author': author_name,
-            'reviews': reviews_data
+            'author': _author_name(toilet),
+            'review_count': toilet.get_review_count(),
+            'reviews': reviews_data,
+            'next_cursor': next_cursor
         }
 
-        return toilet_data, 200
\ No newline at end of file
+        return toilet_data, 200
+    
+    @staticmethod
+    def submit_batch(payload):
+        if 'user_id' not in session:
+            return {"error": "Authentication required"}, 401
+        
+        # Either {"items": [...]} or the bare list
+        items = payload.get('items') if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            return {"error": "Expected a list of items"}, 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return {"error": f"At most {MAX_BATCH_ITEMS} items per batch"}, 400
+        
+        results = submit_batch(session['user_id'], items)
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        return {'results': results, 'counts': counts}, 200
+    
+    @staticmethod
+    def search_toilets(query, bbox=None, limit=None):
+        if 'user_id' not in session:
+            return {"error": "Authentication required"}, 401
+        
+        if not query or not query.strip():
+            return {"error": "q is required"}, 400
+        try:
+            bbox = parse_bbox(bbox) if bbox else None
+            limit = parse_int(limit, 'limit', 1, MAX_SEARCH_RESULTS) if limit else SEARCH_RESULTS
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        
+        # Ranked ids first, then one query for the toilets and their authors
+        toilet_ids = search_toilets(query, bbox, limit)
+        toilets = {}
+        if toilet_ids:
+            toilets = {toilet.id: toilet for toilet in
+                       Toilet.query.options(joinedload(Toilet.author)).filter(Toilet.id.in_(toilet_ids))}
+        toilet_list = [_serialize_toilet(toilets[toilet_id]) for toilet_id in toilet_ids if toilet_id in toilets]
+        return {'query': query, 'toilets': toilet_list}, 200
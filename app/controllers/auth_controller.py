@@ -1,6 +1,9 @@
-from flask import session, flash
+from flask import current_app, session, flash
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
 from app import db
 from app.models.user import User
+from app.utils.password_hashing import PasswordHashingBusy
 from app.utils.validators import validate_username, validate_email
 
 class AuthController:
@@ -19,12 +22,13 @@ class AuthController:
             flash('Password must be at least 8 characters long')
             return False
         
-        # Check existing users
-        if User.query.filter_by(username=username).first():
+        # Check existing users, by username and email in one query
+        existing = User.query.filter(or_(User.username == username, User.email == email)).all()
+        if any(user.username == username for user in existing):
             flash('Username already exists')
             return False
         
-        if User.query.filter_by(email=email).first():
+        if existing:
             flash('Email already registered')
             return False
         
@@ -42,6 +46,18 @@ class AuthController:
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            # Upgrade hashes made with an older PASSWORD_HASH_METHOD, unless
+            # the hashing pool is shedding load; a later login does it then
+            if user.password_needs_rehash():
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except PasswordHashingBusy:
+                    pass
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    current_app.logger.exception('Storing the rehashed password failed')
+            
             session['user_id'] = user.id
             session['username'] = user.username
             flash('Logged in successfully!')
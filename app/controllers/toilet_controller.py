@@ -1,9 +1,18 @@
-from flask import session, flash
+from flask import current_app, session, flash
 from app import db
 from app.models.toilet import Toilet
 from app.models.review import Review
-from app.utils.validators import validate_coordinates
-from markupsafe import escape
+from app.utils.validators import sanitize_text, validate_cleanliness, validate_coordinates
+from app.utils.group_commit import GroupCommitBusy, get_group_commit_writer
+from app.utils.toilet_index import index_toilet
+
+def _index_saved(toilet):
+    # The row is already committed: a failure here only leaves the in-memory
+    # indexes behind until the next refresh, so it is logged, not reported
+    try:
+        index_toilet(toilet)
+    except Exception:
+        current_app.logger.exception('Indexing toilet %s failed', toilet.id)
 
 class ToiletController:
     @staticmethod
@@ -13,19 +22,15 @@ class ToiletController:
             lat, lng = validate_coordinates(latitude, longitude)
             
             # Sanitize and validate description
-            desc = escape(description.strip())
-            if len(desc) > 200:
-                desc = desc[:200]
+            desc = sanitize_text(description)
             if not desc:
                 flash('Description is required')
                 return False
             
             # Validate cleanliness rating
-            clean_rating = int(cleanliness)
-            if not (1 <= clean_rating <= 5):
-                raise ValueError("Invalid cleanliness rating")
+            clean_rating = validate_cleanliness(cleanliness)
             
-            toilet = Toilet(
+            values = dict(
                 latitude=lat,
                 longitude=lng,
                 description=desc,
@@ -35,8 +40,17 @@ class ToiletController:
                 user_id=session['user_id']
             )
             
-            db.session.add(toilet)
-            db.session.commit()
+            writer = get_group_commit_writer()
+            if writer is not None:
+                # Hand the connection back to the pool while waiting on the
+                # writer, which is committed and indexed with other submissions
+                db.session.commit()
+                writer.submit(Toilet, values)
+            else:
+                toilet = Toilet(**values)
+                db.session.add(toilet)
+                db.session.commit()
+                _index_saved(toilet)
             
             flash('Toilet added successfully!')
             return True
@@ -44,6 +58,9 @@ class ToiletController:
         except (ValueError, KeyError) as e:
             flash(f'Invalid input: {str(e)}')
             return False
+        except GroupCommitBusy:
+            # Answered with a 503, see app.views.errors
+            raise
         except Exception as e:
             flash('An error occurred while adding the toilet')
             return False
@@ -54,17 +71,13 @@ class ToiletController:
             toilet = Toilet.query.get_or_404(toilet_id)
             
             # Validate cleanliness rating
-            clean_rating = int(cleanliness)
-            if not (1 <= clean_rating <= 5):
-                raise ValueError("Invalid cleanliness rating")
+            clean_rating = validate_cleanliness(cleanliness)
             
             # Sanitize comment
-            sanitized_comment = escape(comment.strip())
-            if len(sanitized_comment) > 200:
-                sanitized_comment = sanitized_comment[:200]
+            sanitized_comment = sanitize_text(comment)
             
             # Create new review
-            review = Review(
+            values = dict(
                 accessible=accessible,
                 has_toilet_paper=has_toilet_paper,
                 cleanliness=clean_rating,
@@ -73,8 +86,17 @@ class ToiletController:
                 toilet_id=toilet_id
             )
             
-            db.session.add(review)
-            db.session.commit()
+            writer = get_group_commit_writer()
+            if writer is not None:
+                # Hand the connection back to the pool while waiting on the
+                # writer, which is committed and indexed with other submissions
+                db.session.commit()
+                writer.submit(Review, values)
+            else:
+                db.session.add(Review(**values))
+                db.session.commit()
+                # The review may have changed the toilet's consensus values
+                _index_saved(toilet)
             
             flash('Review submitted successfully!')
             return True
@@ -82,6 +104,9 @@ class ToiletController:
         except (ValueError, KeyError) as e:
             flash(f'Invalid input: {str(e)}')
             return False
+        except GroupCommitBusy:
+            # Answered with a 503, see app.views.errors
+            raise
         except Exception as e:
             flash('An error occurred while submitting the review')
             return False
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""Ordered schema migrations.
+
+Each module named vNNN_<name>.py upgrades the database from schema version
+NNN - 1 to NNN with an ``upgrade(connection)`` function; its docstring is
+the description shown by `flask db-upgrade`. Migrations run in order, each
+in its own transaction together with the schema_version update, and check
+what already exists before changing it, so re-running one that was
+interrupted, or racing another worker running the same one, is harmless.
+
+Databases created before versions were recorded count as version 0, the
+original user/toilet/review layout. Empty databases skip the migrations and
+get the current layout from create_all directly.
+"""
+import importlib
+import pkgutil
+import re
+from sqlalchemy import inspect, text
+from app import db
+from app.models.schema import SCHEMA_VERSION, get_schema_version, set_schema_version
+
+MODULE_PATTERN = re.compile(r'^v(\d{3})_\w+$')
+
+class Migration:
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+        self.description = (module.__doc__ or name).strip().splitlines()[0]
+
+    def upgrade(self, connection):
+        self.module.upgrade(connection)
+
+def load_migrations():
+    """All migrations ordered by version."""
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        match = MODULE_PATTERN.match(module_info.name)
+        if match:
+            module = importlib.import_module(f'{__name__}.{module_info.name}')
+            migrations.append(Migration(int(match.group(1)), module_info.name, module))
+    migrations.sort(key=lambda migration: migration.version)
+
+    versions = [migration.version for migration in migrations]
+    if versions != list(range(1, SCHEMA_VERSION + 1)):
+        raise RuntimeError(f'Migrations {versions} do not lead up to schema version {SCHEMA_VERSION}')
+    return migrations
+
+def database_is_empty():
+    return not inspect(db.engine).has_table('toilet')
+
+def pending_migrations(version=None):
+    """Migrations still to be applied to a database at `version`, by default
+    the current one."""
+    if version is None:
+        version = get_schema_version() or 0
+    return [migration for migration in load_migrations() if migration.version > version]
+
+def upgrade(target=SCHEMA_VERSION, progress=None):
+    """Bring the database to schema version `target`. Returns the applied
+    migrations; `progress` is called with each one before it runs."""
+    version = get_schema_version()
+    # Don't hold the session's connection while migrating
+    db.session.remove()
+
+    if version is None and database_is_empty():
+        if target != SCHEMA_VERSION:
+            raise ValueError(f'An empty database can only be created at version {SCHEMA_VERSION}')
+        with db.engine.begin() as connection:
+            db.metadata.create_all(connection)
+            set_schema_version(connection, SCHEMA_VERSION)
+        return []
+
+    applied = []
+    for migration in pending_migrations(version or 0):
+        if migration.version > target:
+            break
+        if progress:
+            progress(migration)
+        with db.engine.begin() as connection:
+            migration.upgrade(connection)
+            set_schema_version(connection, migration.version)
+        applied.append(migration)
+    return applied
+
+# Helpers for migration scripts
+
+def has_column(connection, table_name, column_name):
+    return any(column['name'] == column_name for column in inspect(connection).get_columns(table_name))
+
+def add_column(connection, table_name, column_definition):
+    """ALTER TABLE ... ADD COLUMN unless the column exists. Returns whether
+    it was added."""
+    column_name = column_definition.split()[0]
+    if has_column(connection, table_name, column_name):
+        return False
+    connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_definition}'))
+    return True
+
+def create_index(connection, name, table_name, columns):
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({", ".join(columns)})'))
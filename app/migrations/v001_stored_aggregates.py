@@ -0,0 +1,79 @@
+"""Add the grid index, rating aggregates and dataset version tables"""
+from sqlalchemy import bindparam, case, column, func, select, table
+from app import db
+from app.migrations import add_column, create_index
+from app.models.dataset import reset_dataset_version
+from app.utils.geo import grid_cell
+
+BACKFILL_BATCH_SIZE = 1000
+
+CLEANLINESS_FIELDS = ['cleanliness_1', 'cleanliness_2', 'cleanliness_3', 'cleanliness_4', 'cleanliness_5']
+AGGREGATE_FIELDS = CLEANLINESS_FIELDS + ['accessible_votes', 'toilet_paper_votes', 'review_count']
+
+# The tables as of this version
+toilet = table('toilet', column('id'), column('latitude'), column('longitude'), column('cleanliness'),
+               column('accessible'), column('has_toilet_paper'), column('grid_cell'),
+               *[column(field) for field in AGGREGATE_FIELDS])
+review = table('review', column('toilet_id'), column('cleanliness'), column('accessible'),
+               column('has_toilet_paper'))
+
+def upgrade(connection):
+    # New tables: dataset_version, toilet_change, schema_version
+    db.metadata.create_all(connection, tables=[
+        db.metadata.tables['dataset_version'],
+        db.metadata.tables['toilet_change'],
+        db.metadata.tables['schema_version']
+    ])
+    add_column(connection, 'dataset_version', 'compacted_version INTEGER NOT NULL DEFAULT 0')
+
+    add_column(connection, 'toilet', 'grid_cell INTEGER')
+    create_index(connection, 'ix_toilet_grid_cell', 'toilet', ['grid_cell'])
+    added = [add_column(connection, 'toilet', f'{field} INTEGER NOT NULL DEFAULT 0')
+             for field in AGGREGATE_FIELDS]
+    create_index(connection, 'ix_review_toilet_id_id', 'review', ['toilet_id', 'id'])
+
+    backfilled = _backfill_grid_cells(connection)
+    if any(added):
+        _backfill_aggregates(connection)
+        backfilled = True
+    if backfilled:
+        # Cached responses and in-memory indexes predate the new values
+        reset_dataset_version(connection)
+
+def _backfill_grid_cells(connection):
+    rows = connection.execute(
+        select(toilet.c.id, toilet.c.latitude, toilet.c.longitude).where(toilet.c.grid_cell.is_(None))
+    ).all()
+    statement = toilet.update().where(toilet.c.id == bindparam('toilet_id')).values(grid_cell=bindparam('cell'))
+    for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+        connection.execute(statement, [
+            {'toilet_id': row.id, 'cell': grid_cell(row.latitude, row.longitude)}
+            for row in rows[start:start + BACKFILL_BATCH_SIZE]
+        ])
+    return bool(rows)
+
+def _backfill_aggregates(connection):
+    # Same values as app.utils.aggregates.rebuild_aggregates, computed in one
+    # statement: the rating the toilet was added with plus all its reviews
+    def reviews_where(*conditions):
+        return (
+            select(func.count())
+            .where(review.c.toilet_id == toilet.c.id, *conditions)
+            .scalar_subquery()
+        )
+
+    def flag(condition):
+        return case((condition, 1), else_=0)
+
+    cleanliness = func.coalesce(toilet.c.cleanliness, 3)
+    buckets = [cleanliness <= 1, cleanliness == 2, cleanliness == 3, cleanliness == 4, cleanliness >= 5]
+    review_buckets = [review.c.cleanliness <= 1, review.c.cleanliness == 2, review.c.cleanliness == 3,
+                      review.c.cleanliness == 4, review.c.cleanliness >= 5]
+    values = {
+        field: flag(bucket) + reviews_where(review_bucket)
+        for field, bucket, review_bucket in zip(CLEANLINESS_FIELDS, buckets, review_buckets)
+    }
+    values['accessible_votes'] = flag(toilet.c.accessible) + reviews_where(review.c.accessible)
+    values['toilet_paper_votes'] = flag(toilet.c.has_toilet_paper) + reviews_where(review.c.has_toilet_paper)
+    values['review_count'] = reviews_where()
+    connection.execute(toilet.update().values(values))
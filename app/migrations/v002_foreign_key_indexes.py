@@ -0,0 +1,9 @@
+"""Index review.user_id, toilet.user_id and toilet coordinates"""
+from app.migrations import create_index
+
+def upgrade(connection):
+    # Loading User.reviews and User.toilets was a full table scan
+    create_index(connection, 'ix_review_user_id', 'review', ['user_id'])
+    create_index(connection, 'ix_toilet_user_id', 'toilet', ['user_id'])
+    # Bounding boxes too tall for the grid index filter on the coordinates alone
+    create_index(connection, 'ix_toilet_latitude_longitude', 'toilet', ['latitude', 'longitude'])
@@ -0,0 +1,5 @@
+"""Add the idempotency_key table for batch submissions"""
+from app import db
+
+def upgrade(connection):
+    db.metadata.tables['idempotency_key'].create(connection, checkfirst=True)
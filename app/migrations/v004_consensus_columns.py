@@ -0,0 +1,26 @@
+"""Store the median cleanliness and consensus flags of toilets and index them"""
+from sqlalchemy import column, table
+from app.migrations import add_column, create_index
+from app.models.toilet import consensus_sql
+
+COUNTER_FIELDS = ['cleanliness_1', 'cleanliness_2', 'cleanliness_3', 'cleanliness_4', 'cleanliness_5',
+                  'accessible_votes', 'toilet_paper_votes', 'review_count']
+
+# The table as of this version
+toilet = table('toilet', *[column(field) for field in COUNTER_FIELDS], column('median_cleanliness'),
+               column('accessible_consensus'), column('toilet_paper_consensus'))
+
+def upgrade(connection):
+    added = [
+        add_column(connection, 'toilet', 'median_cleanliness INTEGER NOT NULL DEFAULT 3'),
+        add_column(connection, 'toilet', 'accessible_consensus BOOLEAN NOT NULL DEFAULT 0'),
+        add_column(connection, 'toilet', 'toilet_paper_consensus BOOLEAN NOT NULL DEFAULT 0')
+    ]
+    create_index(connection, 'ix_toilet_review_count', 'toilet', ['review_count'])
+    create_index(connection, 'ix_toilet_median_cleanliness', 'toilet', ['median_cleanliness'])
+    create_index(connection, 'ix_toilet_consensus', 'toilet',
+                 ['accessible_consensus', 'toilet_paper_consensus', 'median_cleanliness'])
+    if any(added):
+        # Derived from the stored counters in one statement; the values the
+        # API returns don't change, so cached responses stay valid
+        connection.execute(toilet.update().values(consensus_sql({field: toilet.c[field] for field in COUNTER_FIELDS})))
@@ -0,0 +1,7 @@
+"""Add the full-text search table and index existing descriptions and comments"""
+from app.models.search import rebuild_search_index, search_supported
+
+def upgrade(connection):
+    # Other backends search with LIKE and need no table
+    if search_supported(connection):
+        rebuild_search_index(connection)
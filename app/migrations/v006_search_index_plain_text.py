@@ -0,0 +1,6 @@
+"""Reindex search texts unescaped, as they were typed"""
+from app.models.search import rebuild_search_index, search_supported
+
+def upgrade(connection):
+    if search_supported(connection):
+        rebuild_search_index(connection)
@@ -1,3 +1,7 @@
 from app.models.user import User
 from app.models.toilet import Toilet
-from app.models.review import Review
\ No newline at end of file
+from app.models.review import Review
+from app.models.dataset import DatasetVersion, ToiletChange
+from app.models.idempotency import IdempotencyKey
+from app.models.search import SEARCH_TABLE
+from app.models.schema import SchemaVersion
\ No newline at end of file
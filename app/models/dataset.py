@@ -0,0 +1,102 @@
+from app import db
+from datetime import datetime
+from sqlalchemy import select
+
+class DatasetVersion(db.Model):
+    # Single row counting changes to toilets and reviews, used to validate caches
+    __tablename__ = 'dataset_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Change log entries up to this version have been deleted
+    compacted_version = db.Column(db.Integer, nullable=False, default=0)
+
+class ToiletChange(db.Model):
+    # Change log: which toilets changed in which dataset version
+    __tablename__ = 'toilet_change'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, index=True)
+    toilet_id = db.Column(db.Integer, nullable=False)
+
+@db.event.listens_for(DatasetVersion.__table__, 'after_create')
+def create_version_row(table, connection, **kwargs):
+    connection.execute(table.insert().values(id=1, version=0, updated_at=datetime.utcnow(), compacted_version=0))
+
+def bump_dataset_version(connection, toilet_ids):
+    # Runs on the connection of the writing transaction, so the new version
+    # and its change log entries become visible together with the change.
+    # The row update also serializes concurrent writers, keeping versions in
+    # commit order.
+    table = DatasetVersion.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id == 1)
+        .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+    )
+    version = connection.execute(select(table.c.version).where(table.c.id == 1)).scalar()
+    if toilet_ids:
+        connection.execute(
+            ToiletChange.__table__.insert(),
+            [{'version': version, 'toilet_id': toilet_id} for toilet_id in toilet_ids]
+        )
+    return version
+
+def reset_dataset_version(connection):
+    # For bulk changes too large for the change log: bump the version and mark
+    # the log compacted up to it, so feed clients and indexes reload in full
+    table = DatasetVersion.__table__
+    version = bump_dataset_version(connection, [])
+    connection.execute(table.update().where(table.c.id == 1).values(compacted_version=version))
+    return version
+
+def get_dataset_version():
+    """Return (version, updated_at) of the current data."""
+    table = DatasetVersion.__table__
+    row = db.session.execute(select(table.c.version, table.c.updated_at).where(table.c.id == 1)).first()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at
+
+def get_changed_toilet_ids(since, limit=None):
+    """Return (version, toilet_ids) with the ids of toilets changed after
+    version `since`, or (version, None) when the log no longer reaches back
+    that far and the caller has to start over from a full load."""
+    table = DatasetVersion.__table__
+    row = db.session.execute(
+        select(table.c.version, table.c.compacted_version).where(table.c.id == 1)
+    ).first()
+    if row is None:
+        return 0, None
+    if since < row.compacted_version or since > row.version:
+        return row.version, None
+    if since == row.version:
+        return row.version, []
+
+    changes = ToiletChange.__table__
+    query = (
+        select(changes.c.toilet_id)
+        .where(changes.c.version > since, changes.c.version <= row.version)
+        .distinct()
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return row.version, db.session.execute(query).scalars().all()
+
+def compact_changes(keep_versions):
+    """Delete change log entries older than the newest keep_versions versions.
+    Returns the number of entries removed."""
+    table = DatasetVersion.__table__
+    version = db.session.execute(select(table.c.version).where(table.c.id == 1)).scalar() or 0
+    cutoff = version - keep_versions
+    if cutoff <= 0:
+        return 0
+
+    changes = ToiletChange.__table__
+    removed = db.session.execute(changes.delete().where(changes.c.version <= cutoff)).rowcount
+    db.session.execute(
+        table.update()
+        .where(table.c.id == 1, table.c.compacted_version < cutoff)
+        .values(compacted_version=cutoff)
+    )
+    db.session.commit()
+    return removed
@@ -0,0 +1,26 @@
+from app import db
+from datetime import datetime, timedelta
+
+class IdempotencyKey(db.Model):
+    # What an item of a batch submission created, so a retried submission
+    # with the same key returns the earlier result instead of a duplicate
+    __tablename__ = 'idempotency_key'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)  # 'toilet' or 'review'
+    result_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_id_key'),
+    )
+
+def prune_idempotency_keys(days):
+    """Delete keys older than the given number of days, after which clients
+    are not expected to retry. Returns the number of keys removed."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    table = IdempotencyKey.__table__
+    removed = db.session.execute(table.delete().where(table.c.created_at < cutoff)).rowcount
+    db.session.commit()
+    return removed
@@ -1,5 +1,12 @@
 from app import db
 from datetime import datetime
+from sqlalchemy import inspect
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from app.models.dataset import bump_dataset_version
+from app.models.toilet import (
+    AGGREGATE_FIELDS, CLEANLINESS_FIELDS, Toilet, add_review_to_aggregates, cleanliness_field, consensus_sql
+)
 
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -8,5 +15,41 @@ class Review(db.Model):
     cleanliness = db.Column(db.Integer, default=3)  # 1-5 stars
     comment = db.Column(db.String(200))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    toilet_id = db.Column(db.Integer, db.ForeignKey('toilet.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    toilet_id = db.Column(db.Integer, db.ForeignKey('toilet.id'), nullable=False)
+    
+    __table_args__ = (
+        # Keyset pagination of a toilet's reviews is a range scan on this index
+        db.Index('ix_review_toilet_id_id', 'toilet_id', 'id'),
+    )
+
+@db.event.listens_for(Review, 'after_insert')
+def count_review(mapper, connection, review):
+    # Fold the review into its toilet's stored aggregates with a relative
+    # UPDATE in the same transaction, so concurrent reviews never lose a vote
+    table = Toilet.__table__
+    histogram_field = cleanliness_field(review.cleanliness)
+    counters = {field: table.c[field] for field in CLEANLINESS_FIELDS}
+    counters.update({
+        histogram_field: table.c[histogram_field] + 1,
+        'accessible_votes': table.c.accessible_votes + (1 if review.accessible else 0),
+        'toilet_paper_votes': table.c.toilet_paper_votes + (1 if review.has_toilet_paper else 0),
+        'review_count': table.c.review_count + 1
+    })
+    # SET expressions see the row before the update, so the consensus
+    # columns are derived from the incremented counters
+    values = {field: counters[field] for field in (histogram_field, 'accessible_votes',
+                                                   'toilet_paper_votes', 'review_count')}
+    values.update(consensus_sql(counters))
+    connection.execute(table.update().where(table.c.id == review.toilet_id).values(values))
+    bump_dataset_version(connection, [review.toilet_id])
+    
+    # Mirror the change on a toilet already loaded in this session; expired
+    # ones will read the updated row on next access anyway
+    session = object_session(review)
+    toilet = session.identity_map.get(session.identity_key(Toilet, review.toilet_id)) if session else None
+    if toilet is not None and not inspect(toilet).unloaded.intersection(AGGREGATE_FIELDS):
+        aggregates = toilet.stored_aggregates()
+        add_review_to_aggregates(aggregates, review.cleanliness, review.accessible, review.has_toilet_paper)
+        for field, value in aggregates.items():
+            set_committed_value(toilet, field, value)
@@ -0,0 +1,54 @@
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from app import db
+
+# Version of the table layout defined by the models. Bump it together with
+# any model change and add the matching script to app.migrations, so
+# existing databases get updated by `flask db-upgrade`.
+SCHEMA_VERSION = 6
+
+class SchemaVersion(db.Model):
+    # Single row holding the SCHEMA_VERSION the database was last brought to
+    __tablename__ = 'schema_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+def get_schema_version():
+    """The database's schema version, or None for an empty database or one
+    created before schema versions were recorded."""
+    try:
+        return db.session.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+    except (OperationalError, ProgrammingError):
+        # No schema_version table yet
+        db.session.rollback()
+        return None
+
+def set_schema_version(connection, version):
+    table = SchemaVersion.__table__
+    if not connection.execute(table.update().where(table.c.id == 1).values(version=version)).rowcount:
+        connection.execute(table.insert().values(id=1, version=version))
+
+def ensure_schema():
+    """Create the tables of an empty database and bring an older one up to
+    SCHEMA_VERSION, unless SCHEMA_AUTO_UPGRADE is off and that is left to
+    `flask db-upgrade`. Returns the resulting version, 0 for an unversioned
+    database. When the schema is current this costs a single query instead of
+    create_all's per-table inspection."""
+    from app.migrations import database_is_empty, upgrade
+
+    version = get_schema_version()
+    if version == SCHEMA_VERSION:
+        return version
+    if version is not None and version > SCHEMA_VERSION:
+        # A newer release already upgraded the database, e.g. mid rolling deploy
+        current_app.logger.warning('Database schema version %s is newer than this code (%s)',
+                                   version, SCHEMA_VERSION)
+        return version
+    if not current_app.config.get('SCHEMA_AUTO_UPGRADE', True) and not database_is_empty():
+        current_app.logger.warning('Database schema version %s is older than this code (%s), '
+                                   'run "flask db-upgrade"', version or 0, SCHEMA_VERSION)
+        return version or 0
+
+    upgrade()
+    return SCHEMA_VERSION
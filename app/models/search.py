@@ -0,0 +1,122 @@
+import sqlite3
+from functools import lru_cache
+from sqlalchemy import inspect, text
+from app import db
+from app.models.review import Review
+from app.models.toilet import Toilet
+
+# FTS5 table over toilet descriptions and review comments. The rowid holds
+# the toilet id in its upper bits and the review id (0 for the description)
+# in the lower ones, so matches give their toilet without reading any
+# stored column, and a description can be replaced by rowid.
+SEARCH_TABLE = 'search_index'
+TOILET_ROWID_SHIFT = 32
+
+_CREATE_SEARCH_TABLE = text(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+    "USING fts5(body, tokenize='porter unicode61 remove_diacritics 2')"
+)
+# Stored texts are HTML-escaped (see sanitize_text) while the index holds
+# what was typed, so "bob's" matches and "39" doesn't match every
+# apostrophe. These are the entities markupsafe writes, &amp; undone last.
+_ENTITIES = (('&lt;', '<'), ('&gt;', '>'), ('&#34;', '"'), ('&#39;', "'"), ('&amp;', '&'))
+
+def _unescape(value):
+    # A plain str: Markup.replace would escape the replacement again
+    value = str(value)
+    for entity, char in _ENTITIES:
+        value = value.replace(entity, char)
+    return value
+
+def _unescape_sql(column):
+    # The same replacements in SQL, for the bulk inserts
+    for entity, char in _ENTITIES:
+        char = char.replace("'", "''")
+        column = f"replace({column}, '{entity}', '{char}')"
+    return column
+
+_INSERT = text(f'INSERT INTO {SEARCH_TABLE} (rowid, body) VALUES (:rowid, :body)')
+_DELETE = text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid')
+
+@lru_cache(maxsize=None)
+def _fts5_compiled_in():
+    # A property of the SQLite library the process loaded
+    connection = sqlite3.connect(':memory:')
+    try:
+        return bool(connection.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+    finally:
+        connection.close()
+
+def search_rowid(toilet_id, review_id=0):
+    return toilet_id << TOILET_ROWID_SHIFT | review_id
+
+def search_supported(connection):
+    """Whether the database behind `connection` has the FTS5 search table.
+    Other backends search with LIKE instead, see app.utils.search."""
+    return connection.dialect.name == 'sqlite' and _fts5_compiled_in()
+
+@db.event.listens_for(db.metadata, 'after_create')
+def create_search_table(target, connection, **kwargs):
+    if search_supported(connection):
+        connection.execute(_CREATE_SEARCH_TABLE)
+
+@db.event.listens_for(db.metadata, 'before_drop')
+def drop_search_table(target, connection, **kwargs):
+    if search_supported(connection):
+        connection.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+def rebuild_search_index(connection):
+    """Refill the search table from the toilet and review tables, e.g. after
+    bulk inserts that bypassed the mapper events. Returns the number of
+    indexed texts."""
+    connection.execute(_CREATE_SEARCH_TABLE)
+    connection.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    indexed = index_toilets_after(connection, None)
+    indexed += connection.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, body) "
+        f"SELECT toilet_id << {TOILET_ROWID_SHIFT} | id, {_unescape_sql('comment')} FROM review "
+        # In rowid order, which FTS5 appends fastest
+        "WHERE comment IS NOT NULL AND comment != '' ORDER BY toilet_id, id"
+    )).rowcount
+    # Merge the b-trees written by the bulk insert
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    return indexed
+
+def index_toilets_after(connection, toilet_id):
+    """Index the descriptions of toilets with an id above `toilet_id` (all
+    toilets for None), for bulk inserts. Returns the number indexed."""
+    query = (
+        f"INSERT INTO {SEARCH_TABLE} (rowid, body) "
+        f"SELECT id << {TOILET_ROWID_SHIFT}, {_unescape_sql('description')} FROM toilet WHERE description IS NOT NULL AND description != ''"
+    )
+    if toilet_id is None:
+        return connection.execute(text(query)).rowcount
+    return connection.execute(text(query + ' AND id > :after'), {'after': toilet_id}).rowcount
+
+def index_inserted_toilets(connection, toilets):
+    """Index the descriptions of bulk inserted toilets, given as (id,
+    description) rows. Returns the number indexed."""
+    rows = [{'rowid': search_rowid(toilet_id), 'body': _unescape(description)}
+            for toilet_id, description in toilets if description]
+    if rows:
+        connection.execute(_INSERT, rows)
+    return len(rows)
+
+@db.event.listens_for(Toilet, 'after_insert')
+def index_toilet_description(mapper, connection, toilet):
+    # Same transaction as the insert, like the aggregates and change log
+    if toilet.description and search_supported(connection):
+        connection.execute(_INSERT, {'rowid': search_rowid(toilet.id), 'body': _unescape(toilet.description)})
+
+@db.event.listens_for(Toilet, 'after_update')
+def reindex_toilet_description(mapper, connection, toilet):
+    if not search_supported(connection) or not inspect(toilet).attrs.description.history.has_changes():
+        return
+    connection.execute(_DELETE, {'rowid': search_rowid(toilet.id)})
+    if toilet.description:
+        connection.execute(_INSERT, {'rowid': search_rowid(toilet.id), 'body': _unescape(toilet.description)})
+
+@db.event.listens_for(Review, 'after_insert')
+def index_review_comment(mapper, connection, review):
+    if review.comment and search_supported(connection):
+        connection.execute(_INSERT, {'rowid': search_rowid(review.toilet_id, review.id), 'body': _unescape(review.comment)})
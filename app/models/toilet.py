@@ -1,6 +1,20 @@
+import math
 from app import db
 from datetime import datetime
-from statistics import median
+from sqlalchemy import and_, case, or_
+from app.models.dataset import bump_dataset_version
+from app.utils.geo import grid_cell, grid_cell_ranges, split_bbox
+
+DEFAULT_CLEANLINESS = 3
+
+# Stored rating aggregates: a 1-5 cleanliness histogram plus yes-vote and
+# review counters. The histogram and votes include the rating given when the
+# toilet was added, review_count does not. The consensus fields are derived
+# from the counters and stored so they can be filtered and sorted on in SQL.
+CLEANLINESS_FIELDS = ['cleanliness_1', 'cleanliness_2', 'cleanliness_3', 'cleanliness_4', 'cleanliness_5']
+COUNTER_FIELDS = CLEANLINESS_FIELDS + ['accessible_votes', 'toilet_paper_votes', 'review_count']
+CONSENSUS_FIELDS = ['median_cleanliness', 'accessible_consensus', 'toilet_paper_consensus']
+AGGREGATE_FIELDS = COUNTER_FIELDS + CONSENSUS_FIELDS
 
 class Toilet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,33 +23,177 @@ class Toilet(db.Model):
     description = db.Column(db.String(200))
     accessible = db.Column(db.Boolean, default=False)
     has_toilet_paper = db.Column(db.Boolean, default=False)
-    cleanliness = db.Column(db.Integer, default=3)  # 1-5 stars
+    cleanliness = db.Column(db.Integer, default=DEFAULT_CLEANLINESS)  # 1-5 stars
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    grid_cell = db.Column(db.Integer, index=True)  # Spatial index cell, see app.utils.geo
+    cleanliness_1 = db.Column(db.Integer, nullable=False, default=0)
+    cleanliness_2 = db.Column(db.Integer, nullable=False, default=0)
+    cleanliness_3 = db.Column(db.Integer, nullable=False, default=0)
+    cleanliness_4 = db.Column(db.Integer, nullable=False, default=0)
+    cleanliness_5 = db.Column(db.Integer, nullable=False, default=0)
+    accessible_votes = db.Column(db.Integer, nullable=False, default=0)
+    toilet_paper_votes = db.Column(db.Integer, nullable=False, default=0)
+    review_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    median_cleanliness = db.Column(db.Integer, nullable=False, default=DEFAULT_CLEANLINESS, index=True)
+    accessible_consensus = db.Column(db.Boolean, nullable=False, default=False)
+    toilet_paper_consensus = db.Column(db.Boolean, nullable=False, default=False)
     reviews = db.relationship('Review', backref='toilet', lazy=True)
     
-    def get_median_cleanliness(self):
-        all_ratings = [self.cleanliness]  # Include initial rating
+    __table_args__ = (
+        # Bounding boxes too tall for the grid index filter on the coordinates alone
+        db.Index('ix_toilet_latitude_longitude', 'latitude', 'longitude'),
+        # Attribute filters of the toilet list: flags by equality, then a cleanliness range
+        db.Index('ix_toilet_consensus', 'accessible_consensus', 'toilet_paper_consensus', 'median_cleanliness'),
+    )
+    
+    @classmethod
+    def in_bbox(cls, min_lng, min_lat, max_lng, max_lat):
+        # SQL condition selecting toilets inside a bounding box through the grid_cell index
+        conditions = []
+        for box in split_bbox(min_lng, min_lat, max_lng, max_lat):
+            west, south, east, north = box
+            exact = and_(cls.latitude.between(south, north), cls.longitude.between(west, east))
+            ranges = grid_cell_ranges(west, south, east, north)
+            if ranges is None:
+                conditions.append(exact)
+            else:
+                cells = or_(*[cls.grid_cell.between(first, last) for first, last in ranges])
+                conditions.append(and_(cells, exact))
+        return or_(*conditions)
+    
+    @classmethod
+    def distance_order(cls, lat, lng):
+        # SQL expression ordering toilets by distance from a point: squared
+        # equirectangular distance in degrees, which follows great-circle
+        # order closely at city scale and needs no math functions in SQLite
+        scale = math.cos(math.radians(lat))
+        dlat = cls.latitude - lat
+        dlng = (cls.longitude - lng) * scale
+        return dlat * dlat + dlng * dlng
+    
+    def stored_aggregates(self):
+        return {field: getattr(self, field) or 0 for field in AGGREGATE_FIELDS}
+    
+    def compute_aggregates(self):
+        # Full recompute from the initial rating and every review
+        aggregates = initial_aggregates(self.cleanliness, self.accessible, self.has_toilet_paper)
         for review in self.reviews:
-            all_ratings.append(review.cleanliness)
-        return int(median(all_ratings))
+            add_review_to_aggregates(aggregates, review.cleanliness, review.accessible, review.has_toilet_paper)
+        return aggregates
+    
+    def rebuild_aggregates(self):
+        for field, value in self.compute_aggregates().items():
+            setattr(self, field, value)
+    
+    def _aggregates(self):
+        aggregates = self.stored_aggregates()
+        # Rows created before aggregates were stored have an empty histogram until rebuilt
+        if not any(aggregates[field] for field in CLEANLINESS_FIELDS):
+            return self.compute_aggregates()
+        return aggregates
+    
+    def get_review_count(self):
+        return self._aggregates()['review_count']
+    
+    def get_median_cleanliness(self):
+        return self._aggregates()['median_cleanliness']
     
     def get_accessibility_consensus(self):
-        # Count votes for accessibility
-        yes_votes = 1 if self.accessible else 0
-        for review in self.reviews:
-            if review.accessible:
-                yes_votes += 1
-        
         # If more than half of all reviews (including initial) say it's accessible, consider it accessible
-        return yes_votes >= (len(self.reviews) + 1) / 2
+        return bool(self._aggregates()['accessible_consensus'])
     
     def get_toilet_paper_consensus(self):
-        # Count votes for toilet paper
-        yes_votes = 1 if self.has_toilet_paper else 0
-        for review in self.reviews:
-            if review.has_toilet_paper:
-                yes_votes += 1
-        
         # If more than half of all reviews (including initial) say it has toilet paper, consider it has toilet paper
-        return yes_votes >= (len(self.reviews) + 1) / 2
\ No newline at end of file
+        return bool(self._aggregates()['toilet_paper_consensus'])
+
+def initial_aggregates(cleanliness, accessible, has_toilet_paper):
+    # Aggregates of a toilet without reviews, counting the rating it was added with
+    aggregates = {field: 0 for field in COUNTER_FIELDS}
+    add_review_to_aggregates(aggregates, cleanliness, accessible, has_toilet_paper)
+    aggregates['review_count'] = 0
+    return update_consensus(aggregates)
+
+def add_review_to_aggregates(aggregates, cleanliness, accessible, has_toilet_paper):
+    aggregates[cleanliness_field(cleanliness)] += 1
+    aggregates['accessible_votes'] += 1 if accessible else 0
+    aggregates['toilet_paper_votes'] += 1 if has_toilet_paper else 0
+    aggregates['review_count'] += 1
+    update_consensus(aggregates)
+
+def update_consensus(aggregates):
+    # Derive the consensus fields from the counters, in place
+    aggregates['median_cleanliness'] = median_from_histogram([aggregates[field] for field in CLEANLINESS_FIELDS])
+    aggregates['accessible_consensus'] = majority_vote(aggregates['accessible_votes'], aggregates['review_count'])
+    aggregates['toilet_paper_consensus'] = majority_vote(aggregates['toilet_paper_votes'], aggregates['review_count'])
+    return aggregates
+
+def cleanliness_field(cleanliness):
+    return CLEANLINESS_FIELDS[min(max(int(cleanliness), 1), 5) - 1]
+
+def majority_vote(votes, review_count):
+    # Votes come from the reviews plus the rating the toilet was added with
+    return votes >= (review_count + 1) / 2
+
+def median_from_histogram(histogram):
+    # Same result as int(median(ratings)) without materializing the ratings
+    total = sum(histogram)
+    if not total:
+        return DEFAULT_CLEANLINESS
+    
+    def rating_at(position):
+        seen = 0
+        for rating, count in enumerate(histogram, start=1):
+            seen += count
+            if position < seen:
+                return rating
+    
+    return int((rating_at((total - 1) // 2) + rating_at(total // 2)) / 2)
+
+def consensus_sql(counters):
+    """SQL expressions for the consensus fields, computed like
+    update_consensus from column expressions of the counters. Used by
+    relative UPDATEs, which must derive them from the row being updated."""
+    histogram = [counters[field] for field in CLEANLINESS_FIELDS]
+    total = sum(histogram[1:], histogram[0])
+    
+    def rating_at(position):
+        seen = 0
+        whens = []
+        for rating, count in enumerate(histogram[:-1], start=1):
+            seen = count if rating == 1 else seen + count
+            whens.append((position < seen, rating))
+        return case(*whens, else_=len(histogram))
+    
+    median = case((total == 0, DEFAULT_CLEANLINESS), else_=(rating_at((total - 1) // 2) + rating_at(total // 2)) // 2)
+    return {
+        'median_cleanliness': median,
+        'accessible_consensus': counters['accessible_votes'] * 2 >= counters['review_count'] + 1,
+        'toilet_paper_consensus': counters['toilet_paper_votes'] * 2 >= counters['review_count'] + 1
+    }
+
+@db.event.listens_for(Toilet, 'before_insert')
+@db.event.listens_for(Toilet, 'before_update')
+def update_grid_cell(mapper, connection, toilet):
+    # Keep the spatial index column in sync with the coordinates
+    toilet.grid_cell = grid_cell(toilet.latitude, toilet.longitude)
+
+@db.event.listens_for(Toilet, 'before_insert')
+def init_aggregates(mapper, connection, toilet):
+    # Apply the column defaults now so the aggregates can count the initial rating
+    if toilet.cleanliness is None:
+        toilet.cleanliness = DEFAULT_CLEANLINESS
+    if toilet.accessible is None:
+        toilet.accessible = False
+    if toilet.has_toilet_paper is None:
+        toilet.has_toilet_paper = False
+    
+    if toilet.review_count is None:
+        aggregates = initial_aggregates(toilet.cleanliness, toilet.accessible, toilet.has_toilet_paper)
+        for field, value in aggregates.items():
+            setattr(toilet, field, value)
+
+@db.event.listens_for(Toilet, 'after_insert')
+@db.event.listens_for(Toilet, 'after_update')
+def toilet_changed(mapper, connection, toilet):
+    bump_dataset_version(connection, [toilet.id])
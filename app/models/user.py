@@ -1,5 +1,5 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.utils.password_hashing import hash_password, password_needs_rehash, verify_password
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,7 +10,10 @@ class User(db.Model):
     reviews = db.relationship('Review', backref='author', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
\ No newline at end of file
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return password_needs_rehash(self.password_hash)
\ No newline at end of file
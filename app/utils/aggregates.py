@@ -0,0 +1,82 @@
+from sqlalchemy import bindparam, case, func, select
+from app import db
+from app.models.toilet import AGGREGATE_FIELDS, COUNTER_FIELDS, Toilet, initial_aggregates, update_consensus
+from app.models.review import Review
+from app.models.dataset import bump_dataset_version
+
+# Toilets updated per statement/transaction when rebuilding
+REBUILD_BATCH_SIZE = 1000
+
+def _recomputed_rows():
+    # Stream every toilet with its stored aggregates next to a from-scratch
+    # recompute, using one grouped pass over the review table
+    toilet = Toilet.__table__
+    review = Review.__table__
+    counts = [
+        func.sum(case((review.c.cleanliness <= 1, 1), else_=0)).label('cleanliness_1'),
+        func.sum(case((review.c.cleanliness == 2, 1), else_=0)).label('cleanliness_2'),
+        func.sum(case((review.c.cleanliness == 3, 1), else_=0)).label('cleanliness_3'),
+        func.sum(case((review.c.cleanliness == 4, 1), else_=0)).label('cleanliness_4'),
+        func.sum(case((review.c.cleanliness >= 5, 1), else_=0)).label('cleanliness_5'),
+        func.sum(case((review.c.accessible, 1), else_=0)).label('accessible_votes'),
+        func.sum(case((review.c.has_toilet_paper, 1), else_=0)).label('toilet_paper_votes'),
+        func.count().label('review_count')
+    ]
+    grouped = select(review.c.toilet_id, *counts).group_by(review.c.toilet_id).subquery()
+
+    query = (
+        select(toilet.c.id, toilet.c.cleanliness, toilet.c.accessible, toilet.c.has_toilet_paper,
+               *[toilet.c[field].label('stored_' + field) for field in AGGREGATE_FIELDS],
+               *[grouped.c[field] for field in COUNTER_FIELDS])
+        .outerjoin(grouped, grouped.c.toilet_id == toilet.c.id)
+        .order_by(toilet.c.id)
+    )
+
+    for row in db.session.execute(query.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        expected = initial_aggregates(
+            row.cleanliness if row.cleanliness is not None else 3,
+            row.accessible, row.has_toilet_paper
+        )
+        for field in COUNTER_FIELDS:
+            expected[field] += getattr(row, field) or 0
+        update_consensus(expected)
+        stored = {field: getattr(row, 'stored_' + field) or 0 for field in AGGREGATE_FIELDS}
+        yield row.id, stored, expected
+
+def rebuild_aggregates():
+    """Recompute the stored aggregates of every toilet. Returns the number of
+    toilets whose stored values changed."""
+    table = Toilet.__table__
+    statement = (
+        table.update()
+        .where(table.c.id == bindparam('toilet_id'))
+        .values({field: bindparam(field) for field in AGGREGATE_FIELDS})
+    )
+
+    # Materialize the changes first so the updates don't run under an open cursor
+    changes = [
+        dict(expected, toilet_id=toilet_id)
+        for toilet_id, stored, expected in _recomputed_rows()
+        if stored != expected
+    ]
+    for start in range(0, len(changes), REBUILD_BATCH_SIZE):
+        batch = changes[start:start + REBUILD_BATCH_SIZE]
+        db.session.execute(statement, batch)
+        bump_dataset_version(db.session.connection(), [change['toilet_id'] for change in batch])
+        db.session.commit()
+    return len(changes)
+
+def check_aggregates():
+    """Compare stored aggregates against a full recompute. Returns a list of
+    (toilet_id, stored, expected) for every toilet that disagrees."""
+    return [
+        (toilet_id, stored, expected)
+        for toilet_id, stored, expected in _recomputed_rows()
+        if stored != expected
+    ]
+
+def describe_mismatch(stored, expected):
+    return ', '.join(
+        f'{field} {stored[field]} != {expected[field]}'
+        for field in AGGREGATE_FIELDS if stored[field] != expected[field]
+    )
@@ -0,0 +1,59 @@
+import threading
+from flask import Flask
+
+SWAGGER_TEMPLATE = {
+    "swagger": "2.0",
+    "info": {
+        "title": "Toilet Finder API",
+        "description": "API documentation for public toilet data",
+        "version": "1.0"
+    },
+    "basePath": "/",
+    "schemes": ["http"]
+}
+
+# Paths served by flasgger's views
+API_DOCS_PREFIXES = ('/apidocs', '/apispec_1.json', '/flasgger_static/', '/oauth2-redirect.html')
+
+def build_docs_app(app):
+    """A Flask app serving the Swagger UI and spec for `app`'s views."""
+    from flasgger import Swagger
+
+    docs_app = Flask(app.import_name)
+    docs_app.config['SWAGGER'] = app.config.get('SWAGGER', {})
+    docs_app.debug = app.debug
+    Swagger(docs_app, template=SWAGGER_TEMPLATE)
+    # The spec is generated from the docstrings of the view functions in the url map
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint != 'static' and rule.endpoint not in docs_app.view_functions:
+            docs_app.add_url_rule(rule.rule, rule.endpoint, app.view_functions[rule.endpoint],
+                                  methods=rule.methods)
+    return docs_app
+
+class LazyApiDocs:
+    """WSGI middleware routing API doc requests to a docs app that is only
+    built on the first such request, so starting a worker neither imports
+    flasgger nor registers its views."""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._docs_app = None
+        self._lock = threading.Lock()
+
+    @property
+    def docs_app(self):
+        if self._docs_app is None:
+            with self._lock:
+                if self._docs_app is None:
+                    self._docs_app = build_docs_app(self.app)
+        return self._docs_app
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(API_DOCS_PREFIXES):
+            return self.docs_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+def init_api_docs(app):
+    if app.config.get('API_DOCS', True):
+        app.wsgi_app = LazyApiDocs(app)
@@ -0,0 +1,180 @@
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.idempotency import IdempotencyKey
+from app.models.review import Review
+from app.models.toilet import Toilet
+from app.utils.toilet_index import reindex_toilets
+from app.utils.validators import MAX_ID, sanitize_text, validate_cleanliness, validate_coordinates
+
+# Largest number of items one batch request may carry
+MAX_BATCH_ITEMS = 500
+MAX_KEY_LENGTH = 64
+ITEM_TYPES = ('toilet', 'review')
+
+class _Item:
+    __slots__ = ('index', 'type', 'key', 'values', 'toilet_id', 'toilet_key', 'result')
+
+    def __init__(self, index, raw):
+        self.index = index
+        self.type = raw.get('type') if isinstance(raw, dict) else None
+        self.key = raw.get('key') if isinstance(raw, dict) else None
+        self.values = None
+        self.toilet_id = None
+        self.toilet_key = None
+        self.result = None
+
+    def finish(self, status, result_id=None, error=None):
+        self.result = {'index': self.index, 'type': self.type, 'key': self.key, 'status': status}
+        if result_id is not None:
+            self.result['id'] = result_id
+        if error is not None:
+            self.result['error'] = error
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError("accessible and has_toilet_paper must be true or false")
+    return value
+
+def _validate(item, raw):
+    # Same rules as the add_toilet and add_review forms
+    if not isinstance(raw, dict):
+        raise ValueError("Item must be an object")
+    if item.type not in ITEM_TYPES:
+        raise ValueError(f"type must be one of {', '.join(ITEM_TYPES)}")
+    if item.key is not None and not (isinstance(item.key, str) and 0 < len(item.key) <= MAX_KEY_LENGTH):
+        raise ValueError(f"key must be a string of 1 to {MAX_KEY_LENGTH} characters")
+
+    values = {
+        'accessible': _flag(raw.get('accessible', False)),
+        'has_toilet_paper': _flag(raw.get('has_toilet_paper', False)),
+        'cleanliness': validate_cleanliness(raw.get('cleanliness'))
+    }
+    if item.type == 'toilet':
+        values['latitude'], values['longitude'] = validate_coordinates(raw.get('latitude'), raw.get('longitude'))
+        description = raw.get('description')
+        values['description'] = sanitize_text(description) if isinstance(description, str) else ''
+        if not values['description']:
+            raise ValueError("Description is required")
+    else:
+        comment = raw.get('comment') or ''
+        if not isinstance(comment, str):
+            raise ValueError("comment must be a string")
+        values['comment'] = sanitize_text(comment)
+        # Either an existing toilet, or one created by an earlier item (of
+        # this or a previous batch) with the given key
+        item.toilet_key = raw.get('toilet_key')
+        if item.toilet_key is None:
+            item.toilet_id = raw.get('toilet_id')
+            if isinstance(item.toilet_id, bool) or not isinstance(item.toilet_id, int):
+                raise ValueError("toilet_id must be an integer, or toilet_key the key of a toilet item")
+            if not 1 <= item.toilet_id <= MAX_ID:
+                raise ValueError("toilet_id is out of range")
+        elif not isinstance(item.toilet_key, str):
+            raise ValueError("toilet_key must be a string")
+    item.values = values
+
+def _process(user_id, raw_items):
+    items = [_Item(index, raw) for index, raw in enumerate(raw_items)]
+    for item, raw in zip(items, raw_items):
+        try:
+            _validate(item, raw)
+        except ValueError as e:
+            item.finish('invalid', error=str(e))
+    pending = [item for item in items if item.result is None]
+
+    # Keys used before, in one query
+    keys = {item.key for item in pending if item.key} | {item.toilet_key for item in pending if item.toilet_key}
+    stored = {}
+    if keys:
+        stored = {
+            row.key: row for row in db.session.execute(
+                select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key.in_(keys))
+            ).scalars()
+        }
+
+    first_with_key = {}
+    to_insert = []
+    for item in pending:
+        if item.key in stored:
+            previous = stored[item.key]
+            if previous.kind != item.type:
+                item.finish('invalid', error=f"key was already used for a {previous.kind}")
+            else:
+                item.finish('duplicate', previous.result_id)
+        elif item.key and item.key in first_with_key:
+            # Filled in once the first item with this key has its id
+            continue
+        else:
+            if item.key:
+                first_with_key[item.key] = item
+            to_insert.append(item)
+
+    # Referenced toilets: new ones of this batch, or existing ids checked in one query
+    new_toilets = {item.key: item for item in to_insert if item.type == 'toilet' and item.key}
+    reviews = [item for item in to_insert if item.type == 'review']
+    for item in reviews:
+        if item.toilet_key is not None:
+            stored_toilet = stored.get(item.toilet_key)
+            if stored_toilet is not None and stored_toilet.kind == 'toilet':
+                item.toilet_id = stored_toilet.result_id
+            elif item.toilet_key not in new_toilets:
+                item.finish('not_found', error="No toilet item with this toilet_key")
+    wanted = {item.toilet_id for item in reviews if item.result is None and item.toilet_id is not None}
+    existing = set()
+    if wanted:
+        existing = set(db.session.execute(select(Toilet.id).where(Toilet.id.in_(wanted))).scalars())
+    for item in reviews:
+        if item.result is None and item.toilet_id is not None and item.toilet_id not in existing:
+            item.finish('not_found', error="Toilet not found")
+    to_insert = [item for item in to_insert if item.result is None]
+
+    # Toilets first so reviews of new toilets know their ids; one transaction
+    toilets = {}
+    for item in to_insert:
+        if item.type == 'toilet':
+            toilets[item.index] = Toilet(user_id=user_id, **item.values)
+    db.session.add_all(toilets.values())
+    db.session.flush()
+    rows = dict(toilets)
+    for item in to_insert:
+        if item.type == 'review':
+            if item.toilet_id is None:
+                item.toilet_id = toilets[new_toilets[item.toilet_key].index].id
+            rows[item.index] = Review(user_id=user_id, toilet_id=item.toilet_id, **item.values)
+    db.session.add_all(rows[item.index] for item in to_insert if item.type == 'review')
+    db.session.flush()
+
+    for item in to_insert:
+        result_id = rows[item.index].id
+        item.finish('created', result_id)
+        if item.key:
+            db.session.add(IdempotencyKey(user_id=user_id, key=item.key, kind=item.type, result_id=result_id))
+    db.session.commit()
+
+    for item in items:
+        if item.result is None:
+            first = first_with_key[item.key]
+            if first.result['status'] == 'created' and first.type == item.type:
+                item.finish('duplicate', first.result['id'])
+            else:
+                item.finish('invalid', error="key was already used by an earlier item")
+
+    changed = {item.toilet_id for item in to_insert if item.type == 'review'}
+    changed.update(toilet.id for toilet in toilets.values())
+    return [item.result for item in items], changed
+
+def submit_batch(user_id, raw_items):
+    """Validate and insert a list of toilet and review submissions in one
+    transaction. Returns a result per item, in order, with status
+    'created', 'duplicate' (the key was seen before; carries the earlier
+    id), 'invalid' or 'not_found'."""
+    try:
+        results, changed = _process(user_id, raw_items)
+    except IntegrityError:
+        # A concurrent retry stored one of the keys first; the rerun
+        # reports those items as duplicates
+        db.session.rollback()
+        results, changed = _process(user_id, raw_items)
+    reindex_toilets(changed)
+    return results
@@ -0,0 +1,117 @@
+import math
+import threading
+from app.utils.geo import split_bbox
+
+# Toilets are clustered on a grid of 64x64 pixel cells of the Web Mercator
+# tiles Leaflet draws, for every zoom level up to MAX_CLUSTER_ZOOM. Each
+# cell at zoom z is exactly four cells at zoom z + 1, so the levels form a
+# quadtree-like hierarchy.
+TILE_SIZE = 256
+CLUSTER_CELL_PIXELS = 64
+MAX_CLUSTER_ZOOM = 14
+MAX_MERCATOR_LAT = 85.05112878
+
+def cells_per_axis(zoom):
+    return (TILE_SIZE // CLUSTER_CELL_PIXELS) * 2 ** zoom
+
+def cell_for(lat, lng, zoom):
+    cells = cells_per_axis(zoom)
+    lat = max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180) / 360
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(int(x * cells), 0), cells - 1), min(max(int(y * cells), 0), cells - 1)
+
+class _Cluster:
+    __slots__ = ('count', 'lat_sum', 'lng_sum', 'cleanliness', 'accessible')
+
+    def __init__(self):
+        self.count = 0
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+        self.cleanliness = [0] * 6  # Toilets per median rating 1-5
+        self.accessible = 0
+
+    def apply(self, entry, sign):
+        lat, lng, cleanliness, accessible = entry
+        self.count += sign
+        self.lat_sum += sign * lat
+        self.lng_sum += sign * lng
+        self.cleanliness[cleanliness] += sign
+        self.accessible += sign if accessible else 0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'latitude': self.lat_sum / self.count,
+            'longitude': self.lng_sum / self.count,
+            'best_cleanliness': max(rating for rating in range(1, 6) if self.cleanliness[rating]),
+            'any_accessible': self.accessible > 0
+        }
+
+class ClusterIndex:
+    """Per-zoom grid clusters of all toilets, updated incrementally.
+
+    Clusters keep counts rather than members, so a toilet whose rating
+    changes is subtracted with its old values and added back with the new."""
+
+    def __init__(self, max_zoom=MAX_CLUSTER_ZOOM):
+        self.max_zoom = max_zoom
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._levels = [{} for _ in range(self.max_zoom + 1)]
+        self._entries = {}
+
+    def _apply(self, entry, sign):
+        lat, lng = entry[0], entry[1]
+        for zoom, level in enumerate(self._levels):
+            cell = cell_for(lat, lng, zoom)
+            cluster = level.get(cell)
+            if cluster is None:
+                cluster = level[cell] = _Cluster()
+            cluster.apply(entry, sign)
+            if cluster.count == 0:
+                del level[cell]
+
+    def load(self, items):
+        # items: iterable of (key, lat, lng, cleanliness, accessible)
+        with self._lock:
+            self._reset()
+            for key, *entry in items:
+                entry = tuple(entry)
+                self._entries[key] = entry
+                self._apply(entry, 1)
+
+    def add(self, key, lat, lng, cleanliness, accessible):
+        # Inserts a new toilet or replaces the values of a known one
+        entry = (lat, lng, cleanliness, accessible)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous == entry:
+                return
+            if previous is not None:
+                self._apply(previous, -1)
+            self._entries[key] = entry
+            self._apply(entry, 1)
+
+    def clusters(self, zoom, min_lng=-180.0, min_lat=-90.0, max_lng=180.0, max_lat=90.0):
+        zoom = min(zoom, self.max_zoom)
+        results = []
+        with self._lock:
+            level = self._levels[zoom]
+            for west, south, east, north in split_bbox(min_lng, min_lat, max_lng, max_lat):
+                first_x, first_y = cell_for(north, west, zoom)
+                last_x, last_y = cell_for(south, east, zoom)
+                area = (last_x - first_x + 1) * (last_y - first_y + 1)
+                # Walk whichever is smaller: the cells in view or the occupied cells
+                if area <= len(level):
+                    cells = ((x, y) for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1))
+                    results.extend(level[cell].to_dict() for cell in cells if cell in level)
+                else:
+                    results.extend(
+                        cluster.to_dict() for (x, y), cluster in level.items()
+                        if first_x <= x <= last_x and first_y <= y <= last_y
+                    )
+        return results
@@ -0,0 +1,82 @@
+from app.utils.geo import grid_cell
+
+# Coordinates are sent as integers in units of 1e-5 degrees (about 1 meter)
+COORDINATE_SCALE = 100000
+
+# Bit layout of the per-toilet flags byte
+CLEANLINESS_MASK = 0b111
+ACCESSIBLE_FLAG = 1 << 3
+TOILET_PAPER_FLAG = 1 << 4
+
+def _deltas(values):
+    previous = 0
+    encoded = []
+    for value in values:
+        encoded.append(value - previous)
+        previous = value
+    return encoded
+
+def encode_compact(toilets, ordered=False):
+    """Turn serialized toilets (as in the /api/toilets list) into a columnar
+    payload: parallel arrays, delta-encoded fixed-point coordinates and ids,
+    one flags byte per toilet and de-duplicated author names, plus
+    distance_km when the toilets carry it.
+
+    Toilets are ordered by spatial grid cell first so that neighbouring
+    entries are close on the map and their coordinate deltas stay small,
+    unless `ordered` says their order matters (a distance or rating sort)."""
+    if not ordered:
+        toilets = sorted(toilets, key=lambda t: (grid_cell(t['latitude'], t['longitude']), t['id']))
+
+    authors = {}
+    author_indexes = []
+    flags = []
+    for toilet in toilets:
+        author_indexes.append(authors.setdefault(toilet['author'], len(authors)))
+        flags.append(
+            (toilet['cleanliness'] & CLEANLINESS_MASK)
+            | (ACCESSIBLE_FLAG if toilet['accessible'] else 0)
+            | (TOILET_PAPER_FLAG if toilet['has_toilet_paper'] else 0)
+        )
+
+    payload = {
+        'format': 'compact',
+        'count': len(toilets),
+        'scale': COORDINATE_SCALE,
+        'id': _deltas(toilet['id'] for toilet in toilets),
+        'latitude': _deltas(round(toilet['latitude'] * COORDINATE_SCALE) for toilet in toilets),
+        'longitude': _deltas(round(toilet['longitude'] * COORDINATE_SCALE) for toilet in toilets),
+        'flags': flags,
+        'review_count': [toilet['review_count'] for toilet in toilets],
+        'description': [toilet['description'] for toilet in toilets],
+        'authors': list(authors),
+        'author': author_indexes
+    }
+    if any('distance_km' in toilet for toilet in toilets):
+        payload['distance_km'] = [toilet['distance_km'] for toilet in toilets]
+    return payload
+
+def decode_compact(payload):
+    """Inverse of encode_compact, mirroring the decoder in main.html."""
+    toilets = []
+    toilet_id = lat = lng = 0
+    scale = payload['scale']
+    for i in range(payload['count']):
+        toilet_id += payload['id'][i]
+        lat += payload['latitude'][i]
+        lng += payload['longitude'][i]
+        flags = payload['flags'][i]
+        toilets.append({
+            'id': toilet_id,
+            'latitude': lat / scale,
+            'longitude': lng / scale,
+            'description': payload['description'][i],
+            'accessible': bool(flags & ACCESSIBLE_FLAG),
+            'has_toilet_paper': bool(flags & TOILET_PAPER_FLAG),
+            'cleanliness': flags & CLEANLINESS_MASK,
+            'review_count': payload['review_count'][i],
+            'author': payload['authors'][payload['author'][i]]
+        })
+        if 'distance_km' in payload:
+            toilets[-1]['distance_km'] = payload['distance_km'][i]
+    return toilets
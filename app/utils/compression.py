@@ -0,0 +1,127 @@
+import gzip
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+# Text formats worth compressing. PNG/WebP marker images are already
+# deflate/VP8 compressed and shrink by under 1%, so they are left alone.
+# HTML pages embed the CSRF token next to reflected input, so they are not
+# compressed either (BREACH).
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/geo+json',
+    'application/x-ndjson',
+    'application/javascript',
+    'text/javascript',
+    'text/css',
+    'text/plain',
+    'image/svg+xml'
+}
+
+def _gzip(body, level):
+    return gzip.compress(body, compresslevel=level)
+
+def _brotli(body, level):
+    return brotli.compress(body, quality=level)
+
+class CompressedBodyCache:
+    """LRU of compressed bodies keyed by (ETag, encoding), bounded in bytes.
+
+    Only responses with an ETag are cached: the ETag changes whenever the
+    body does (dataset version for the API, file mtime/size for static
+    files), so a cached entry can never be stale."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, old_body = self._entries.popitem(last=False)
+                self._size -= len(old_body)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._size}
+
+def choose_encoding(accept_encodings, available):
+    # Highest client quality wins; ties go to the server's preference order
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def init_compression(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    compressors = {}
+    if brotli is not None and app.config.get('COMPRESS_BROTLI', True):
+        compressors['br'] = (_brotli, app.config.get('COMPRESS_BROTLI_LEVEL', 5))
+    compressors['gzip'] = (_gzip, app.config.get('COMPRESS_GZIP_LEVEL', 6))
+
+    cache = CompressedBodyCache(app.config.get('COMPRESS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    app.extensions['compression_cache'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if (not app.config.get('COMPRESS_RESPONSES', True)
+                or response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'Content-Encoding' in response.headers
+                or (response.is_streamed and not response.direct_passthrough)):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings, compressors)
+        if encoding is None:
+            return response
+
+        # Static files are sent as file wrappers; read them so they can be compressed
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (etag, encoding) if etag else None
+        compressed = cache.get(key) if key else None
+        if compressed is None:
+            compress, level = compressors[encoding]
+            compressed = compress(body, level)
+            if key:
+                cache.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # The encoded bytes differ from the identity ones, so only a weak
+            # validator still holds; If-None-Match compares weakly anyway
+            response.set_etag(etag, weak=True)
+        return response
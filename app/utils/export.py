@@ -0,0 +1,79 @@
+import json
+from sqlalchemy import select
+from app import db
+from app.models.toilet import AGGREGATE_FIELDS, CLEANLINESS_FIELDS, Toilet
+from app.models.user import User
+
+# Rows fetched per round trip, and serialized per chunk of output
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = ('ndjson', 'geojson')
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'geojson': 'application/geo+json'
+}
+
+def _export_query():
+    toilet = Toilet.__table__
+    user = User.__table__
+    return (
+        select(toilet.c.id, toilet.c.latitude, toilet.c.longitude, toilet.c.description,
+               *[toilet.c[field] for field in AGGREGATE_FIELDS], user.c.username)
+        .outerjoin(user, user.c.id == toilet.c.user_id)
+        .order_by(toilet.c.id)
+    )
+
+def _serialize_row(row):
+    # Same fields as the /api/toilets list, computed from the stored columns
+    aggregates = {field: row._mapping[field] for field in AGGREGATE_FIELDS}
+    if not any(aggregates[field] for field in CLEANLINESS_FIELDS):
+        # Legacy row that `flask rebuild-aggregates` has not filled in yet
+        aggregates = db.session.get(Toilet, row.id).compute_aggregates()
+    return {
+        'id': row.id,
+        'latitude': row.latitude,
+        'longitude': row.longitude,
+        'description': row.description,
+        'accessible': bool(aggregates['accessible_consensus']),
+        'has_toilet_paper': bool(aggregates['toilet_paper_consensus']),
+        'cleanliness': aggregates['median_cleanliness'],
+        'review_count': aggregates['review_count'],
+        'author': row.username or 'Unknown'
+    }
+
+def iter_toilets(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of serialized toilets, chunk_size at a time, from a single
+    streamed query. Only one chunk of rows is held in memory at any time."""
+    result = db.session.execute(_export_query().execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        yield [_serialize_row(row) for row in rows]
+
+def _geojson_feature(toilet):
+    properties = dict(toilet)
+    longitude = properties.pop('longitude')
+    latitude = properties.pop('latitude')
+    return {
+        'type': 'Feature',
+        'id': toilet['id'],
+        'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+        'properties': properties
+    }
+
+def export_toilets(output_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the whole toilet table as NDJSON lines or as one GeoJSON
+    FeatureCollection, one string per chunk of rows."""
+    if output_format == 'ndjson':
+        for chunk in iter_toilets(chunk_size):
+            yield ''.join(_encoder.encode(toilet) + '\n' for toilet in chunk)
+        return
+
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    for chunk in iter_toilets(chunk_size):
+        features = ','.join(_encoder.encode(_geojson_feature(toilet)) for toilet in chunk)
+        yield separator + features
+        separator = ','
+    yield ']}\n'
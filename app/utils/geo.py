@@ -0,0 +1,79 @@
+import math
+from app.utils.validators import validate_coordinates
+
+# Size of one spatial index cell in degrees (roughly 1km at the equator)
+GRID_CELL_SIZE = 0.01
+GRID_ROWS = int(round(180 / GRID_CELL_SIZE))
+GRID_COLUMNS = int(round(360 / GRID_CELL_SIZE))
+
+# Bounding boxes spanning more grid rows than this are answered with a plain
+# coordinate range scan instead of one index range per row
+MAX_GRID_ROWS = 64
+
+def grid_row(lat):
+    return min(max(int((lat + 90) // GRID_CELL_SIZE), 0), GRID_ROWS - 1)
+
+def grid_column(lng):
+    return min(max(int((lng + 180) // GRID_CELL_SIZE), 0), GRID_COLUMNS - 1)
+
+def grid_cell(lat, lng):
+    # Cells are numbered row by row, so the cells of one row inside a
+    # bounding box form a single contiguous range of the indexed column
+    return grid_row(lat) * GRID_COLUMNS + grid_column(lng)
+
+def parse_bbox(value):
+    # Expects "minLng,minLat,maxLng,maxLat" like Leaflet's toBBoxString()
+    try:
+        min_lng, min_lat, max_lng, max_lat = [part.strip() for part in value.split(',')]
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid bounding box format")
+
+    min_lat, min_lng = validate_coordinates(min_lat, min_lng)
+    max_lat, max_lng = validate_coordinates(max_lat, max_lng)
+    if min_lat > max_lat:
+        raise ValueError("Invalid bounding box format")
+    return min_lng, min_lat, max_lng, max_lat
+
+def split_bbox(min_lng, min_lat, max_lng, max_lat):
+    # A box crossing the antimeridian (minLng > maxLng) becomes two boxes
+    if min_lng <= max_lng:
+        return [(min_lng, min_lat, max_lng, max_lat)]
+    return [(min_lng, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lng, max_lat)]
+
+def bbox_center(min_lng, min_lat, max_lng, max_lat):
+    # (lat, lng) of the middle of a box, measured along the wrapped longitude
+    # span so a box crossing the antimeridian is centered near 180
+    lng = min_lng + ((max_lng - min_lng) % 360) / 2
+    if lng > 180:
+        lng -= 360
+    return (min_lat + max_lat) / 2, lng
+
+def grid_cell_ranges(min_lng, min_lat, max_lng, max_lat):
+    # Returns the (first, last) cell ranges covering a box that does not cross
+    # the antimeridian, or None when the box is too tall to be worth it
+    first_row, last_row = grid_row(min_lat), grid_row(max_lat)
+    if last_row - first_row + 1 > MAX_GRID_ROWS:
+        return None
+
+    first_column, last_column = grid_column(min_lng), grid_column(max_lng)
+    return [
+        (row * GRID_COLUMNS + first_column, row * GRID_COLUMNS + last_column)
+        for row in range(first_row, last_row + 1)
+    ]
+
+EARTH_RADIUS_KM = 6371.0088
+
+def to_unit_vector(lat, lng):
+    # Point on the unit sphere; straight-line (chord) distance between two of
+    # these is monotonic in great-circle distance, so a plain 3-d tree works
+    lat_rad, lng_rad = math.radians(lat), math.radians(lng)
+    cos_lat = math.cos(lat_rad)
+    return (cos_lat * math.cos(lng_rad), cos_lat * math.sin(lng_rad), math.sin(lat_rad))
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1.0))
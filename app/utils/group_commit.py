@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as ResultTimeout
+from flask import current_app
+from app import db
+from app.models.review import Review
+from app.models.toilet import Toilet
+from app.utils.toilet_index import reindex_toilets
+
+class GroupCommitBusy(Exception):
+    """Raised when a submission can't be queued or isn't committed in time."""
+
+class GroupCommitWriter:
+    """Single background writer that inserts submitted rows in batches.
+
+    Each commit costs a journal sync and takes SQLite's write lock, so
+    under bursts one commit per request makes writers queue on the lock and
+    time out. Here requests hand their row to one thread that collects up
+    to `max_batch` of them, or whatever arrived within `max_delay` seconds
+    of the first, and commits them together. The submitting request waits
+    until its batch is committed and gets the new row's id back, or the
+    exception that row caused. When a batch fails as a whole its rows are
+    retried one by one, so a bad row only fails its own request. A request
+    waits at most `result_timeout` seconds, then gets GroupCommitBusy and
+    its row is dropped unless the writer already took it."""
+
+    def __init__(self, app, max_batch=200, max_delay=0.02, max_queue=10000, submit_timeout=5.0,
+                 result_timeout=10.0):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.submit_timeout = submit_timeout
+        self.result_timeout = result_timeout
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, model, values):
+        """Queue a `model(**values)` insert and return a Future resolving to
+        its id once committed."""
+        self._ensure_started()
+        future = Future()
+        try:
+            # Blocks while the queue is full
+            self._queue.put((model, values, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise GroupCommitBusy()
+        return future
+
+    def submit(self, model, values):
+        """Insert `model(**values)` with the next batch and return its id."""
+        future = self.enqueue(model, values)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except ResultTimeout:
+            # Succeeds while the row is still queued, so it won't be written
+            future.cancel()
+            raise GroupCommitBusy()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _ensure_started(self):
+        # Started on first use, i.e. in each worker after a preload fork
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                # Rows whose request stopped waiting are dropped
+                batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+                try:
+                    if batch:
+                        self._write(batch)
+                    db.session.remove()
+                except Exception as error:
+                    # Keep the thread alive; the batch's requests get the error
+                    current_app.logger.exception('Group commit writer failed on a batch')
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(error)
+
+    def _write(self, batch):
+        try:
+            ids = self._commit(batch)
+        except Exception as error:
+            db.session.rollback()
+            if len(batch) > 1:
+                # Find the bad rows by retrying one at a time
+                for item in batch:
+                    self._write([item])
+            else:
+                self.failed += 1
+                batch[0][2].set_exception(error)
+            return
+
+        self.batches += 1
+        self.committed += len(batch)
+        self._refresh_indexes(batch, ids)
+        for (_, _, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+
+    def _commit(self, batch):
+        rows = [model(**values) for model, values, _ in batch]
+        db.session.add_all(rows)
+        # Read the ids before commit expires the rows
+        db.session.flush()
+        ids = [row.id for row in rows]
+        db.session.commit()
+        return ids
+
+    def _refresh_indexes(self, batch, ids):
+        # New toilets, and toilets whose consensus values the reviews changed
+        toilet_ids = {
+            row_id if model is Toilet else values['toilet_id']
+            for (model, values, _), row_id in zip(batch, ids)
+            if model in (Toilet, Review)
+        }
+        try:
+            reindex_toilets(toilet_ids)
+        except Exception:
+            # The rows are committed; indexes catch up from the change log
+            current_app.logger.exception('Refreshing toilet indexes after a group commit failed')
+
+def init_group_commit(app):
+    if app.config.get('GROUP_COMMIT'):
+        app.extensions['group_commit'] = GroupCommitWriter(
+            app,
+            max_batch=app.config.get('GROUP_COMMIT_MAX_BATCH', 200),
+            max_delay=app.config.get('GROUP_COMMIT_MAX_DELAY_MS', 20) / 1000,
+            result_timeout=app.config.get('GROUP_COMMIT_TIMEOUT_MS', 10000) / 1000
+        )
+
+def get_group_commit_writer():
+    """The group commit writer, or None when requests commit their own writes."""
+    return current_app.extensions.get('group_commit')
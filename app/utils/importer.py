@@ -0,0 +1,316 @@
+import csv
+import json
+import math
+import os
+import time
+from datetime import datetime
+from markupsafe import escape
+from sqlalchemy import select
+from app import db
+from app.models.dataset import reset_dataset_version
+from app.models.search import index_inserted_toilets, search_supported
+from app.models.toilet import DEFAULT_CLEANLINESS, Toilet, initial_aggregates
+from app.utils.geo import EARTH_RADIUS_KM, grid_cell, to_unit_vector
+from app.utils.validators import validate_coordinates
+
+# Rows inserted per executemany and per transaction
+IMPORT_BATCH_SIZE = 5000
+
+# Points closer than this to an existing or already imported toilet are skipped
+DEFAULT_DEDUPE_RADIUS_M = 10
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'designated'}
+
+# Accepted column / property names, the first match wins. The OSM names are
+# those of amenity=toilets tags as exported by osmium or overpass.
+LATITUDE_KEYS = ['latitude', 'lat', 'y']
+LONGITUDE_KEYS = ['longitude', 'lng', 'lon', 'x']
+DESCRIPTION_KEYS = ['description', 'name', 'operator']
+ACCESSIBLE_KEYS = ['accessible', 'wheelchair', 'toilets:wheelchair']
+TOILET_PAPER_KEYS = ['has_toilet_paper', 'toilet_paper', 'toilets:paper_supplied']
+CLEANLINESS_KEYS = ['cleanliness']
+
+def _first(record, keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return value is not None and str(value).strip().lower() in TRUE_VALUES
+
+def _cleanliness(value):
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_CLEANLINESS
+    return rating if 1 <= rating <= 5 else DEFAULT_CLEANLINESS
+
+def read_csv(path):
+    """Yield one record per CSV row, keyed by lower-cased header."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield {key.strip().lower(): value for key, value in row.items() if key}
+
+# Characters read at a time when streaming GeoJSON
+GEOJSON_CHUNK_SIZE = 64 * 1024
+
+# JSON whitespace, plus the record separator GeoJSONSeq puts before features
+_JSON_WHITESPACE = ' \t\r\n\x1e'
+
+class _JSONStream:
+    """Reads JSON tokens and values one at a time from a text file, holding
+    only the value being decoded in memory."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(GEOJSON_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """The next character that isn't whitespace, or '' at the end."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Invalid GeoJSON: expected one of {chars!r} at {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+            else:
+                # A number at the end of the buffer may go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            self._fill()
+
+def _stream_features(f):
+    # Top-level objects are read member by member: the members of a
+    # FeatureCollection's "features" array are yielded one at a time, a
+    # top-level Feature (as in GeoJSONSeq) once it is complete
+    stream = _JSONStream(f)
+    while stream.peek():
+        stream.expect('{')
+        members = {}
+        if stream.peek() == '}':
+            stream.expect('}')
+            continue
+        while True:
+            key = stream.value()
+            stream.expect(':')
+            if key == 'features' and stream.peek() == '[':
+                stream.expect('[')
+                if stream.peek() == ']':
+                    stream.expect(']')
+                else:
+                    while True:
+                        yield stream.value()
+                        if stream.expect(',]') == ']':
+                            break
+            else:
+                members[key] = stream.value()
+            if stream.expect(',}') == '}':
+                break
+        if members.get('type') == 'Feature':
+            yield members
+
+def read_geojson(path):
+    """Yield one record per GeoJSON feature, from a FeatureCollection or from
+    newline-delimited features (GeoJSONSeq, as written by osmium export).
+    Both are streamed, one feature in memory at a time. Non-point
+    geometries yield a record without coordinates."""
+    with open(path, encoding='utf-8') as f:
+        for feature in _stream_features(f):
+            if not isinstance(feature, dict):
+                raise ValueError("Invalid GeoJSON: features must be objects")
+            record = {key.lower(): value for key, value in (feature.get('properties') or {}).items()}
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Point':
+                record['longitude'], record['latitude'] = geometry['coordinates'][:2]
+            else:
+                record.pop('latitude', None)
+                record.pop('longitude', None)
+            yield record
+
+READERS = {'csv': read_csv, 'geojson': read_geojson}
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.geojson', '.geojsonl', '.geojsons', '.json', '.ndjson'):
+        return 'geojson'
+    raise ValueError(f'Cannot tell the format of {path}, pass --format')
+
+class NearbyPoints:
+    """Set of points answering "is there one within radius?" in constant time.
+
+    Points are bucketed by their unit vector on a 3D grid whose cell size is
+    the chord length of the radius, so a match can only be in one of the 27
+    cells around the query point, at any latitude."""
+
+    def __init__(self, radius_m):
+        self.cell = max(radius_m / 1000 / EARTH_RADIUS_KM, 1e-12)
+        self.max_chord_sq = self.cell ** 2
+        self._cells = {}
+
+    def _key(self, point):
+        return tuple(math.floor(value / self.cell) for value in point)
+
+    def add(self, lat, lng):
+        point = to_unit_vector(lat, lng)
+        self._cells.setdefault(self._key(point), []).append(point)
+
+    def contains_near(self, lat, lng):
+        point = to_unit_vector(lat, lng)
+        x, y, z = self._key(point)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    for other in self._cells.get((x + dx, y + dy, z + dz), ()):
+                        if sum((a - b) ** 2 for a, b in zip(point, other)) <= self.max_chord_sq:
+                            return True
+        return False
+
+def checkpoint_path(path):
+    return path + '.import-checkpoint'
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def load_checkpoint(path):
+    """Number of records already handled by an interrupted import of this
+    exact file, or 0."""
+    try:
+        with open(checkpoint_path(path)) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if {key: checkpoint.get(key) for key in ('source', 'size', 'mtime')} != _source_stamp(path):
+        return 0
+    return checkpoint.get('records', 0)
+
+def _save_checkpoint(path, records):
+    tmp_path = checkpoint_path(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(_source_stamp(path), records=records), f)
+    os.replace(tmp_path, checkpoint_path(path))
+
+def _row(record, user_id, timestamp):
+    lat, lng = validate_coordinates(_first(record, LATITUDE_KEYS), _first(record, LONGITUDE_KEYS))
+    description = str(escape(str(_first(record, DESCRIPTION_KEYS) or 'Public toilet').strip()))[:200]
+    accessible = _flag(_first(record, ACCESSIBLE_KEYS))
+    has_toilet_paper = _flag(_first(record, TOILET_PAPER_KEYS))
+    cleanliness = _cleanliness(_first(record, CLEANLINESS_KEYS))
+    # Core inserts bypass the Toilet mapper events, so fill in what they would
+    return dict(
+        initial_aggregates(cleanliness, accessible, has_toilet_paper),
+        latitude=lat,
+        longitude=lng,
+        description=description,
+        accessible=accessible,
+        has_toilet_paper=has_toilet_paper,
+        cleanliness=cleanliness,
+        timestamp=timestamp,
+        user_id=user_id,
+        grid_cell=grid_cell(lat, lng)
+    )
+
+def import_toilets(path, user_id, file_format=None, batch_size=IMPORT_BATCH_SIZE,
+                   dedupe_radius_m=DEFAULT_DEDUPE_RADIUS_M, resume=True, progress=None):
+    """Bulk insert toilets from a CSV or GeoJSON file.
+
+    Rows are inserted with one executemany per batch and committed per
+    batch, after which a checkpoint next to the file records how far the
+    import got; an interrupted import resumes from there. Returns a dict of
+    counts. `progress`, if given, is called with that dict after every batch."""
+    reader = READERS[file_format or detect_format(path)]
+    skip = load_checkpoint(path) if resume else 0
+
+    nearby = NearbyPoints(dedupe_radius_m)
+    if dedupe_radius_m > 0:
+        table = Toilet.__table__
+        for lat, lng in db.session.execute(select(table.c.latitude, table.c.longitude)):
+            nearby.add(lat, lng)
+
+    stats = {'records': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'resumed_at': skip, 'errors': []}
+    statement = Toilet.__table__.insert()
+    timestamp = datetime.utcnow()
+    started = time.perf_counter()
+    batch = []
+
+    def flush():
+        if batch:
+            if search_supported(db.session.connection()):
+                # Core inserts bypass the mapper event indexing descriptions;
+                # RETURNING gives exactly the rows this batch inserted
+                table = Toilet.__table__
+                inserted = db.session.execute(statement.returning(table.c.id, table.c.description), batch)
+                index_inserted_toilets(db.session.connection(), inserted.all())
+            else:
+                db.session.execute(statement, batch)
+            stats['imported'] += len(batch)
+            batch.clear()
+        db.session.commit()
+        _save_checkpoint(path, skip + stats['records'])
+        stats['rows_per_second'] = stats['records'] / max(time.perf_counter() - started, 1e-9)
+        if progress:
+            progress(stats)
+
+    for number, record in enumerate(reader(path), start=1):
+        if number <= skip:
+            continue
+        stats['records'] += 1
+        try:
+            row = _row(record, user_id, timestamp)
+        except ValueError as e:
+            stats['invalid'] += 1
+            if len(stats['errors']) < 20:
+                stats['errors'].append(f'record {number}: {e}')
+            continue
+
+        if dedupe_radius_m > 0:
+            if nearby.contains_near(row['latitude'], row['longitude']):
+                stats['duplicates'] += 1
+                continue
+            nearby.add(row['latitude'], row['longitude'])
+
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+
+    flush()
+    if stats['imported'] or skip:
+        # One version bump for the whole import (and any interrupted run
+        # before it) instead of one per toilet
+        reset_dataset_version(db.session.connection())
+        db.session.commit()
+    os.remove(checkpoint_path(path))
+    return stats
@@ -0,0 +1,115 @@
+import heapq
+
+class _Node:
+    __slots__ = ('key', 'point', 'payload', 'axis', 'left', 'right')
+
+    def __init__(self, key, point, payload, axis):
+        self.key = key
+        self.point = point
+        self.payload = payload
+        self.axis = axis
+        self.left = None
+        self.right = None
+
+class KDTree:
+    """3-d tree over points with an attached payload, supporting incremental
+    inserts, payload updates and k-nearest search with a filter predicate."""
+
+    DIMENSIONS = 3
+
+    def __init__(self, items=()):
+        # items: iterable of (key, point, payload)
+        self.rebuild(items)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    def rebuild(self, items):
+        self._nodes = {}
+        self._root = self._build(list(items), 0)
+        self._built_size = len(self._nodes)
+        self._inserted = 0
+
+    def _build(self, items, depth):
+        if not items:
+            return None
+        axis = depth % self.DIMENSIONS
+        items.sort(key=lambda item: item[1][axis])
+        middle = len(items) // 2
+        key, point, payload = items[middle]
+        node = _Node(key, point, payload, axis)
+        self._nodes[key] = node
+        node.left = self._build(items[:middle], depth + 1)
+        node.right = self._build(items[middle + 1:], depth + 1)
+        return node
+
+    def items(self):
+        return [(node.key, node.point, node.payload) for node in self._nodes.values()]
+
+    def insert(self, key, point, payload):
+        if key in self._nodes:
+            self.update(key, payload)
+            return
+
+        # Plain inserts unbalance the tree, so rebuild once they grow it by half
+        if self._inserted >= max(self._built_size // 2, 64):
+            self.rebuild(self.items() + [(key, point, payload)])
+            return
+
+        depth = 0
+        parent = None
+        node = self._root
+        while node is not None:
+            parent = node
+            node = node.left if point[node.axis] < node.point[node.axis] else node.right
+            depth += 1
+
+        new_node = _Node(key, point, payload, depth % self.DIMENSIONS)
+        if parent is None:
+            self._root = new_node
+        elif point[parent.axis] < parent.point[parent.axis]:
+            parent.left = new_node
+        else:
+            parent.right = new_node
+        self._nodes[key] = new_node
+        self._inserted += 1
+
+    def update(self, key, payload):
+        self._nodes[key].payload = payload
+
+    def nearest(self, point, k, predicate=None):
+        """Return up to k (squared distance, key, payload) tuples, closest
+        first. Points whose payload fails the predicate are skipped during
+        the search, so they never take up one of the k slots."""
+        if k <= 0:
+            return []
+
+        heap = []  # Max-heap of the best k so far, via negated distances
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, plane_distance = stack.pop()
+            if node is None:
+                continue
+            # Skip subtrees on the far side of a plane further than the k-th result
+            if len(heap) == k and plane_distance >= -heap[0][0]:
+                continue
+
+            distance = sum((a - b) ** 2 for a, b in zip(point, node.point))
+            if predicate is None or predicate(node.payload):
+                entry = (-distance, node.key, node.payload)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif distance < -heap[0][0]:
+                    heapq.heapreplace(heap, entry)
+
+            offset = point[node.axis] - node.point[node.axis]
+            near, far = (node.left, node.right) if offset < 0 else (node.right, node.left)
+            # Push the far side first so the near side is searched first; the
+            # pushed value is a lower bound on any distance inside the subtree
+            stack.append((far, max(plane_distance, offset * offset)))
+            stack.append((near, plane_distance))
+
+        return sorted((-negated, key, payload) for negated, key, payload in heap)
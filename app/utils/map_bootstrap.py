@@ -0,0 +1,87 @@
+import json
+import math
+from flask import current_app, request
+from app.controllers.api_controller import MAX_MAP_ZOOM, ApiController
+from app.models.dataset import get_dataset_version
+from app.utils.clusters import MAX_MERCATOR_LAT, TILE_SIZE
+from app.utils.response_cache import get_response_cache
+
+# Where the map opens for users without a saved view
+DEFAULT_MAP_VIEW = {'latitude': 51.505, 'longitude': -0.09, 'zoom': 13}
+
+# The page stores the last map view in this cookie as "lat,lng,zoom"
+MAP_VIEW_COOKIE = 'map_view'
+
+# Assumed map size in pixels when picking the area to embed; a larger map
+# fetches the rest the usual way
+BOOTSTRAP_VIEWPORT = (1600, 1000)
+
+def parse_map_view(value):
+    """The map view stored in the cookie, or the default view."""
+    try:
+        lat, lng, zoom = value.split(',')
+        view = {'latitude': float(lat), 'longitude': float(lng), 'zoom': int(zoom)}
+    except (AttributeError, ValueError):
+        return dict(DEFAULT_MAP_VIEW)
+    if not (-90 <= view['latitude'] <= 90 and -180 <= view['longitude'] <= 180 and 0 <= view['zoom'] <= MAX_MAP_ZOOM):
+        return dict(DEFAULT_MAP_VIEW)
+    return view
+
+def _world_pixel(lat, lng, zoom):
+    size = TILE_SIZE * 2 ** zoom
+    lat = max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180) / 360 * size
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * size
+    return x, y
+
+def _lat_lng(x, y, zoom):
+    size = TILE_SIZE * 2 ** zoom
+    lng = x / size * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+    return lat, lng
+
+def viewport_bbox(view, viewport=BOOTSTRAP_VIEWPORT):
+    """(west, south, east, north) around a view, widened to whole map tiles so
+    nearby views share one cached payload."""
+    zoom = view['zoom']
+    size = TILE_SIZE * 2 ** zoom
+    x, y = _world_pixel(view['latitude'], view['longitude'], zoom)
+    width, height = viewport
+    left = max(math.floor((x - width / 2) / TILE_SIZE) * TILE_SIZE, 0)
+    right = min(math.ceil((x + width / 2) / TILE_SIZE) * TILE_SIZE, size)
+    top = max(math.floor((y - height / 2) / TILE_SIZE) * TILE_SIZE, 0)
+    bottom = min(math.ceil((y + height / 2) / TILE_SIZE) * TILE_SIZE, size)
+    north, west = _lat_lng(left, top, zoom)
+    south, east = _lat_lng(right, bottom, zoom)
+    return (round(west, 6), round(max(south, -90), 6), round(east, 6), round(min(north, 90), 6))
+
+def _htmlsafe(text):
+    # Same escaping as Jinja's tojson, for JSON placed inside a <script> tag
+    return (text.replace('<', '\\u003c').replace('>', '\\u003e')
+            .replace('&', '\\u0026').replace("'", '\\u0027'))
+
+def map_bootstrap(view):
+    """JSON for the page to draw its first markers from: what the clusters
+    endpoint returns for the area around `view`, with the bbox it covers and
+    the dataset version it reflects. Cached per dataset version, zoom and
+    bbox. Returns None when disabled or unavailable."""
+    if not current_app.config.get('MAP_BOOTSTRAP', True):
+        return None
+    bbox = viewport_bbox(view)
+    version, _ = get_dataset_version()
+    key = ('main.map_bootstrap', version, view['zoom'], bbox)
+    cache = get_response_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        return entry[0]
+
+    data, status = ApiController.get_toilet_clusters(view['zoom'], ','.join(map(str, bbox)), 'compact')
+    if status != 200:
+        return None
+    body = _htmlsafe(json.dumps({'version': version, 'bbox': bbox, 'data': data}, separators=(',', ':')))
+    cache.set(key, body, 'application/json')
+    return body
+
+def current_map_view():
+    return parse_map_view(request.cookies.get(MAP_VIEW_COOKIE))
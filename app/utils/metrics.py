@@ -0,0 +1,271 @@
+import cProfile
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        # Without taking the lock: after a fork it may be held by a thread
+        # that only exists in the parent
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_sample(key, value) for key, value in items)
+        return lines
+
+    def _render_sample(self, key, value):
+        return f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}'
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *label_values, value):
+        # Per label set: [count per bucket (+Inf last), sum]
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_format_number(float(bound))}"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {_format_number(float(total))}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return '\n'.join(lines)
+
+class Metrics:
+    """Process-local metrics in the Prometheus text format. With several
+    worker processes each one reports its own values, so scrape them per
+    worker or aggregate them in the query."""
+
+    def __init__(self):
+        endpoint = ('endpoint', 'method')
+        self.requests = Counter('http_requests_total', 'HTTP requests handled', endpoint + ('status',))
+        self.request_duration = Histogram('http_request_duration_seconds',
+                                          'Time from the start of the request to the response', endpoint)
+        self.response_size = Histogram('http_response_size_bytes',
+                                       'Response body size as sent, after compression', endpoint,
+                                       buckets=SIZE_BUCKETS)
+        self.in_flight = Gauge('http_requests_in_flight', 'Requests being handled', ('endpoint',))
+        self.request_statements = Histogram('http_request_sql_statements', 'SQL statements executed per request',
+                                            endpoint, buckets=STATEMENT_BUCKETS)
+        self.request_sql_duration = Histogram('http_request_sql_duration_seconds',
+                                              'Time spent executing SQL per request', endpoint)
+        self.statements = Counter('sql_statements_total', 'SQL statements executed, including outside requests')
+        self.statement_duration = Histogram('sql_statement_duration_seconds', 'SQL statement execution time')
+        self.slow_profiles = Counter('http_slow_request_profiles_total', 'cProfile dumps written for slow requests',
+                                     ('endpoint',))
+        self.collectors = []
+
+    def metrics(self):
+        return [self.requests, self.request_duration, self.response_size, self.in_flight,
+                self.request_statements, self.request_sql_duration, self.statements,
+                self.statement_duration, self.slow_profiles]
+
+    def reset(self):
+        """Start every metric from zero, e.g. in a worker forked from a
+        parent that already handled (warm-up) requests."""
+        for metric in self.metrics():
+            metric.reset()
+
+    def add_collector(self, collector):
+        """Register a function returning (name, kind, description, value)
+        tuples computed at scrape time, e.g. cache statistics."""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, kind, description, value in collector():
+                lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {kind}',
+                              f'{name} {_format_number(value)}'])
+        return '\n'.join(lines) + '\n'
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is None or not has_app_context():
+        return
+    elapsed = time.perf_counter() - start
+    metrics = current_app.extensions.get('metrics')
+    if metrics is None:
+        return
+    metrics.statements.inc()
+    metrics.statement_duration.observe(value=elapsed)
+    # Statement count per request comes from app.utils.query_counter
+    g.sql_duration = g.get('sql_duration', 0.0) + elapsed
+
+def _app_collector(app):
+    # Statistics kept by other extensions, read at scrape time
+    def collect():
+        samples = []
+        for name in ('response_cache', 'compression_cache'):
+            cache = app.extensions.get(name)
+            if cache is not None:
+                stats = cache.stats()
+                samples += [
+                    (f'{name}_hits_total', 'counter', f'{name} lookups served from the cache', stats['hits']),
+                    (f'{name}_misses_total', 'counter', f'{name} lookups that missed', stats['misses']),
+                    (f'{name}_entries', 'gauge', f'Entries held by {name}', stats['entries']),
+                    (f'{name}_bytes', 'gauge', f'Bytes held by {name}', stats['bytes'])
+                ]
+        hasher = app.extensions.get('password_hasher')
+        if hasher is not None:
+            samples.append(('password_hash_rejected_total', 'counter',
+                            'Logins and signups turned away because the hashing pool was full', hasher.rejected))
+        writer = app.extensions.get('group_commit')
+        if writer is not None:
+            samples += [
+                ('group_commit_batches_total', 'counter', 'Batches committed by the group commit writer',
+                 writer.batches),
+                ('group_commit_rows_total', 'counter', 'Rows committed by the group commit writer', writer.committed),
+                ('group_commit_failed_total', 'counter', 'Rows the group commit writer could not insert',
+                 writer.failed)
+            ]
+        if 'toilet_index_version' in app.extensions:
+            samples.append(('toilet_index_dataset_version', 'gauge',
+                            'Dataset version the in-memory toilet indexes reflect',
+                            app.extensions['toilet_index_version']))
+        return samples
+    return collect
+
+def _endpoint():
+    # Unmatched URLs share one label so scanners can't blow up the series count
+    return request.endpoint or 'unmatched'
+
+def _profile_path(directory, endpoint, elapsed):
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, f'{stamp}-{endpoint}-{int(elapsed * 1000)}ms-{threading.get_ident()}.prof')
+
+def init_metrics(app):
+    """Record request, SQL and cache metrics for /metrics, and optionally
+    profile slow requests. Call before other extensions register
+    after_request hooks, so sizes are taken after compression."""
+    metrics = Metrics()
+    metrics.add_collector(_app_collector(app))
+    app.extensions['metrics'] = metrics
+
+    profile_threshold = app.config.get('PROFILE_SLOW_REQUESTS_MS', 0) / 1000
+    profile_dir = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = _endpoint()
+        metrics.in_flight.inc(g.metrics_endpoint)
+        if profile_threshold:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another thread's request is being profiled (Python 3.12+)
+                return
+            g.metrics_profiler = profiler
+
+    @app.after_request
+    def record_response_size(response):
+        # Registered first, so this runs after the other after_request hooks
+        if not response.is_streamed:
+            metrics.response_size.observe(_endpoint(), request.method, value=response.calculate_content_length() or 0)
+        metrics.requests.inc(_endpoint(), request.method, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error=None):
+        # Runs for every request that got through before_request, even when the view raised
+        if 'metrics_start' not in g:
+            return
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = g.metrics_endpoint
+        metrics.in_flight.dec(endpoint)
+        metrics.request_duration.observe(endpoint, request.method, value=elapsed)
+        metrics.request_statements.observe(endpoint, request.method, value=g.get('sql_statement_count', 0))
+        metrics.request_sql_duration.observe(endpoint, request.method, value=g.get('sql_duration', 0.0))
+
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= profile_threshold:
+                os.makedirs(profile_dir, exist_ok=True)
+                path = _profile_path(profile_dir, endpoint, elapsed)
+                profiler.dump_stats(path)
+                metrics.slow_profiles.inc(endpoint)
+                app.logger.info('%s took %.0f ms, profile written to %s', endpoint, elapsed * 1000, path)
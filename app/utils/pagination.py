@@ -0,0 +1,86 @@
+import base64
+import json
+import math
+from sqlalchemy import and_, or_
+from app.utils.validators import MAX_ID, parse_int
+
+# Largest page a client may ask for
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(last_id, sort_key=None):
+    # Opaque to clients; only the server knows it holds the last seen id
+    # (and, for sorted pages, the last seen sort value)
+    cursor = {'after': last_id}
+    if sort_key is not None:
+        cursor['key'] = sort_key
+    payload = json.dumps(cursor, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor, sorted_page=False):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        after = payload['after']
+        # Out-of-range values would fail in the database, not here
+        if isinstance(after, bool) or not isinstance(after, int) or not 0 <= after <= MAX_ID:
+            raise ValueError
+        if not sorted_page:
+            return after
+        sort_key = payload['key']
+        if isinstance(sort_key, bool) or not isinstance(sort_key, (int, float)):
+            raise ValueError
+        if isinstance(sort_key, int) and not -MAX_ID - 1 <= sort_key <= MAX_ID:
+            raise ValueError
+        if isinstance(sort_key, float) and not math.isfinite(sort_key):
+            raise ValueError
+        return after, sort_key
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError("Invalid cursor")
+
+def parse_limit(limit, default):
+    if limit is None or limit == '':
+        return default
+    return parse_int(limit, 'limit', 1, MAX_PAGE_SIZE)
+
+def keyset_page(query, id_column, limit, cursor=None):
+    """Return (items, next_cursor) for one page ordered by id_column.
+
+    Pages continue from the id in the cursor (WHERE id > last) so every page
+    is an index range scan, unlike OFFSET which rescans skipped rows."""
+    if cursor:
+        query = query.filter(id_column > decode_cursor(cursor))
+    items = query.order_by(id_column).limit(limit + 1).all()
+    if len(items) > limit:
+        items = items[:limit]
+        return items, encode_cursor(items[-1].id)
+    return items, None
+
+def sort_order(sort_column, id_column, descending=False):
+    # ORDER BY terms for sorted_keyset_page and unpaginated sorted lists
+    if descending:
+        return sort_column.desc(), id_column.desc()
+    return sort_column, id_column
+
+def sorted_keyset_page(query, sort_column, id_column, limit, cursor=None, descending=False):
+    """Like keyset_page, ordered by a numeric sort_column (a column or SQL
+    expression) with id_column breaking ties in the same direction, which
+    an index on sort_column alone already provides. Returns (items,
+    sort_keys, next_cursor)."""
+    if cursor:
+        after, sort_key = decode_cursor(cursor, sorted_page=True)
+        if descending:
+            beyond = or_(sort_column < sort_key, and_(sort_column == sort_key, id_column < after))
+        else:
+            beyond = or_(sort_column > sort_key, and_(sort_column == sort_key, id_column > after))
+        query = query.filter(beyond)
+    rows = (
+        query.add_columns(sort_column)
+        .order_by(*sort_order(sort_column, id_column, descending))
+        .limit(limit + 1)
+        .all()
+    )
+    items = [row[0] for row in rows[:limit]]
+    sort_keys = [row[1] for row in rows[:limit]]
+    if len(rows) > limit:
+        return items, sort_keys, encode_cursor(items[-1].id, sort_keys[-1])
+    return items, sort_keys, None
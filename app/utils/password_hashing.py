@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class PasswordHashingBusy(Exception):
+    """Raised when the password hashing pool and its queue are full."""
+
+class PasswordHasher:
+    """Runs password hashing on a small dedicated thread pool.
+
+    hashlib's scrypt and pbkdf2 release the GIL, so the pool hashes in
+    parallel while limiting how many CPU-heavy hashes run at once. Beyond
+    `workers` running plus `max_queue` waiting hashes, new ones are refused
+    with PasswordHashingBusy instead of piling up behind each other. With
+    workers=0 hashes run inline on the calling thread."""
+
+    def __init__(self, method='scrypt', workers=2, max_queue=32):
+        self.method = method
+        self.rejected = 0
+        self._method_id = None
+        self._executor = None
+        if workers > 0:
+            # Threads start on first use, i.e. in each worker after a preload fork
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            self._slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def submit(self, function, *args):
+        """Run function(*args) on the pool and return its result."""
+        if self._executor is None:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHashingBusy()
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self.submit(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self.submit(check_password_hash, password_hash, password)
+
+    @property
+    def method_id(self):
+        # Method with its cost parameters as stored in hashes, e.g. "scrypt:32768:8:1"
+        if self._method_id is None:
+            self._method_id = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._method_id
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method_id
+
+def init_password_hasher(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config.get('PASSWORD_HASH_METHOD', 'scrypt'),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        max_queue=app.config.get('PASSWORD_HASH_QUEUE', 32)
+    )
+
+def get_password_hasher():
+    return current_app.extensions.get('password_hasher') if has_app_context() else None
+
+def hash_password(password):
+    hasher = get_password_hasher()
+    if hasher is None:
+        return generate_password_hash(password)
+    return hasher.hash(password)
+
+def verify_password(password_hash, password):
+    hasher = get_password_hasher()
+    if hasher is None:
+        return check_password_hash(password_hash, password)
+    return hasher.verify(password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """Whether a stored hash was made with other settings than PASSWORD_HASH_METHOD."""
+    hasher = get_password_hasher()
+    return hasher is not None and hasher.needs_rehash(password_hash)
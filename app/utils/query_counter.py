@@ -0,0 +1,59 @@
+from functools import wraps
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    # Each request runs in its own app context, so g holds a per-request count
+    if has_app_context():
+        g.sql_statement_count = g.get('sql_statement_count', 0) + 1
+
+def statement_count():
+    """Number of SQL statements executed in the current app/request context."""
+    return g.get('sql_statement_count', 0)
+
+class QueryCounter:
+    """Context manager counting the SQL statements executed inside it.
+
+        with QueryCounter() as counter:
+            ApiController.get_toilets()
+        assert counter.count <= 1
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self._start = statement_count()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.count = statement_count() - self._start
+
+def query_budget(limit):
+    """Decorator declaring how many SQL statements a view may execute.
+
+    Going over budget is logged, and raises when SQL_QUERY_BUDGET_STRICT is
+    set so tests catch N+1 regressions."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with QueryCounter() as counter:
+                response = view(*args, **kwargs)
+            if counter.count > limit:
+                message = f'{view.__name__} executed {counter.count} SQL statements, budget is {limit}'
+                if current_app.config.get('SQL_QUERY_BUDGET_STRICT'):
+                    raise RuntimeError(message)
+                current_app.logger.warning(message)
+            return response
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
+
+def init_query_counter(app):
+    @app.after_request
+    def add_statement_count_header(response):
+        if app.config.get('SQL_COUNT_HEADER'):
+            response.headers['X-SQL-Statements'] = str(statement_count())
+        return response
@@ -0,0 +1,115 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, current_app, request, session
+from app.models.dataset import get_dataset_version
+
+class ResponseCache:
+    """LRU cache of serialized response bodies, bounded by entry count and bytes."""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, mimetype)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (old_body, _) = self._entries.popitem(last=False)
+                self._size -= len(old_body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._size
+            }
+
+def init_response_cache(app):
+    app.extensions['response_cache'] = ResponseCache(
+        max_entries=app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 256),
+        max_bytes=app.config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+    )
+
+def get_response_cache():
+    return current_app.extensions['response_cache']
+
+def _finish(response, etag, version, updated_at):
+    response.set_etag(etag)
+    # Lets clients poll /api/toilets/changes from this point on
+    response.headers['X-Dataset-Version'] = str(version)
+    if updated_at is not None:
+        response.last_modified = updated_at
+    # Data is per login, so only the browser may keep it and must revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def cached_by_dataset_version(view):
+    """Cache a JSON view's body per dataset version and query string, and
+    answer matching If-None-Match/If-Modified-Since requests with a 304
+    before any serialization happens."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Anonymous requests go straight to the view for its 401
+        if 'user_id' not in session:
+            return view(*args, **kwargs)
+
+        version, updated_at = get_dataset_version()
+        params = sorted(request.args.items(multi=True))
+        key = (request.endpoint, version, tuple(sorted(kwargs.items())), tuple(params))
+        etag = hashlib.sha1(repr(key).encode()).hexdigest()
+
+        if request.if_none_match:
+            # Weak comparison, since compression turns the ETag into a weak one
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            # Last-Modified only has whole seconds, and another write may land
+            # in the second a client's copy is from, so that second isn't enough
+            not_modified = (updated_at is not None and request.if_modified_since is not None
+                            and updated_at.replace(microsecond=0) < request.if_modified_since.replace(tzinfo=None))
+        if not_modified:
+            return _finish(Response(status=304), etag, version, updated_at)
+
+        cache = get_response_cache()
+        entry = cache.get(key)
+        if entry is not None:
+            body, mimetype = entry
+            response = Response(body, mimetype=mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return _finish(response, etag, version, updated_at)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        cache.set(key, response.get_data(), response.mimetype)
+        response.headers['X-Cache'] = 'MISS'
+        return _finish(response, etag, version, updated_at)
+    return wrapper
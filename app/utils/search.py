@@ -0,0 +1,79 @@
+import re
+from markupsafe import escape
+from sqlalchemy import and_, column, func, literal_column, or_, select, table
+from app import db
+from app.models.review import Review
+from app.models.search import SEARCH_TABLE, TOILET_ROWID_SHIFT, search_supported
+from app.models.toilet import Toilet
+
+# Words or quoted phrases taken from a query, the rest is ignored
+MAX_QUERY_TERMS = 8
+
+_TERM = re.compile(r'"([^"]*)"|([^\s"]+)')
+
+_search = table(SEARCH_TABLE, column('rowid'), column('rank'))
+
+def parse_query(query):
+    """Split a search query into terms: bare words and "quoted phrases".
+    Terms without any letter or digit are dropped."""
+    terms = []
+    for phrase, word in _TERM.findall(query or ''):
+        term = ' '.join((phrase or word).split())
+        if re.search(r'\w', term):
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+def _fts_query(terms):
+    # Every term quoted, so user input can't use FTS5 operators or column
+    # filters; adjacent terms must all match
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def _like_pattern(term):
+    # Stored texts are HTML-escaped, see sanitize_text
+    escaped = str(escape(term)).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def _full_text_search(terms, bbox, limit):
+    # Toilets by the sum of their matching texts' rank, FTS5's bm25 score
+    # (lower is better), so more matching reviews count too. The bm25()
+    # function itself can't be used in an aggregate.
+    toilet_id = _search.c.rowid.op('>>')(TOILET_ROWID_SHIFT).label('toilet_id')
+    score = func.sum(_search.c.rank).label('score')
+    query = (
+        select(toilet_id, score)
+        .where(literal_column(SEARCH_TABLE).op('MATCH')(_fts_query(terms)))
+        .group_by(toilet_id)
+    )
+    if bbox:
+        toilet = Toilet.__table__
+        query = query.join(toilet, toilet.c.id == toilet_id).where(Toilet.in_bbox(*bbox))
+    query = query.order_by(score, toilet_id).limit(limit)
+    return [row.toilet_id for row in db.session.execute(query)]
+
+def _like_search(terms, bbox, limit):
+    # Backends without FTS5: the description or a review comment containing
+    # every term, most reviewed toilets first. Scans both tables.
+    patterns = [_like_pattern(term) for term in terms]
+    reviewed = select(Review.toilet_id).where(*[Review.comment.ilike(pattern, escape='\\') for pattern in patterns])
+    query = select(Toilet.id).where(or_(
+        and_(*[Toilet.description.ilike(pattern, escape='\\') for pattern in patterns]),
+        Toilet.id.in_(reviewed)
+    ))
+    if bbox:
+        query = query.where(Toilet.in_bbox(*bbox))
+    query = query.order_by(Toilet.review_count.desc(), Toilet.id).limit(limit)
+    return list(db.session.execute(query).scalars())
+
+def search_toilets(query, bbox=None, limit=20, full_text=None):
+    """Ids of the toilets whose description or one of whose review comments
+    contains every term of `query`, best match first, optionally inside `bbox` (a parsed
+    (min_lng, min_lat, max_lng, max_lat) tuple). Uses the FTS5 index when
+    the database has one, unless `full_text` says otherwise."""
+    terms = parse_query(query)
+    if not terms:
+        return []
+    if full_text is None:
+        full_text = search_supported(db.session.connection())
+    if full_text:
+        return _full_text_search(terms, bbox, limit)
+    return _like_search(terms, bbox, limit)
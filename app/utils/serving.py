@@ -0,0 +1,58 @@
+import time
+from app import db
+from app.utils.toilet_index import refresh_toilet_indexes
+
+# Browsers ask for brotli; the compressed bodies are cached too
+WARM_UP_ENCODING = 'gzip, deflate, br'
+
+def warm_up(app, paths=None):
+    """Request the hot read paths once, so templates are compiled and the
+    response and compression caches hold their bodies before real traffic
+    arrives. Returns {path: status code}.
+
+    Run in the parent before the server forks its workers, every worker
+    starts warm; see gunicorn.conf.py."""
+    paths = app.config.get('WARM_UP_PATHS', ()) if paths is None else paths
+    if not paths:
+        return {}
+    start = time.perf_counter()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        # The read paths only check that someone is logged in; nothing is written
+        sess['user_id'] = 0
+    results = {}
+    for path in paths:
+        response = client.get(path, headers={'Accept-Encoding': WARM_UP_ENCODING})
+        response.close()
+        results[path] = response.status_code
+        if response.status_code != 200:
+            app.logger.warning('Warm-up request for %s returned %s', path, response.status_code)
+    app.logger.info('Warmed up %d paths in %.0f ms', len(paths), (time.perf_counter() - start) * 1000)
+    return results
+
+def before_fork(app):
+    """Bring the parent's in-memory indexes and caches up to date before it
+    forks a worker, e.g. one replacing a recycled worker, so the new worker
+    doesn't catch up on its first requests."""
+    if 'toilet_index_version' in app.extensions:
+        with app.app_context():
+            refresh_toilet_indexes()
+            db.session.remove()
+    warm_up(app)
+
+def after_fork(app):
+    """Reset the state a forked worker inherited from its parent: pooled
+    database connections can't be shared between processes, and the
+    metrics should only count the worker's own requests."""
+    with app.app_context():
+        for engine in db.engines.values():
+            # Leaves the parent's connections to the parent
+            engine.dispose(close=False)
+    app.extensions['metrics'].reset()
+
+def before_exit(app):
+    """Commit the writes still queued for the group commit writer before a
+    worker exits, e.g. when it is recycled."""
+    writer = app.extensions.get('group_commit')
+    if writer is not None:
+        writer.stop()
@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from flask import current_app
+from app.models.dataset import get_dataset_version
+from app.models.schema import SCHEMA_VERSION, get_schema_version
+from app.utils.compact import encode_compact
+from app.utils.export import iter_toilets
+
+MANIFEST_NAME = 'latest.json'
+SNAPSHOT_PREFIX = 'toilets-'
+SNAPSHOT_SUFFIX = '.json.gz'
+
+# Superseded snapshots kept for pages that were rendered before the switch
+SNAPSHOT_KEEP = 3
+
+def snapshot_dir(app=None):
+    app = app or current_app
+    return app.config.get('SNAPSHOT_DIR') or os.path.join(app.instance_path, 'snapshots')
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def read_manifest(directory):
+    """The manifest of the newest snapshot, or None if none was published."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _prune(directory, keep_name):
+    snapshots = sorted(
+        (entry for entry in os.scandir(directory)
+         if entry.name.startswith(SNAPSHOT_PREFIX) and entry.name.endswith(SNAPSHOT_SUFFIX)
+         and entry.name != keep_name),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in snapshots[SNAPSHOT_KEEP:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def publish_snapshot(directory=None, force=False):
+    """Write every toilet in the compact list format to a gzipped,
+    content-addressed file and point the manifest at it.
+
+    Returns the manifest. Nothing is written when the manifest already
+    describes the current dataset version, unless force is set."""
+    directory = directory or snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    # Read the version first: changes racing with the read are replayed by
+    # the change feed from this version, which is harmless
+    version, _ = get_dataset_version()
+    manifest = read_manifest(directory)
+    if manifest and manifest['version'] == version and not force:
+        return manifest
+
+    toilets = [toilet for chunk in iter_toilets() for toilet in chunk]
+    payload = dict(encode_compact(toilets), version=version)
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    name = f'{SNAPSHOT_PREFIX}{hashlib.sha256(body).hexdigest()[:16]}{SNAPSHOT_SUFFIX}'
+
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        # mtime=0 keeps the gzip bytes a pure function of the content
+        _write_atomic(path, gzip.compress(body, compresslevel=9, mtime=0))
+
+    manifest = {'version': version, 'file': name, 'count': len(toilets), 'published_at': time.time()}
+    _write_atomic(os.path.join(directory, MANIFEST_NAME), json.dumps(manifest).encode())
+    _prune(directory, name)
+    return manifest
+
+def latest_snapshot_name():
+    manifest = read_manifest(snapshot_dir())
+    return manifest['file'] if manifest else None
+
+class SnapshotPublisher:
+    """Background thread publishing a new snapshot after the dataset version
+    changes. Writes are debounced: a snapshot is published once the version
+    has been stable for `debounce` seconds, or at the latest `max_delay`
+    seconds after the first unpublished change."""
+
+    def __init__(self, app, interval=5, debounce=10, max_delay=60):
+        self.app = app
+        self.interval = interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.published_version = None
+        self._seen_version = None
+        self._changed_at = None
+        self._pending_since = None
+        self._schema_ready = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='snapshot-publisher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.check(time.monotonic())
+            except Exception:
+                self.app.logger.exception('Publishing the toilet snapshot failed')
+
+    def check(self, now):
+        """Publish if due. Returns the new manifest, or None."""
+        if not self._schema_ready:
+            # Started on an outdated database: wait for `flask db-upgrade`
+            schema_version = get_schema_version()
+            if schema_version is None or schema_version < SCHEMA_VERSION:
+                return None
+            self._schema_ready = True
+        if self.published_version is None:
+            manifest = read_manifest(snapshot_dir(self.app))
+            self.published_version = manifest['version'] if manifest else -1
+
+        version, _ = get_dataset_version()
+        if version == self.published_version:
+            self._pending_since = None
+            return None
+        if version != self._seen_version:
+            self._seen_version = version
+            self._changed_at = now
+            if self._pending_since is None:
+                self._pending_since = now
+
+        if now - self._changed_at < self.debounce and now - self._pending_since < self.max_delay:
+            return None
+        manifest = publish_snapshot(snapshot_dir(self.app))
+        self.published_version = manifest['version']
+        self._pending_since = None
+        return manifest
+
+def init_snapshot_publisher(app):
+    if not app.config.get('SNAPSHOT_PUBLISHER'):
+        return
+    publisher = SnapshotPublisher(
+        app,
+        interval=app.config.get('SNAPSHOT_INTERVAL', 5),
+        debounce=app.config.get('SNAPSHOT_DEBOUNCE', 10),
+        max_delay=app.config.get('SNAPSHOT_MAX_DELAY', 60)
+    )
+    app.extensions['snapshot_publisher'] = publisher
+    publisher.start()
@@ -0,0 +1,25 @@
+from sqlalchemy import event
+
+def sqlite_pragmas(config):
+    # busy_timeout goes first so switching the journal mode waits out other connections
+    return [
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))),
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 0))),
+        # A negative cache_size is in KiB rather than pages
+        ('cache_size', -int(config.get('SQLITE_CACHE_SIZE_KB', 2000)))
+    ]
+
+def init_sqlite_pragmas(app, engine):
+    """Apply the SQLITE_* settings to every connection the pool opens."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
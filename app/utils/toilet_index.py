@@ -0,0 +1,127 @@
+import threading
+from flask import current_app
+from app.models.dataset import get_changed_toilet_ids, get_dataset_version
+from app.models.toilet import Toilet
+from app.utils.clusters import ClusterIndex
+from app.utils.geo import chord_to_km, to_unit_vector
+from app.utils.kdtree import KDTree
+
+class NearestToiletIndex:
+    """In-memory k-nearest-neighbour index over all toilets.
+
+    Built once from the Toilet table and kept current by ToiletController,
+    so "closest toilet" lookups never touch the whole table."""
+
+    def __init__(self):
+        self._tree = KDTree()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tree)
+
+    @staticmethod
+    def _entry(toilet):
+        payload = {
+            'accessible': toilet.get_accessibility_consensus(),
+            'has_toilet_paper': toilet.get_toilet_paper_consensus(),
+            'cleanliness': toilet.get_median_cleanliness()
+        }
+        return toilet.id, to_unit_vector(toilet.latitude, toilet.longitude), payload
+
+    def load(self, toilets):
+        items = [self._entry(toilet) for toilet in toilets]
+        with self._lock:
+            self._tree.rebuild(items)
+
+    def add(self, toilet):
+        # Inserts a new toilet or refreshes the attributes of a known one
+        key, point, payload = self._entry(toilet)
+        with self._lock:
+            self._tree.insert(key, point, payload)
+
+    def nearest(self, lat, lng, k, accessible=False, has_toilet_paper=False, min_cleanliness=None):
+        def matches(payload):
+            if accessible and not payload['accessible']:
+                return False
+            if has_toilet_paper and not payload['has_toilet_paper']:
+                return False
+            if min_cleanliness and payload['cleanliness'] < min_cleanliness:
+                return False
+            return True
+
+        with self._lock:
+            results = self._tree.nearest(to_unit_vector(lat, lng), k, matches)
+        return [(key, chord_to_km(distance ** 0.5)) for distance, key, payload in results]
+
+def _cluster_entry(toilet):
+    return (toilet.id, toilet.latitude, toilet.longitude,
+            toilet.get_median_cleanliness(), toilet.get_accessibility_consensus())
+
+# Changes since the last sync beyond which a full rebuild is cheaper
+MAX_INDEX_CATCH_UP = 1000
+
+def _build_indexes(app):
+    nearest_index = NearestToiletIndex()
+    cluster_index = ClusterIndex()
+    # Read the version first: changes racing with the load are applied again
+    # by the next refresh, which is harmless since adds are idempotent
+    version, _ = get_dataset_version()
+    toilets = Toilet.query.all()
+    nearest_index.load(toilets)
+    cluster_index.load(_cluster_entry(toilet) for toilet in toilets)
+    app.extensions['nearest_toilet_index'] = nearest_index
+    app.extensions['toilet_cluster_index'] = cluster_index
+    app.extensions['toilet_index_version'] = version
+
+# Serializes lazy builds, so concurrent first requests build the indexes once
+_build_lock = threading.Lock()
+
+def _ensure_indexes(app):
+    # An app started on an outdated schema skips the build at startup; the
+    # indexes are built on first use once the database has been upgraded
+    if 'toilet_index_version' not in app.extensions:
+        with _build_lock:
+            if 'toilet_index_version' not in app.extensions:
+                _build_indexes(app)
+
+def init_toilet_index(app):
+    # Build every in-memory index from a single pass over the Toilet table
+    with app.app_context():
+        _build_indexes(app)
+
+def refresh_toilet_indexes():
+    """Bring the indexes up to date with changes committed by other
+    processes, using the dataset change log."""
+    app = current_app._get_current_object()
+    _ensure_indexes(app)
+    since = app.extensions['toilet_index_version']
+    version, toilet_ids = get_changed_toilet_ids(since, limit=MAX_INDEX_CATCH_UP + 1)
+    if version == since:
+        return
+    if toilet_ids is None or len(toilet_ids) > MAX_INDEX_CATCH_UP:
+        _build_indexes(app)
+        return
+    for toilet in Toilet.query.filter(Toilet.id.in_(toilet_ids)):
+        index_toilet(toilet)
+    app.extensions['toilet_index_version'] = version
+
+def index_toilet(toilet):
+    """Add a new toilet to the in-memory indexes, or refresh one whose
+    location or consensus values changed."""
+    get_nearest_index().add(toilet)
+    get_cluster_index().add(*_cluster_entry(toilet))
+
+def reindex_toilets(toilet_ids):
+    """Refresh the indexes for toilets changed by this process, loading them
+    in one query."""
+    if toilet_ids:
+        for toilet in Toilet.query.filter(Toilet.id.in_(toilet_ids)):
+            index_toilet(toilet)
+
+def get_nearest_index():
+    _ensure_indexes(current_app)
+    return current_app.extensions['nearest_toilet_index']
+
+def get_cluster_index():
+    _ensure_indexes(current_app)
+    return current_app.extensions['toilet_cluster_index']
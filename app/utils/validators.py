@@ -1,4 +1,8 @@
 import re
+from markupsafe import escape
+
+# Largest value a SQLite INTEGER holds; bigger ids can't even be looked up
+MAX_ID = 2 ** 63 - 1
 
 def validate_coordinates(lat, lng):
     try:
@@ -10,6 +14,31 @@ def validate_coordinates(lat, lng):
     except (ValueError, TypeError):
         raise ValueError("Invalid coordinate format")
 
+def validate_cleanliness(cleanliness):
+    try:
+        rating = int(cleanliness)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cleanliness rating")
+    if not (1 <= rating <= 5):
+        raise ValueError("Invalid cleanliness rating")
+    return rating
+
+def parse_int(value, name, low, high=None):
+    """An integer query parameter within [low, high], with messages fit for
+    API clients."""
+    try:
+        value = int(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"{name} must be an integer")
+    if value < low or (high is not None and value > high):
+        raise ValueError(f"{name} must be between {low} and {high}" if high is not None
+                         else f"{name} must be at least {low}")
+    return value
+
+def sanitize_text(text, max_length=200):
+    # HTML-escaped and trimmed to the column size
+    return escape(text.strip())[:max_length]
+
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
@@ -1,20 +1,93 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from app.controllers.api_controller import ApiController
 from app import csrf
+from app.models.dataset import get_dataset_version
+from app.utils.export import EXPORT_MIMETYPES
+from app.utils.query_counter import query_budget
+from app.utils.response_cache import cached_by_dataset_version
 
 api_bp = Blueprint('api', __name__)
 
 @api_bp.route('/toilets')
 @csrf.exempt
+@cached_by_dataset_version
+@query_budget(1)
 def get_toilets():
     """
-    Get all toilets
+    Get all toilets, optionally limited to a map viewport and filtered by their ratings
     ---
     tags:
       - Toilets
+    parameters:
+      - name: bbox
+        in: query
+        type: string
+        required: false
+        description: Bounding box as minLng,minLat,maxLng,maxLat
+      - name: accessible
+        in: query
+        type: boolean
+        required: false
+        description: Only toilets most reviews say are accessible
+      - name: has_toilet_paper
+        in: query
+        type: boolean
+        required: false
+        description: Only toilets most reviews say have toilet paper
+      - name: min_cleanliness
+        in: query
+        type: integer
+        required: false
+        description: Minimum median cleanliness rating (1-5)
+      - name: min_review_count
+        in: query
+        type: integer
+        required: false
+        description: Minimum number of reviews
+      - name: sort
+        in: query
+        type: string
+        enum: [id, distance, rating]
+        required: false
+        description: >
+          id (default; pages come in id order), distance from lat/lng (or
+          the bbox center when they are not given; results then carry
+          distance_km), or rating (highest median cleanliness first).
+          Compact responses keep the distance and rating order and add a
+          distance_km array; sorted by id they are ordered by grid cell.
+      - name: lat
+        in: query
+        type: number
+        required: false
+        description: Latitude to sort by distance from
+      - name: lng
+        in: query
+        type: number
+        required: false
+        description: Longitude to sort by distance from
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-1000); enables pagination
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: The next_cursor value of the previous page
+      - name: format
+        in: query
+        type: string
+        enum: [json, compact]
+        required: false
+        description: >
+          compact returns parallel arrays instead of a list of objects, with
+          delta-encoded ids and fixed-point coordinates (scale), flags packing
+          cleanliness (bits 0-2), accessible (bit 3) and toilet paper (bit 4),
+          and author indexes into an authors table
     responses:
       200:
-        description: A list of all toilets
+        description: A list of all toilets. Responses carry an ETag and Last-Modified tied to the dataset version.
         schema:
           type: object
           properties:
@@ -41,14 +114,209 @@ def get_toilets():
                     type: integer
                   author:
                     type: string
+      304:
+        description: Not modified since the version given in If-None-Match/If-Modified-Since
+      400:
+        description: Invalid bounding box, filter, sort, pagination parameters or format
       401:
         description: Unauthorized
     """
-    data, status = ApiController.get_toilets()
-    return jsonify(data) if status != 200 else data
+    data, status = ApiController.get_toilets(
+        request.args.get('bbox'),
+        request.args.get('limit'),
+        request.args.get('cursor'),
+        request.args.get('format'),
+        accessible=request.args.get('accessible'),
+        has_toilet_paper=request.args.get('has_toilet_paper'),
+        min_cleanliness=request.args.get('min_cleanliness'),
+        min_review_count=request.args.get('min_review_count'),
+        sort=request.args.get('sort'),
+        lat=request.args.get('lat'),
+        lng=request.args.get('lng')
+    )
+    return jsonify(data), status
+
+@api_bp.route('/toilets/nearest')
+@csrf.exempt
+@query_budget(4)
+def get_nearest_toilets():
+    """
+    Get the toilets closest to a location
+    ---
+    tags:
+      - Toilets
+    parameters:
+      - name: lat
+        in: query
+        type: number
+        required: true
+      - name: lng
+        in: query
+        type: number
+        required: true
+      - name: k
+        in: query
+        type: integer
+        required: false
+        description: Number of toilets to return (1-50, default 5)
+      - name: accessible
+        in: query
+        type: boolean
+        required: false
+        description: Only return accessible toilets
+      - name: has_toilet_paper
+        in: query
+        type: boolean
+        required: false
+        description: Only return toilets with toilet paper
+      - name: min_cleanliness
+        in: query
+        type: integer
+        required: false
+        description: Minimum median cleanliness rating (1-5)
+    responses:
+      200:
+        description: The closest toilets ordered by distance, each with a distance_km field
+      400:
+        description: Invalid parameters
+      401:
+        description: Unauthorized
+    """
+    data, status = ApiController.get_nearest_toilets(
+        request.args.get('lat'),
+        request.args.get('lng'),
+        request.args.get('k', 5),
+        request.args.get('accessible', False),
+        request.args.get('has_toilet_paper', False),
+        request.args.get('min_cleanliness')
+    )
+    return jsonify(data), status
+
+@api_bp.route('/toilets/clusters')
+@csrf.exempt
+@cached_by_dataset_version
+@query_budget(3)
+def get_toilet_clusters():
+    """
+    Get toilets grouped into map clusters for a zoom level
+    ---
+    tags:
+      - Toilets
+    parameters:
+      - name: z
+        in: query
+        type: integer
+        required: true
+        description: Leaflet zoom level
+      - name: bbox
+        in: query
+        type: string
+        required: false
+        description: Bounding box as minLng,minLat,maxLng,maxLat
+      - name: format
+        in: query
+        type: string
+        enum: [json, compact]
+        required: false
+        description: Encoding of the toilet list returned above zoom 14
+    responses:
+      200:
+        description: >
+          Up to zoom 14 a clusters array (count, latitude, longitude,
+          best_cleanliness, any_accessible); above it the individual toilets
+          in the bounding box, as returned by /api/toilets
+      400:
+        description: Invalid zoom level or bounding box
+      401:
+        description: Unauthorized
+    """
+    data, status = ApiController.get_toilet_clusters(
+        request.args.get('z'),
+        request.args.get('bbox'),
+        request.args.get('format')
+    )
+    return jsonify(data), status
+
+@api_bp.route('/toilets/changes')
+@csrf.exempt
+@query_budget(3)
+def get_toilet_changes():
+    """
+    Get the toilets that changed after a dataset version
+    ---
+    tags:
+      - Toilets
+    parameters:
+      - name: since
+        in: query
+        type: integer
+        required: true
+        description: >
+          Dataset version the client last saw, from the X-Dataset-Version
+          header or the version field of a previous call
+    responses:
+      200:
+        description: >
+          The current version and the toilets changed since the given one.
+          With reset set to true the change log no longer reaches back that
+          far and the client should reload everything.
+      400:
+        description: Invalid version
+      401:
+        description: Unauthorized
+    """
+    data, status = ApiController.get_toilet_changes(request.args.get('since'))
+    return jsonify(data), status
+
+@api_bp.route('/toilets/export')
+@csrf.exempt
+@query_budget(1)
+def export_toilets():
+    """
+    Download every toilet as NDJSON or a GeoJSON FeatureCollection
+    ---
+    tags:
+      - Toilets
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, geojson]
+        required: false
+        description: ndjson (default) writes one toilet object per line
+    produces:
+      - application/x-ndjson
+      - application/geo+json
+    responses:
+      200:
+        description: >
+          The full dataset, streamed as it is read from the database.
+          X-Dataset-Version gives the version the export starts from.
+      400:
+        description: Invalid format
+      401:
+        description: Unauthorized
+    """
+    output_format = request.args.get('format') or 'ndjson'
+    chunks, status = ApiController.export_toilets(output_format)
+    if status != 200:
+        return jsonify(chunks), status
+    
+    # The export query itself runs while the body streams, outside the budget
+    version, _ = get_dataset_version()
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_MIMETYPES[output_format],
+        headers={
+            'Content-Disposition': f'attachment; filename=toilets-v{version}.{output_format}',
+            'X-Dataset-Version': str(version)
+        }
+    )
 
 @api_bp.route('/toilet/<int:toilet_id>')
 @csrf.exempt
+@cached_by_dataset_version
+@query_budget(2)
 def get_toilet_details(toilet_id):
     """
     Get details of a specific toilet
@@ -61,11 +329,126 @@ def get_toilet_details(toilet_id):
         type: integer
         required: true
         description: ID of the toilet
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Number of reviews per page (default 20)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: The next_cursor value of the previous page of reviews
+    responses:
+      200:
+        description: Details of the toilet with one page of reviews
+      400:
+        description: Invalid pagination parameters
+      401:
+        description: Unauthorized
+    """
+    data, status = ApiController.get_toilet_details(
+        toilet_id,
+        request.args.get('limit'),
+        request.args.get('cursor')
+    )
+    return jsonify(data), status
+
+@api_bp.route('/search')
+@csrf.exempt
+@cached_by_dataset_version
+@query_budget(2)
+def search_toilets():
+    """
+    Search toilet descriptions and review comments
+    ---
+    tags:
+      - Toilets
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: >
+          Words and "quoted phrases"; a toilet matches when its description
+          or one of its reviews contains all of them. Words match other
+          forms of the same word (station, stations).
+      - name: bbox
+        in: query
+        type: string
+        required: false
+        description: Only toilets inside this bounding box, as minLng,minLat,maxLng,maxLat
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Number of results (1-100, default 20)
+    responses:
+      200:
+        description: Matching toilets, best match first
+      400:
+        description: Missing query, invalid bounding box or limit
+      401:
+        description: Unauthorized
+    """
+    data, status = ApiController.search_toilets(
+        request.args.get('q'),
+        request.args.get('bbox'),
+        request.args.get('limit')
+    )
+    return jsonify(data), status
+
+@api_bp.route('/batch', methods=['POST'])
+@csrf.exempt
+def submit_batch():
+    """
+    Add toilets and reviews in one transaction
+    ---
+    tags:
+      - Toilets
+    consumes:
+      - application/json
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: >
+          Up to 500 items. Toilets take latitude, longitude, description,
+          cleanliness, accessible and has_toilet_paper; reviews take
+          toilet_id (or toilet_key, the key of a toilet item of this or an
+          earlier batch), cleanliness, comment, accessible and
+          has_toilet_paper. An item with a key that was already submitted
+          returns the earlier result instead of being added again, so a
+          failed request can be retried as is.
+        schema:
+          type: object
+          properties:
+            items:
+              type: array
+              items:
+                type: object
+                properties:
+                  type:
+                    type: string
+                    enum: [toilet, review]
+                  key:
+                    type: string
+                    maxLength: 64
     responses:
       200:
-        description: Details of the toilet with reviews
+        description: >
+          A result per item, in order, with status created, duplicate,
+          invalid or not_found and the id of the toilet or review
+      400:
+        description: Not a list of items, or too many
       401:
         description: Unauthorized
+      415:
+        description: The body is not JSON
     """
-    data, status = ApiController.get_toilet_details(toilet_id)
-    return jsonify(data) if status != 200 else data
\ No newline at end of file
+    # Requiring a JSON body keeps plain cross-site form posts out, since
+    # the endpoint is exempt from the CSRF token check
+    if not request.is_json:
+        return jsonify({"error": "Expected an application/json body"}), 415
+    data, status = ApiController.submit_batch(request.get_json(silent=True))
+    return jsonify(data), status
@@ -1,4 +1,6 @@
 from flask import Blueprint, flash, redirect, url_for
+from app.utils.group_commit import GroupCommitBusy
+from app.utils.password_hashing import PasswordHashingBusy
 
 errors_bp = Blueprint('errors', __name__)
 
@@ -8,3 +10,13 @@ def bad_request(error):
         flash('Security token missing. Please try again.')
         return redirect(url_for('main.main'))
     return "Bad Request", 400
+
+@errors_bp.app_errorhandler(PasswordHashingBusy)
+def password_hashing_busy(error):
+    # Too many logins/signups at once: shed them instead of queueing
+    return "Too many login attempts right now, please try again in a moment", 503, {'Retry-After': '2'}
+
+@errors_bp.app_errorhandler(GroupCommitBusy)
+def group_commit_busy(error):
+    # The writer is backed up: free the worker instead of waiting on it
+    return "Too many submissions right now, please try again in a moment", 503, {'Retry-After': '2'}
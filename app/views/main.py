@@ -1,17 +1,57 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from app.models.toilet import Toilet
+import gzip
+from flask import (Blueprint, Response, abort, flash, redirect, render_template, request,
+                   send_from_directory, session, url_for)
+from werkzeug.security import safe_join
 from app.controllers.toilet_controller import ToiletController
+from app.utils.clusters import MAX_CLUSTER_ZOOM
+from app.utils.map_bootstrap import MAP_VIEW_COOKIE, current_map_view, map_bootstrap
+from app.utils.query_counter import query_budget
+from app.utils.snapshot import SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX, latest_snapshot_name, snapshot_dir
+
+# Snapshot names are content hashes, so browsers may keep them forever
+SNAPSHOT_MAX_AGE = 365 * 24 * 3600
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/main')
+# The dataset version plus what /api/toilets/clusters runs on a cache miss
+@query_budget(4)
 def main():
     if 'user_id' not in session:
         flash('Please log in first')
         return redirect(url_for('auth.login'))
     
-    toilets = Toilet.query.all()
-    return render_template('main.html', toilets=toilets)
+    name = latest_snapshot_name()
+    snapshot_url = url_for('main.toilet_snapshot', name=name) if name else None
+    # The markers around the last viewed area come inline with the page
+    map_view = current_map_view()
+    return render_template('main.html', snapshot_url=snapshot_url, max_cluster_zoom=MAX_CLUSTER_ZOOM,
+                           map_view=map_view, map_view_cookie=MAP_VIEW_COOKIE,
+                           map_bootstrap=map_bootstrap(map_view))
+
+@main_bp.route('/snapshots/<name>')
+def toilet_snapshot(name):
+    if 'user_id' not in session:
+        abort(401)
+    if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+        abort(404)
+    
+    directory = snapshot_dir()
+    if 'gzip' in request.accept_encodings:
+        # Sent as stored; the compression hook leaves encoded responses alone
+        response = send_from_directory(directory, name, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        path = safe_join(directory, name)
+        try:
+            with gzip.open(path) as f:
+                response = Response(f.read(), mimetype='application/json')
+        except (OSError, TypeError):
+            abort(404)
+    
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'private, max-age={SNAPSHOT_MAX_AGE}, immutable'
+    return response
 
 @main_bp.route('/add_toilet', methods=['POST'])
 def add_toilet():
@@ -0,0 +1,30 @@
+import hmac
+import ipaddress
+from flask import Blueprint, Response, abort, current_app, request
+from app.utils.metrics import get_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+def _is_local_request():
+    # Forwarded requests count as remote even from a proxy on this host
+    if request.headers.get('X-Forwarded-For') or request.headers.get('Forwarded'):
+        return False
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+@metrics_bp.route('/metrics')
+def metrics():
+    # Prometheus scrape target; when METRICS_TOKEN is set the scraper has to
+    # send it as a bearer token, otherwise only local scrapes are served
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        expected = f'Bearer {token}'
+        # Bytes, since compare_digest rejects str with non-ASCII characters
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                   expected.encode('utf-8')):
+            abort(401)
+    elif not _is_local_request():
+        abort(403)
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
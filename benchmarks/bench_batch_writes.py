@@ -0,0 +1,94 @@
+"""Replaying queued offline submissions: one form POST per item vs one call
+to the batch endpoint.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_batch_writes [--items 200] [--synchronous FULL]
+
+Each round replays the same number of items (a tenth of them new toilets,
+the rest reviews of existing ones). Only server time is measured; a real
+client also pays a network round trip per request, which the batch saves
+as well.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from app import create_app, db
+from benchmarks.datasets import CITY_CENTER, SCALES, generate
+
+ROUNDS = 5
+
+def queued_items(rng, count, toilets, round_number):
+    items = []
+    for i in range(count):
+        key = f'{round_number}-{i}'
+        if i % 10 == 0:
+            items.append({'type': 'toilet', 'key': key, 'description': f'Queued {key}', 'cleanliness': 3,
+                          'latitude': CITY_CENTER[0] + rng.uniform(-0.05, 0.05),
+                          'longitude': CITY_CENTER[1] + rng.uniform(-0.05, 0.05)})
+        else:
+            items.append({'type': 'review', 'key': key, 'toilet_id': rng.randint(1, toilets),
+                          'cleanliness': rng.randint(1, 5), 'comment': 'Queued', 'accessible': True})
+    return items
+
+def replay_forms(client, items):
+    for item in items:
+        form = {key: str(value) for key, value in item.items() if key not in ('type', 'key', 'toilet_id')}
+        if item['type'] == 'toilet':
+            response = client.post('/add_toilet', data=form)
+        else:
+            response = client.post(f"/add_review/{item['toilet_id']}", data=form)
+        if response.status_code != 302:
+            raise RuntimeError(f'{response.request.path} returned {response.status_code}')
+
+def replay_batch(client, items):
+    response = client.post('/api/batch', json={'items': items})
+    if response.status_code != 200 or response.get_json()['counts'].get('created') != len(items):
+        raise RuntimeError(f'/api/batch returned {response.status_code}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--scale', default='small', choices=sorted(SCALES))
+    parser.add_argument('--synchronous', default='FULL', help='SQLite synchronous setting, FULL syncs every commit.')
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+            'SQLITE_SYNCHRONOUS': args.synchronous,
+            'WTF_CSRF_ENABLED': False,
+            'API_DOCS': False
+        })
+        with app.app_context():
+            generate(SCALES[args.scale])
+        toilets = SCALES[args.scale].toilets
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        rng = random.Random(0)
+        print(f"{'replay':>8} {'items':>6} {'requests':>9} {'ms':>9} {'items/s':>9}")
+        for name, replay, requests in (('forms', replay_forms, args.items), ('batch', replay_batch, 1)):
+            timings = []
+            for round_number in range(ROUNDS):
+                items = queued_items(rng, args.items, toilets, f'{name}{round_number}')
+                start = time.perf_counter()
+                replay(client, items)
+                timings.append((time.perf_counter() - start) * 1000)
+            elapsed = statistics.median(timings)
+            print(f'{name:>8} {args.items:>6} {requests:>9} {elapsed:>9.1f} {args.items / elapsed * 1000:>9.0f}')
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
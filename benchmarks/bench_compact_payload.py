@@ -0,0 +1,56 @@
+"""Compare the regular /api/toilets JSON with format=compact.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_compact_payload [--sizes 10000 100000]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from app.utils.compact import encode_compact
+
+def make_toilets(count, seed=42):
+    # Serialized toilets as ApiController.get_toilets returns them, spread over a city
+    rng = random.Random(seed)
+    authors = [f'user_{i}' for i in range(max(count // 20, 1))]
+    return [{
+        'id': toilet_id,
+        'latitude': 42.6977 + rng.uniform(-0.1, 0.1),
+        'longitude': 23.3219 + rng.uniform(-0.15, 0.15),
+        'description': rng.choice(['Mall', 'Station', 'Park', 'Cafe', 'Museum']) + f' toilet {toilet_id}',
+        'accessible': rng.random() < 0.4,
+        'has_toilet_paper': rng.random() < 0.7,
+        'cleanliness': rng.randint(1, 5),
+        'review_count': rng.randint(0, 30),
+        'author': rng.choice(authors)
+    } for toilet_id in range(1, count + 1)]
+
+def measure(encode, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        best = min(best, time.perf_counter() - start)
+    return body, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'toilets':>8} {'format':>8} {'bytes':>12} {'gzip bytes':>12} {'encode ms':>10}")
+    for size in args.sizes:
+        toilets = make_toilets(size)
+        encoders = {
+            'json': lambda: json.dumps({'toilets': toilets}, separators=(',', ':')).encode(),
+            'compact': lambda: json.dumps(encode_compact(toilets), separators=(',', ':')).encode()
+        }
+        for name, encode in encoders.items():
+            body, seconds = measure(encode, args.repeat)
+            print(f'{size:>8} {name:>8} {len(body):>12,} {len(gzip.compress(body)):>12,} {seconds * 1000:>10.1f}')
+
+if __name__ == '__main__':
+    main()
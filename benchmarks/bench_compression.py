@@ -0,0 +1,54 @@
+"""CPU cost vs bytes saved for response compression.
+
+Compresses the /api/toilets JSON at several sizes and the static marker
+images with each available encoder and level. Run from the repository root:
+
+    python -m benchmarks.bench_compression [--sizes 1000 10000 100000]
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from app.utils.compression import _brotli, _gzip, brotli
+from benchmarks.bench_compact_payload import make_toilets
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'static')
+
+def encoders():
+    yield 'gzip-1', lambda body: _gzip(body, 1)
+    yield 'gzip-6', lambda body: _gzip(body, 6)
+    yield 'gzip-9', lambda body: _gzip(body, 9)
+    if brotli is not None:
+        yield 'br-1', lambda body: _brotli(body, 1)
+        yield 'br-5', lambda body: _brotli(body, 5)
+        yield 'br-9', lambda body: _brotli(body, 9)
+
+def payloads(sizes):
+    for size in sizes:
+        body = json.dumps({'toilets': make_toilets(size)}, separators=(',', ':')).encode()
+        yield f'toilets-{size}', body
+    for path in sorted(glob.glob(os.path.join(STATIC_DIR, '*.png')))[:3]:
+        with open(path, 'rb') as f:
+            yield os.path.basename(path), f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'payload':>16} {'encoder':>8} {'bytes in':>12} {'bytes out':>12} {'saved':>7} {'ms':>9} {'MB/s':>8}")
+    for name, body in payloads(args.sizes):
+        for encoder_name, encode in encoders():
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                compressed = encode(body)
+                best = min(best, time.perf_counter() - start)
+            saved = 1 - len(compressed) / len(body)
+            print(f'{name:>16} {encoder_name:>8} {len(body):>12,} {len(compressed):>12,} '
+                  f'{saved:>6.1%} {best * 1000:>9.2f} {len(body) / best / 1e6:>8.1f}')
+
+if __name__ == '__main__':
+    main()
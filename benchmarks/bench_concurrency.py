@@ -0,0 +1,106 @@
+"""Throughput of /api/toilets readers while other threads submit reviews,
+with the SQLite rollback journal vs WAL.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_concurrency [--readers 8] [--writers 2] [--seconds 5]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from flask import session
+from app import create_app, db
+from app.controllers.toilet_controller import ToiletController
+from app.models.toilet import Toilet
+from app.models.user import User
+
+def make_app(db_path, journal_mode, toilets):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLITE_JOURNAL_MODE': journal_mode,
+        # Readers should wait on the database, not the response cache
+        'RESPONSE_CACHE_MAX_ENTRIES': 0
+    })
+    with app.app_context():
+        user = User(username='bench', email='bench@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add_all(Toilet(latitude=42.6977 + i * 1e-4, longitude=23.3219,
+                                  description=f'Toilet {i}', user_id=user.id)
+                           for i in range(toilets))
+        db.session.commit()
+        app.config['BENCH_USER_ID'] = user.id
+    return app
+
+def reader(app, stop, counts):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = app.config['BENCH_USER_ID']
+    done = failed = 0
+    while not stop.is_set():
+        if client.get('/api/toilets').status_code == 200:
+            done += 1
+        else:
+            failed += 1
+    counts.append(('read', done, failed))
+
+def writer(app, stop, counts, toilets):
+    done = failed = 0
+    with app.test_request_context():
+        session['user_id'] = app.config['BENCH_USER_ID']
+        while not stop.is_set():
+            toilet_id = done % toilets + 1
+            if ToiletController.add_review(toilet_id, True, True, '4', 'benchmark review'):
+                done += 1
+            else:
+                failed += 1
+            db.session.remove()
+    counts.append(('write', done, failed))
+
+def run(journal_mode, readers, writers, seconds, toilets):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = make_app(db_path, journal_mode, toilets)
+        stop = threading.Event()
+        counts = []
+        threads = [threading.Thread(target=reader, args=(app, stop, counts)) for _ in range(readers)]
+        threads += [threading.Thread(target=writer, args=(app, stop, counts, toilets)) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        with app.app_context():
+            db.engine.dispose()
+        totals = {}
+        for kind, done, failed in counts:
+            total_done, total_failed = totals.get(kind, (0, 0))
+            totals[kind] = (total_done + done, total_failed + failed)
+        return totals
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--toilets', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'journal':>8} {'reads/s':>9} {'writes/s':>9} {'read errors':>12} {'write errors':>13}")
+    for journal_mode in ('DELETE', 'WAL'):
+        totals = run(journal_mode, args.readers, args.writers, args.seconds, args.toilets)
+        reads, read_errors = totals.get('read', (0, 0))
+        writes, write_errors = totals.get('write', (0, 0))
+        print(f'{journal_mode:>8} {reads / args.seconds:>9.1f} {writes / args.seconds:>9.1f} '
+              f'{read_errors:>12} {write_errors:>13}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Peak memory of dumping every toilet: building the /api/toilets list in
+memory vs the streaming export.
+
+Run from the repository root (filling the database takes a while at 1M rows):
+
+    python -m benchmarks.bench_export_memory [--rows 1000000]
+
+Times are taken under tracemalloc and are several times slower than normal.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from app import create_app, db
+from app.controllers.api_controller import _serialize_toilet
+from app.models.toilet import Toilet, initial_aggregates
+from app.models.user import User
+from app.utils.export import export_toilets
+from app.utils.geo import grid_cell
+
+def fill(rows, seed=42):
+    rng = random.Random(seed)
+    user = User(username='bench', email='bench@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    now = datetime.utcnow()
+    for start in range(0, rows, 10000):
+        batch = []
+        for toilet_id in range(start, min(start + 10000, rows)):
+            lat, lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+            cleanliness, accessible, paper = rng.randint(1, 5), rng.random() < 0.4, rng.random() < 0.7
+            batch.append(dict(initial_aggregates(cleanliness, accessible, paper),
+                              latitude=lat, longitude=lng, description=f'Toilet {toilet_id}',
+                              accessible=accessible, has_toilet_paper=paper, cleanliness=cleanliness,
+                              timestamp=now, user_id=user.id, grid_cell=grid_cell(lat, lng)))
+        db.session.execute(Toilet.__table__.insert(), batch)
+        db.session.commit()
+
+def materialized():
+    # What /api/toilets does without a bbox or limit
+    toilets = Toilet.query.options(joinedload(Toilet.author)).all()
+    return len(json.dumps({'toilets': [_serialize_toilet(toilet) for toilet in toilets]}))
+
+def streamed(output_format):
+    return sum(len(chunk) for chunk in export_toilets(output_format))
+
+def measure(function, *args):
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}'})
+        with app.app_context():
+            fill(args.rows)
+            print(f"{'method':>16} {'output MB':>10} {'seconds':>8} {'peak MB':>8}")
+            for name, function, function_args in [
+                ('stream ndjson', streamed, ('ndjson',)),
+                ('stream geojson', streamed, ('geojson',)),
+                ('list + dumps', materialized, ())
+            ]:
+                size, elapsed, peak = measure(function, *function_args)
+                print(f'{name:>16} {size / 1e6:>10.1f} {elapsed:>8.1f} {peak / 1e6:>8.1f}')
+            db.engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
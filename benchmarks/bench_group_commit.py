@@ -0,0 +1,99 @@
+"""Review submission throughput and latency with a commit per request vs
+the group commit writer.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_group_commit [--clients 32] [--seconds 5] [--synchronous FULL]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from flask import session
+from app import create_app, db
+from app.controllers.toilet_controller import ToiletController
+from app.models.toilet import Toilet
+from app.models.user import User
+
+def make_app(db_path, group_commit, synchronous, toilets):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLITE_SYNCHRONOUS': synchronous,
+        'GROUP_COMMIT': group_commit,
+        'API_DOCS': False
+    })
+    with app.app_context():
+        user = User(username='bench', email='bench@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add_all(Toilet(latitude=42.6977 + i * 1e-4, longitude=23.3219,
+                                  description=f'Toilet {i}', user_id=user.id)
+                           for i in range(toilets))
+        db.session.commit()
+        app.config['BENCH_USER_ID'] = user.id
+    return app
+
+def client(app, stop, toilets, results, offset):
+    done = failed = 0
+    latencies = []
+    with app.test_request_context():
+        session['user_id'] = app.config['BENCH_USER_ID']
+        while not stop.is_set():
+            start = time.perf_counter()
+            if ToiletController.add_review((done + offset) % toilets + 1, True, False, '4', 'benchmark'):
+                done += 1
+                latencies.append(time.perf_counter() - start)
+            else:
+                failed += 1
+            db.session.remove()
+            session.pop('_flashes', None)
+    results.append((done, failed, latencies))
+
+def run(group_commit, synchronous, clients, seconds, toilets):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = make_app(db_path, group_commit, synchronous, toilets)
+        stop = threading.Event()
+        results = []
+        threads = [threading.Thread(target=client, args=(app, stop, toilets, results, i * 7))
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        writer = app.extensions.get('group_commit')
+        if writer is not None:
+            writer.stop()
+        with app.app_context():
+            db.engine.dispose()
+        done = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        latencies = sorted(latency for result in results for latency in result[2])
+        p50 = latencies[len(latencies) // 2] if latencies else float('nan')
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else float('nan')
+        batch = writer.committed / writer.batches if writer and writer.batches else 1
+        return done / seconds, failed, p50, p95, batch
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--toilets', type=int, default=500)
+    parser.add_argument('--synchronous', default='FULL', help='SQLite synchronous setting, FULL syncs every commit.')
+    args = parser.parse_args()
+
+    print(f"{'commit':>12} {'reviews/s':>10} {'failed':>7} {'p50 ms':>8} {'p95 ms':>8} {'rows/commit':>12}")
+    for name, group_commit in [('per request', False), ('group', True)]:
+        rate, failed, p50, p95, batch = run(group_commit, args.synchronous, args.clients, args.seconds, args.toilets)
+        print(f'{name:>12} {rate:>10.1f} {failed:>7} {p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {batch:>12.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Login throughput, shed logins and latency of other pages while many
+clients log in at once, with hashing inline vs on the bounded pool.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_login [--clients 16] [--seconds 5]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from app import create_app, db
+from app.models.user import User
+
+def make_app(db_path, workers, queue):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'WTF_CSRF_ENABLED': False,
+        'PASSWORD_HASH_WORKERS': workers,
+        'PASSWORD_HASH_QUEUE': queue
+    })
+    with app.app_context():
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+    return app
+
+def login_client(app, stop, results):
+    client = app.test_client()
+    ok = shed = 0
+    while not stop.is_set():
+        status = client.post('/login', data={'username': 'bench', 'password': 'password123'}).status_code
+        if status == 302:
+            ok += 1
+        elif status == 503:
+            shed += 1
+    results.append((ok, shed))
+
+def page_client(app, stop, latencies):
+    # A visitor loading a page that needs no hashing
+    client = app.test_client()
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get('/login')
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+def run(workers, queue, clients, seconds):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = make_app(db_path, workers, queue)
+        stop = threading.Event()
+        results, latencies = [], []
+        threads = [threading.Thread(target=login_client, args=(app, stop, results)) for _ in range(clients)]
+        threads.append(threading.Thread(target=page_client, args=(app, stop, latencies)))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        with app.app_context():
+            db.engine.dispose()
+        ok = sum(result[0] for result in results)
+        shed = sum(result[1] for result in results)
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else float('nan')
+        return ok / seconds, shed / seconds, statistics.median(latencies), p95
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 4))
+    parser.add_argument('--queue', type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'hashing':>12} {'logins/s':>9} {'shed/s':>7} {'page p50 ms':>12} {'page p95 ms':>12}")
+    for name, workers in [('inline', 0), (f'pool x{args.workers}', args.workers)]:
+        logins, shed, p50, p95 = run(workers, args.queue, args.clients, args.seconds)
+        print(f'{name:>12} {logins:>9.1f} {shed:>7.1f} {p50 * 1000:>12.1f} {p95 * 1000:>12.1f}')
+
+if __name__ == '__main__':
+    main()
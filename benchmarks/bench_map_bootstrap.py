@@ -0,0 +1,89 @@
+"""Server time to the first map marker: the old page (loading every toilet
+through the ORM, then fetching the markers in a second request) vs the page
+with the markers around the last viewed area embedded.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_map_bootstrap [--scale medium] [--rtt-ms 50]
+
+The estimate adds one network round trip per request to the server time;
+browser parsing and Leaflet drawing are the same either way and left out.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from app import create_app, db
+from app.models.toilet import Toilet
+from app.utils.map_bootstrap import viewport_bbox
+from app.utils.toilet_index import init_toilet_index
+from benchmarks.datasets import CITY_CENTER, SCALES, generate
+
+RUNS = 30
+
+def timed(function):
+    timings = []
+    result = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='medium', choices=sorted(SCALES))
+    parser.add_argument('--rtt-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'API_DOCS': False})
+        with app.app_context():
+            generate(SCALES[args.scale])
+        init_toilet_index(app)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        def full_table_load():
+            # What the old main view did on every page load
+            with app.app_context():
+                toilets = Toilet.query.all()
+                db.session.remove()
+                return len(toilets)
+
+        print(f"{'zoom':>4} {'page':>8} {'page KB':>8} {'server ms':>10} {'requests':>9} {'est. first marker ms':>21}")
+        for zoom in (13, 16):
+            view = {'latitude': CITY_CENTER[0], 'longitude': CITY_CENTER[1], 'zoom': zoom}
+            client.set_cookie('map_view', f'{CITY_CENTER[0]},{CITY_CENTER[1]},{zoom}')
+            bbox = ','.join(map(str, viewport_bbox(view)))
+
+            app.config['MAP_BOOTSTRAP'] = False
+            page_ms, page = timed(lambda: client.get('/main'))
+            orm_ms, _ = timed(full_table_load)
+            fetch_ms, _ = timed(lambda: client.get('/api/toilets/clusters',
+                                                   query_string={'z': zoom, 'bbox': bbox, 'format': 'compact'}))
+            before = page_ms + orm_ms + fetch_ms
+            print(f'{zoom:>4} {"before":>8} {len(page.data) / 1024:>8.1f} {before:>10.1f} {2:>9} '
+                  f'{before + 2 * args.rtt_ms:>21.1f}')
+
+            app.config['MAP_BOOTSTRAP'] = True
+            cache = app.extensions['response_cache']
+            # Cold: the first page after a data change builds the payload
+            cold, page = timed(lambda: (cache.clear(), client.get('/main'))[1])
+            after, page = timed(lambda: client.get('/main'))
+            for name, server_ms in (('cold', cold), ('cached', after)):
+                print(f'{zoom:>4} {name:>8} {len(page.data) / 1024:>8.1f} {server_ms:>10.1f} {1:>9} '
+                      f'{server_ms + args.rtt_ms:>21.1f}')
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
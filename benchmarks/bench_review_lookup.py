@@ -0,0 +1,106 @@
+"""Review lookups on a database that predates the review/toilet foreign key
+indexes, before and after `flask db-upgrade`.
+
+Run from the repository root (filling the database takes a while at 1M reviews):
+
+    python -m benchmarks.bench_review_lookup [--reviews 1000000] [--toilets 20000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import text
+from app import create_app, db
+from app.migrations import upgrade
+from app.models.review import Review
+from app.models.schema import set_schema_version
+from app.models.toilet import Toilet, initial_aggregates
+from app.models.user import User
+from app.utils.geo import grid_cell
+
+USERS = 500
+LOOKUPS = 50
+# Indexes missing from databases created before the migrations existed
+LEGACY_DROPPED = ['ix_review_toilet_id_id', 'ix_review_user_id', 'ix_toilet_user_id',
+                  'ix_toilet_latitude_longitude']
+
+def fill(toilets, reviews, seed=42):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'}
+        for i in range(USERS)
+    ])
+    batch = []
+    for toilet_id in range(toilets):
+        lat, lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+        batch.append(dict(initial_aggregates(3, False, False), latitude=lat, longitude=lng,
+                          description=f'Toilet {toilet_id}', cleanliness=3, accessible=False,
+                          has_toilet_paper=False, timestamp=now, user_id=rng.randint(1, USERS),
+                          grid_cell=grid_cell(lat, lng)))
+    db.session.execute(Toilet.__table__.insert(), batch)
+    db.session.commit()
+
+    # Aggregates don't matter here, so skip the per-review mapper events
+    for start in range(0, reviews, 50000):
+        db.session.execute(Review.__table__.insert(), [
+            {'toilet_id': rng.randint(1, toilets), 'user_id': rng.randint(1, USERS),
+             'cleanliness': rng.randint(1, 5), 'accessible': rng.random() < 0.4,
+             'has_toilet_paper': rng.random() < 0.7, 'comment': 'benchmark', 'timestamp': now}
+            for _ in range(min(50000, reviews - start))
+        ])
+        db.session.commit()
+
+def measure(toilets, seed=7):
+    # Median time of the lazy loads behind toilet.reviews and user.reviews
+    rng = random.Random(seed)
+    results = {}
+    for name, model, count in [('toilet.reviews', Toilet, toilets), ('user.reviews', User, USERS)]:
+        timings = []
+        for _ in range(LOOKUPS):
+            instance = db.session.get(model, rng.randint(1, count))
+            start = time.perf_counter()
+            len(instance.reviews)
+            timings.append(time.perf_counter() - start)
+            db.session.expunge_all()
+        results[name] = sorted(timings)[len(timings) // 2]
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--toilets', type=int, default=20000)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'API_DOCS': False})
+        with app.app_context():
+            fill(args.toilets, args.reviews)
+            with db.engine.begin() as connection:
+                for name in LEGACY_DROPPED:
+                    connection.execute(text(f'DROP INDEX {name}'))
+                set_schema_version(connection, 0)
+
+            before = measure(args.toilets)
+            start = time.perf_counter()
+            upgrade()
+            migrate = time.perf_counter() - start
+            after = measure(args.toilets)
+
+            print(f'{args.reviews} reviews, {args.toilets} toilets, {USERS} users; '
+                  f'migration took {migrate:.1f} s')
+            print(f"{'lookup':>16} {'before ms':>10} {'after ms':>10}")
+            for name in before:
+                print(f'{name:>16} {before[name] * 1000:>10.2f} {after[name] * 1000:>10.2f}')
+            db.engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Search latency of the FTS5 index vs the LIKE fallback, over toilet
+descriptions and review comments.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_search [--scale large]
+
+The large scale has 1M reviews. Filling it and building the index take a
+few minutes; both times are printed.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from app import create_app, db
+from app.models.search import rebuild_search_index
+from app.utils.search import search_toilets
+from benchmarks.datasets import CITY_CENTER, SCALES, generate
+
+# Common, rare, multi-term, phrase and no-match queries
+QUERIES = ['station', 'attendant', 'free clean', '"ask staff for the key"', 'renovated stadium', 'jacuzzi']
+
+# A viewport of about 4 x 4 km around the centre
+BBOX = (CITY_CENTER[1] - 0.025, CITY_CENTER[0] - 0.02, CITY_CENTER[1] + 0.025, CITY_CENTER[0] + 0.02)
+
+def timed(function, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='large', choices=sorted(SCALES))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}', 'API_DOCS': False})
+        with app.app_context():
+            start = time.perf_counter()
+            generate(SCALES[args.scale], text=True)
+            print(f'Filled {args.scale} ({SCALES[args.scale].reviews} reviews) in {time.perf_counter() - start:.0f} s')
+            start = time.perf_counter()
+            indexed = rebuild_search_index(db.session.connection())
+            db.session.commit()
+            print(f'Indexed {indexed} texts in {time.perf_counter() - start:.1f} s')
+
+            print(f"{'query':>26} {'area':>5} {'results':>8} {'fts5 ms':>9} {'like ms':>9}")
+            for query in QUERIES:
+                for area, bbox in (('all', None), ('bbox', BBOX)):
+                    fts_ms, found = timed(lambda: search_toilets(query, bbox, full_text=True), args.runs)
+                    like_ms, _ = timed(lambda: search_toilets(query, bbox, full_text=False), args.runs)
+                    print(f'{query:>26} {area:>5} {len(found):>8} {fts_ms:>9.1f} {like_ms:>9.1f}')
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Throughput and latency of map traffic served by the old entry point
+(`python app.py`, the threaded Werkzeug development server) vs
+`gunicorn wsgi:app` with preloaded, warmed-up, pre-forked workers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_serving [--scale medium] [--clients 16] [--seconds 10]
+    python -m benchmarks.bench_serving --workers 4 --threads 2
+
+Both servers run as subprocesses on a seeded dataset and are driven by
+--clients client processes on the same machine, so the client load takes
+CPU away from the servers; give them a few cores. Each request opens a new
+connection, as the development server doesn't keep them alive.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from app import create_app, db
+from benchmarks.datasets import CITY_CENTER, SCALES, generate
+
+READY_TIMEOUT = 300
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def session_cookie(app, user_id):
+    # Signed like a real login; nothing in the mix needs more than a user id
+    return app.session_interface.get_signing_serializer(app).dumps({'user_id': user_id})
+
+def request(port, path, cookie):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', path, headers={'Cookie': f'session={cookie}',
+                                                 'Accept-Encoding': 'gzip, deflate, br'})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+def random_path(rng, toilets):
+    # What the map page and the API clients ask for
+    lat = CITY_CENTER[0] + rng.uniform(-0.05, 0.05)
+    lng = CITY_CENTER[1] + rng.uniform(-0.05, 0.05)
+    kind = rng.random()
+    if kind < 0.1:
+        return '/main'
+    if kind < 0.3:
+        return '/api/toilets?format=compact'
+    if kind < 0.5:
+        return f'/api/toilets/nearest?lat={lat}&lng={lng}'
+    if kind < 0.7:
+        return f'/api/toilet/{rng.randint(1, toilets)}'
+    return f'/api/toilets/clusters?format=compact&z=15&bbox={lng - 0.01},{lat - 0.01},{lng + 0.01},{lat + 0.01}'
+
+def client(args):
+    port, cookie, toilets, seconds, seed = args
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        path = random_path(rng, toilets)
+        start = time.perf_counter()
+        try:
+            ok = request(port, path, cookie) == 200
+        except OSError:
+            ok = False
+        if ok:
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            errors += 1
+    return latencies, errors
+
+def wait_until_ready(process, port):
+    start = time.monotonic()
+    while time.monotonic() - start < READY_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with status {process.returncode}')
+        try:
+            if request(port, '/login', '') == 200:
+                return time.monotonic() - start
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError('Server did not start')
+
+def stop(process):
+    # The development server's reloader runs the app in a child process
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+def measure(name, command, env, cookie, scale, args):
+    port = free_port()
+    env = dict(env, PORT=str(port), WEB_BIND=f'127.0.0.1:{port}')
+    process = subprocess.Popen(command, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = wait_until_ready(process, port)
+        start = time.perf_counter()
+        request(port, '/main', cookie)
+        first_page = (time.perf_counter() - start) * 1000
+
+        jobs = [(port, cookie, scale.toilets, args.seconds, seed) for seed in range(args.clients)]
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.map(client, jobs)
+    finally:
+        stop(process)
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float('nan')
+    print(f'{name:>10} {ready:>8.1f} {first_page:>15.1f} {len(latencies) / args.seconds:>8.0f} '
+          f'{statistics.median(latencies) if latencies else float("nan"):>8.1f} {p99:>8.1f} {errors:>7}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='medium', choices=sorted(SCALES))
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        uri = f'sqlite:///{db_path}'
+        app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'API_DOCS': False})
+        with app.app_context():
+            generate(SCALES[args.scale])
+            db.engine.dispose()
+        cookie = session_cookie(app, 1)
+
+        env = dict(os.environ, DATABASE_URL=uri, SECRET_KEY=app.config['SECRET_KEY'],
+                   WEB_WORKERS=str(args.workers), WEB_THREADS=str(args.threads))
+        print(f'{args.scale}: {args.clients} clients for {args.seconds:.0f} s, gunicorn with '
+              f'{args.workers} workers x {args.threads} threads, {os.cpu_count()} CPUs')
+        print(f"{'server':>10} {'ready s':>8} {'first /main ms':>15} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'errors':>7}")
+        measure('app.py', [sys.executable, 'app.py'], env, cookie, SCALES[args.scale], args)
+        measure('gunicorn', [sys.executable, '-m', 'gunicorn', 'wsgi:app'], env, cookie,
+                SCALES[args.scale], args)
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Time from process start to the first served request, in fresh
+interpreters, with the API docs built eagerly (as create_app used to),
+lazily (the default) and disabled.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1]})
+if sys.argv[2] == 'eager':
+    from flasgger import Swagger
+    from app.utils.api_docs import SWAGGER_TEMPLATE
+    app.wsgi_app = app.wsgi_app.wsgi_app
+    Swagger(app, template=SWAGGER_TEMPLATE)
+created = time.perf_counter()
+client = app.test_client()
+assert client.get('/login').status_code == 200
+served = time.perf_counter()
+docs = None
+if sys.argv[2] != 'off':
+    assert client.get('/apispec_1.json').status_code == 200
+    docs = time.perf_counter() - served
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': served - created, 'first_docs': docs}))
+'''
+
+def run_once(database_uri, mode):
+    env = dict(os.environ, API_DOCS='0' if mode == 'off' else '1')
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, database_uri, mode], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    # The child's last line; the docs request happens after the first one is served
+    phases = json.loads(output.strip().splitlines()[-1])
+    phases['total'] = total - (phases['first_docs'] or 0)
+    return phases
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    database_uri = f'sqlite:///{db_path}'
+    try:
+        # Create the schema once so every measured start sees an existing database
+        run_once(database_uri, 'off')
+        print(f"{'api docs':>9} {'import ms':>10} {'create_app ms':>14} {'1st request ms':>15} "
+              f"{'to served ms':>13} {'1st /apispec ms':>16}")
+        for mode in ('eager', 'lazy', 'off'):
+            runs = [run_once(database_uri, mode) for _ in range(args.runs)]
+            median = {key: statistics.median(run[key] or 0 for run in runs) for key in runs[0]}
+            docs = f"{median['first_docs'] * 1000:>16.1f}" if mode != 'off' else f"{'-':>16}"
+            print(f"{mode:>9} {median['import'] * 1000:>10.1f} {median['create_app'] * 1000:>14.1f} "
+                  f"{median['first_request'] * 1000:>15.1f} {median['total'] * 1000:>13.1f} {docs}")
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
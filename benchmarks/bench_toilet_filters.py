@@ -0,0 +1,87 @@
+"""Finding toilets by their ratings: downloading the full list and filtering
+it on the client vs filters and sorting on /api/toilets.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_toilet_filters [--scale medium]
+
+Client-side filtering is timed as the full list request plus the filter in
+Python; transfer time of the larger response is not included.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from app import create_app, db
+from benchmarks.datasets import CITY_CENTER, SCALES, generate
+
+RUNS = 20
+
+# (name, query parameters, the same filter applied to a full list entry)
+QUERIES = [
+    ('accessible+paper+clean>=4', {'accessible': 'true', 'has_toilet_paper': 'true', 'min_cleanliness': 4},
+     lambda t: t['accessible'] and t['has_toilet_paper'] and t['cleanliness'] >= 4),
+    ('reviews>=20', {'min_review_count': 20}, lambda t: t['review_count'] >= 20),
+    ('viewport+accessible', {'accessible': 'true', 'bbox': f'{CITY_CENTER[1] - 0.02},{CITY_CENTER[0] - 0.02},'
+                                                          f'{CITY_CENTER[1] + 0.02},{CITY_CENTER[0] + 0.02}'},
+     lambda t: t['accessible'] and abs(t['latitude'] - CITY_CENTER[0]) <= 0.02
+     and abs(t['longitude'] - CITY_CENTER[1]) <= 0.02),
+    ('top 50 by rating', {'sort': 'rating', 'limit': 50}, None),
+    ('20 nearest accessible', {'sort': 'distance', 'lat': CITY_CENTER[0], 'lng': CITY_CENTER[1],
+                               'accessible': 'true', 'limit': 20}, None)
+]
+
+def timed(function):
+    timings = []
+    result = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='medium', choices=sorted(SCALES))
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+            'API_DOCS': False,
+            # Measure the queries, not cache hits
+            'RESPONSE_CACHE_MAX_ENTRIES': 0
+        })
+        with app.app_context():
+            generate(SCALES[args.scale])
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        full_ms, _ = timed(lambda: client.get('/api/toilets'))
+        print(f"{'query':>26} {'results':>8} {'client-side ms':>15} {'server-side ms':>15}")
+        for name, params, keep in QUERIES:
+            server_ms, response = timed(lambda: client.get('/api/toilets', query_string=params))
+            if response.status_code != 200:
+                raise RuntimeError(f'/api/toilets returned {response.status_code}')
+            if keep is not None:
+                # The download is the same for every filter; only the filtering differs
+                toilets = client.get('/api/toilets').get_json()['toilets']
+                filter_ms, _ = timed(lambda: [toilet for toilet in toilets if keep(toilet)])
+                client_side = f'{full_ms + filter_ms:.1f}'
+            else:
+                client_side = f'>{full_ms:.1f}'
+            count = len(response.get_json()['toilets'])
+            print(f'{name:>26} {count:>8} {client_side:>15} {server_ms:>15.1f}')
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Deterministic synthetic datasets for the benchmarks.
+
+Toilets are spread over a city around a few dense neighbourhoods, and both
+the toilets reviewed and the reviewers follow a heavy-tailed distribution:
+a few popular toilets and active users get most of the reviews, like real
+usage. The same seed and sizes always produce the same rows.
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from app import db
+from app.models.review import Review
+from app.models.search import rebuild_search_index, search_supported
+from app.models.toilet import Toilet, add_review_to_aggregates, initial_aggregates
+from app.models.user import User
+from app.utils.geo import grid_cell
+from app.utils.password_hashing import hash_password
+
+# Sofia city centre, and the spread of the city in degrees
+CITY_CENTER = (42.6977, 23.3219)
+CITY_RADIUS = 0.12
+
+PASSWORD = 'password123'
+INSERT_BATCH_SIZE = 10000
+
+@dataclass(frozen=True)
+class Scale:
+    name: str
+    users: int
+    toilets: int
+    reviews: int
+
+SCALES = {
+    'small': Scale('small', users=100, toilets=1000, reviews=5000),
+    'medium': Scale('medium', users=1000, toilets=10000, reviews=100000),
+    'large': Scale('large', users=10000, toilets=100000, reviews=1000000)
+}
+
+# Vocabulary for generate(text=True): descriptions and comments made of
+# these, so full-text search has realistic term frequencies to work with
+PLACES = ['central station', 'bus station', 'shopping mall', 'city park', 'market hall', 'metro',
+          'petrol station', 'museum', 'university', 'stadium', 'cafe', 'library', 'hospital', 'square']
+DETAILS = ['free', 'paid', 'clean', 'dirty', 'busy', 'quiet', 'spacious', 'tiny', 'modern', 'old',
+           'baby changing', 'wheelchair ramp', 'no soap', 'hand dryer', 'long queue', 'attendant']
+REMARKS = ['would use again', 'avoid at night', 'ask staff for the key', 'smells bad', 'recently renovated',
+           'out of paper', 'well maintained', 'closed on sundays', 'open late', 'hard to find']
+
+def _description(rng):
+    return f'{rng.choice(DETAILS).capitalize()} toilet at the {rng.choice(PLACES)}'
+
+def _comment(rng):
+    words = rng.sample(DETAILS, 2) + [rng.choice(REMARKS)]
+    if rng.random() < 0.3:
+        words.append(f'near the {rng.choice(PLACES)}')
+    return ', '.join(words).capitalize()
+
+def _skewed_picker(rng, count, alpha=1.2):
+    # Zipf-like weights over a shuffled order, so popularity isn't tied to ids
+    order = list(range(1, count + 1))
+    rng.shuffle(order)
+    weights = [1 / (rank ** alpha) for rank in range(1, count + 1)]
+    return lambda k: rng.choices(order, weights=weights, k=k)
+
+def _city_point(rng, neighbourhoods):
+    if rng.random() < 0.7:
+        lat, lng = rng.choice(neighbourhoods)
+        spread = CITY_RADIUS / 10
+    else:
+        lat, lng = CITY_CENTER
+        spread = CITY_RADIUS / 2
+    return lat + rng.gauss(0, spread), lng + rng.gauss(0, spread)
+
+def generate(scale, seed=42, text=False):
+    """Fill the current app's empty database with `scale`'s rows. Rows go in
+    with bulk inserts carrying precomputed grid cells and aggregates, which
+    are the values the mapper events would have stored, and the search index
+    is rebuilt after them. With `text`, descriptions and comments are
+    phrases drawn from a small vocabulary instead of numbered labels; they
+    come from a separate generator, so every other value stays the same."""
+    rng = random.Random(seed)
+    text_rng = random.Random(seed + 1) if text else None
+    start_time = datetime(2024, 1, 1)
+    # Hashing is the expensive part of a login; one hash shared by every user keeps filling fast
+    password_hash = hash_password(PASSWORD)
+
+    db.session.execute(User.__table__.insert(), [
+        {'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+         'password_hash': password_hash}
+        for user_id in range(1, scale.users + 1)
+    ])
+
+    neighbourhoods = [_city_point(rng, [CITY_CENTER]) for _ in range(12)]
+    pick_user = _skewed_picker(rng, scale.users)
+    toilets = []
+    for toilet_id, user_id in zip(range(1, scale.toilets + 1), pick_user(scale.toilets)):
+        lat, lng = _city_point(rng, neighbourhoods)
+        cleanliness, accessible, paper = rng.randint(1, 5), rng.random() < 0.4, rng.random() < 0.7
+        description = _description(text_rng) if text else f'Toilet {toilet_id}'
+        toilets.append(dict(initial_aggregates(cleanliness, accessible, paper),
+                            id=toilet_id, latitude=lat, longitude=lng, description=description,
+                            accessible=accessible, has_toilet_paper=paper, cleanliness=cleanliness,
+                            timestamp=start_time + timedelta(minutes=toilet_id), user_id=user_id,
+                            grid_cell=grid_cell(lat, lng)))
+
+    pick_toilet = _skewed_picker(rng, scale.toilets)
+    reviews = []
+    for review_id, toilet_id, user_id in zip(range(1, scale.reviews + 1),
+                                             pick_toilet(scale.reviews), pick_user(scale.reviews)):
+        toilet = toilets[toilet_id - 1]
+        # Reviews drift from the initial rating rather than being uniform
+        cleanliness = min(max(toilet['cleanliness'] + round(rng.gauss(0, 1)), 1), 5)
+        accessible = toilet['accessible'] if rng.random() < 0.8 else not toilet['accessible']
+        paper = rng.random() < 0.6
+        add_review_to_aggregates(toilet, cleanliness, accessible, paper)
+        reviews.append({'id': review_id, 'toilet_id': toilet_id, 'user_id': user_id,
+                        'cleanliness': cleanliness, 'accessible': accessible, 'has_toilet_paper': paper,
+                        'comment': _comment(text_rng) if text else f'Review {review_id}',
+                        'timestamp': start_time + timedelta(minutes=scale.toilets + review_id)})
+
+    for table, rows in ((Toilet.__table__, toilets), (Review.__table__, reviews)):
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(table.insert(), rows[start:start + INSERT_BATCH_SIZE])
+    if search_supported(db.session.connection()):
+        rebuild_search_index(db.session.connection())
+    db.session.commit()
+    return scale
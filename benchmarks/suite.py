@@ -0,0 +1,208 @@
+"""Latency of the main API, form and model operations on seeded synthetic
+datasets, compared against a stored baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.suite [--scales small,medium] [--threshold 1.5]
+    python -m benchmarks.suite --save-baseline
+
+Each benchmark's median is compared with benchmarks/baseline.json and the
+run exits with status 1 when any is more than --threshold times slower, so
+a change that doubles list latency fails it. Absolute times depend on the
+machine: record the baseline on the machine (or CI runner class) that runs
+the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from app import create_app, db
+from app.models.toilet import Toilet
+from app.utils.toilet_index import init_toilet_index
+from benchmarks.datasets import CITY_CENTER, PASSWORD, SCALES, generate
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_THRESHOLD = 1.5
+# Per benchmark: stop after this many runs or this many seconds, whichever comes first
+MAX_RUNS = 200
+MAX_SECONDS = 3.0
+MIN_RUNS = 5
+
+def make_app(db_path):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'WTF_CSRF_ENABLED': False,
+        'API_DOCS': False,
+        # Measure the controllers, not cache hits
+        'RESPONSE_CACHE_MAX_ENTRIES': 0
+    })
+
+def _viewport(rng, size=0.02):
+    # A map viewport of about 2 x 2 km somewhere in the city
+    lat = CITY_CENTER[0] + rng.uniform(-0.05, 0.05)
+    lng = CITY_CENTER[1] + rng.uniform(-0.05, 0.05)
+    return f'{lng - size / 2},{lat - size / 2},{lng + size / 2},{lat + size / 2}'
+
+def benchmarks(app, scale, rng):
+    """(name, operation) pairs; each operation performs one timed request or call."""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    def check(response, status):
+        if response.status_code != status:
+            raise RuntimeError(f'{response.request.path} returned {response.status_code}')
+
+    def list_toilets():
+        check(client.get('/api/toilets'), 200)
+
+    def list_toilets_bbox():
+        check(client.get('/api/toilets', query_string={'bbox': _viewport(rng)}), 200)
+
+    def toilet_details():
+        check(client.get(f'/api/toilet/{rng.randint(1, scale.toilets)}'), 200)
+
+    def add_toilet():
+        lat = CITY_CENTER[0] + rng.uniform(-0.1, 0.1)
+        lng = CITY_CENTER[1] + rng.uniform(-0.1, 0.1)
+        check(client.post('/add_toilet', data={'latitude': lat, 'longitude': lng, 'description': 'Benchmark',
+                                               'accessible': 'on', 'cleanliness': '4'}), 302)
+
+    def add_review():
+        check(client.post(f'/add_review/{rng.randint(1, scale.toilets)}',
+                          data={'has_toilet_paper': 'on', 'cleanliness': '3', 'comment': 'Benchmark'}), 302)
+
+    login_client = app.test_client()
+
+    def login():
+        user = rng.randint(1, scale.users)
+        check(login_client.post('/login', data={'username': f'user{user}', 'password': PASSWORD}), 302)
+
+    def aggregates():
+        # The consensus methods every serialized toilet goes through
+        with app.app_context():
+            for toilet in Toilet.query.filter(Toilet.id.in_(
+                    [rng.randint(1, scale.toilets) for _ in range(100)])):
+                toilet.get_median_cleanliness()
+                toilet.get_accessibility_consensus()
+                toilet.get_toilet_paper_consensus()
+                toilet.get_review_count()
+
+    def compute_aggregates():
+        # Full recompute from the reviews, as check-aggregates does per toilet
+        with app.app_context():
+            db.session.get(Toilet, rng.randint(1, scale.toilets)).compute_aggregates()
+
+    return [
+        ('api_toilets', list_toilets),
+        ('api_toilets_bbox', list_toilets_bbox),
+        ('api_toilet_details', toilet_details),
+        ('add_toilet', add_toilet),
+        ('add_review', add_review),
+        ('login', login),
+        ('aggregates_100_toilets', aggregates),
+        ('compute_aggregates', compute_aggregates)
+    ]
+
+def measure(operation):
+    """Median and 95th percentile of the operation in milliseconds."""
+    operation()  # warm up
+    timings = []
+    deadline = time.perf_counter() + MAX_SECONDS
+    while len(timings) < MAX_RUNS and (len(timings) < MIN_RUNS or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {'median_ms': round(timings[len(timings) // 2], 3),
+            'p95_ms': round(timings[int(len(timings) * 0.95)], 3), 'runs': len(timings)}
+
+def run_scale(scale, seed, only=None):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = make_app(db_path)
+        with app.app_context():
+            start = time.perf_counter()
+            generate(scale, seed)
+            print(f'{scale.name}: {scale.users} users, {scale.toilets} toilets, {scale.reviews} reviews '
+                  f'generated in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+        init_toilet_index(app)
+
+        results = {}
+        rng = random.Random(seed)
+        for name, operation in benchmarks(app, scale, rng):
+            if only and name not in only:
+                continue
+            results[name] = measure(operation)
+        with app.app_context():
+            db.engine.dispose()
+        return results
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+def compare(results, baseline, threshold):
+    """(scale, name, baseline_ms, current_ms, ratio, failed) for every result."""
+    rows = []
+    for scale_name, scale_results in results.items():
+        for name, result in scale_results.items():
+            expected = baseline.get('results', {}).get(scale_name, {}).get(name)
+            if expected is None:
+                rows.append((scale_name, name, None, result['median_ms'], None, False))
+                continue
+            ratio = result['median_ms'] / expected['median_ms'] if expected['median_ms'] else 1.0
+            rows.append((scale_name, name, expected['median_ms'], result['median_ms'], ratio, ratio > threshold))
+    return rows
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='small,medium',
+                        help=f"Comma separated scales out of {', '.join(SCALES)}.")
+    parser.add_argument('--only', help='Comma separated benchmark names to run.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Fail when a median is this many times the baseline.')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline.')
+    args = parser.parse_args()
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {name: run_scale(SCALES[name], args.seed, only) for name in args.scales.split(',')}
+
+    if args.save_baseline:
+        baseline = load_baseline(args.baseline)
+        for scale_name, scale_results in results.items():
+            baseline.setdefault('results', {}).setdefault(scale_name, {}).update(scale_results)
+        baseline.update({'seed': args.seed, 'machine': platform.platform(), 'python': platform.python_version()})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline written to {args.baseline}')
+
+    rows = compare(results, load_baseline(args.baseline), args.threshold)
+    print(f"{'scale':>7} {'benchmark':>24} {'baseline ms':>12} {'median ms':>10} {'ratio':>6}")
+    for scale_name, name, expected, current, ratio, failed in rows:
+        expected_text = f'{expected:>12.2f}' if expected is not None else f"{'-':>12}"
+        ratio_text = f'{ratio:>6.2f}' if ratio is not None else f"{'new':>6}"
+        print(f"{scale_name:>7} {name:>24} {expected_text} {current:>10.2f} {ratio_text}"
+              f"{'  REGRESSION' if failed else ''}")
+
+    regressions = [row for row in rows if row[5]]
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) more than {args.threshold}x slower than the baseline')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
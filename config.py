@@ -1,6 +1,77 @@
 import os
 
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _engine_options(database_uri):
+    if database_uri.startswith('sqlite'):
+        # SQLite is tuned per connection with PRAGMAs instead (see SQLITE_*)
+        return {}
+    # Pool sizing for server databases such as PostgreSQL or MySQL
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        # Recycle before the server drops idle connections
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True
+    }
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///toilets.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///toilets.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # Apply pending schema migrations on startup; with 0 an outdated database
+    # is only logged and `flask db-upgrade` has to be run as a deploy step
+    SCHEMA_AUTO_UPGRADE = os.environ.get('SCHEMA_AUTO_UPGRADE', '1').lower() in ('1', 'true', 'yes')
+
+    # Applied to every new SQLite connection. WAL lets readers run while a
+    # review is being written; synchronous=NORMAL is durable in WAL mode
+    # except for the last commits on power loss.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    # Page cache per connection in KiB
+    SQLITE_CACHE_SIZE_KB = _env_int('SQLITE_CACHE_SIZE_KB', 20000)
+
+    # Hand new reviews and toilets to one background writer that commits them
+    # in batches of up to GROUP_COMMIT_MAX_BATCH, collected for at most
+    # GROUP_COMMIT_MAX_DELAY_MS, instead of a commit per request
+    GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+    GROUP_COMMIT_MAX_BATCH = _env_int('GROUP_COMMIT_MAX_BATCH', 200)
+    GROUP_COMMIT_MAX_DELAY_MS = _env_int('GROUP_COMMIT_MAX_DELAY_MS', 20)
+    # How long a request waits for its commit before answering 503
+    GROUP_COMMIT_TIMEOUT_MS = _env_int('GROUP_COMMIT_TIMEOUT_MS', 10000)
+
+    # Background publishing of the static toilet snapshot the map loads
+    # (see app.utils.snapshot); `flask publish-snapshot` does it on demand
+    SNAPSHOT_PUBLISHER = os.environ.get('SNAPSHOT_PUBLISHER', '').lower() in ('1', 'true', 'yes')
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+
+    # werkzeug hash method with its cost, e.g. "scrypt:32768:8:1" or
+    # "pbkdf2:sha256:600000"; existing hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    # Hashing threads (0 hashes on the request thread) and how many more
+    # hashes may wait before logins are turned away with a 503
+    PASSWORD_HASH_WORKERS = _env_int('PASSWORD_HASH_WORKERS', min(os.cpu_count() or 1, 4))
+    PASSWORD_HASH_QUEUE = _env_int('PASSWORD_HASH_QUEUE', 32)
+
+    # Bearer token required to scrape /metrics. Unset, only requests from
+    # the loopback interface that weren't forwarded by a proxy are served,
+    # so set it wherever the scraper runs on another host
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Write a cProfile dump to PROFILE_DIR (instance/profiles by default) for
+    # every request slower than this many milliseconds, 0 to disable
+    PROFILE_SLOW_REQUESTS_MS = _env_int('PROFILE_SLOW_REQUESTS_MS', 0)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+    # Requested once by `gunicorn wsgi:app` before workers take traffic (see
+    # app.utils.serving.warm_up), separated by whitespace; empty to skip
+    WARM_UP_PATHS = os.environ.get('WARM_UP_PATHS', '/login /main /api/toilets /api/toilets?format=compact').split()
+
+    # Serve the Swagger UI at /apidocs; flasgger is only loaded on first use
+    API_DOCS = os.environ.get('API_DOCS', '1').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,52 @@
+"""gunicorn settings for `gunicorn wsgi:app`, read from the environment.
+
+With WEB_PRELOAD (the default) the master builds the app, the in-memory
+toilet indexes and the warmed-up response caches once and the workers
+share them copy-on-write. The snapshot publisher (SNAPSHOT_PUBLISHER) then
+runs in the master only; without preloading every worker runs its own."""
+import os
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+bind = os.environ.get('WEB_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = _env_int('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1)
+# More than one thread selects the gthread worker, which overlaps requests
+# waiting on SQLite or slow clients, but drops connections it accepted and
+# hadn't read yet when it is recycled; sync workers recycle without losing any
+threads = _env_int('WEB_THREADS', 1)
+preload_app = _env_flag('WEB_PRELOAD', '1')
+
+# Recycle each worker after this many requests (0 never), staggered by the
+# jitter so they don't all restart at once; in-flight requests get
+# graceful_timeout seconds to finish
+max_requests = _env_int('WEB_MAX_REQUESTS', 10000)
+max_requests_jitter = _env_int('WEB_MAX_REQUESTS_JITTER', 1000)
+graceful_timeout = _env_int('WEB_GRACEFUL_TIMEOUT', 30)
+timeout = _env_int('WEB_TIMEOUT', 60)
+keepalive = _env_int('WEB_KEEPALIVE', 5)
+
+accesslog = os.environ.get('WEB_ACCESS_LOG') or None
+errorlog = '-'
+
+def pre_fork(server, worker):
+    # Only a preloaded app lives in the master; loading it here otherwise
+    # would build it once more
+    if server.cfg.preload_app:
+        from app.utils.serving import before_fork
+        before_fork(server.app.wsgi())
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app.utils.serving import after_fork
+        after_fork(server.app.wsgi())
+
+def worker_exit(server, worker):
+    # Unset when the worker failed to load the app
+    if getattr(worker, 'wsgi', None) is not None:
+        from app.utils.serving import before_exit
+        before_exit(worker.wsgi)
@@ -150,6 +150,39 @@ class FlaskAppTestCase(unittest.TestCase):
             self.assertEqual(toilet.description, 'Test toilet')
             self.assertEqual(toilet.cleanliness, 4)
     
+    def test_add_toilet_saved_when_indexing_fails(self):
+        """Test a failure to update the in-memory indexes doesn't report a saved toilet as failed."""
+        from app.controllers import toilet_controller
+        from app.utils.toilet_index import get_nearest_index
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            def failing_index(toilet):
+                raise RuntimeError('index unavailable')
+            original_index_toilet = toilet_controller.index_toilet
+            toilet_controller.index_toilet = failing_index
+            try:
+                with self.assertLogs(self.app.logger, 'ERROR'):
+                    self.assertTrue(ToiletController.add_toilet('42.6977', '23.3219', 'Test toilet', True, True, '4'))
+                toilet = Toilet.query.first()
+                with self.assertLogs(self.app.logger, 'ERROR'):
+                    self.assertTrue(ToiletController.add_review(toilet.id, True, True, '5', 'Fine'))
+            finally:
+                toilet_controller.index_toilet = original_index_toilet
+            self.assertEqual(Review.query.count(), 1)
+            self.assertEqual(len(get_nearest_index()), 0)
+            
+            # The next read catches the indexes up from the change log
+            data, status = ApiController.get_nearest_toilets('42.6977', '23.3219', 1)
+            self.assertEqual(status, 200)
+            self.assertEqual([t['id'] for t in data['toilets']], [toilet.id])
+    
     def test_add_toilet_invalid_coordinates(self):
         """Test adding toilet with invalid coordinates fails."""
         with self.app.test_request_context():
@@ -302,6 +335,1443 @@ class FlaskAppTestCase(unittest.TestCase):
             self.assertEqual(data['description'], 'Test toilet')
             self.assertEqual(data['author'], 'testuser')
     
+    def test_api_get_toilets_bbox(self):
+        """Test API toilets endpoint only returns toilets inside the bounding box."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            db.session.add(Toilet(latitude=42.6977, longitude=23.3219,
+                                  description='Sofia', user_id=user.id))
+            db.session.add(Toilet(latitude=51.5072, longitude=-0.1276,
+                                  description='London', user_id=user.id))
+            db.session.add(Toilet(latitude=-17.7134, longitude=178.0650,
+                                  description='Fiji', user_id=user.id))
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            data, status = ApiController.get_toilets('23.2,42.6,23.4,42.8')
+            self.assertEqual(status, 200)
+            self.assertEqual([t['description'] for t in data['toilets']], ['Sofia'])
+            
+            # Boxes crossing the antimeridian wrap around
+            data, status = ApiController.get_toilets('170,-20,-170,-10')
+            self.assertEqual([t['description'] for t in data['toilets']], ['Fiji'])
+            
+            # Very tall boxes fall back to a plain range scan
+            data, status = ApiController.get_toilets('-10,-60,30,60')
+            self.assertEqual(sorted(t['description'] for t in data['toilets']), ['London', 'Sofia'])
+    
+    def test_api_get_toilets_invalid_bbox(self):
+        """Test API toilets endpoint rejects malformed bounding boxes."""
+        with self.app.test_request_context():
+            from flask import session
+            session['user_id'] = 1
+            
+            data, status = ApiController.get_toilets('1,2,3')
+            self.assertEqual(status, 400)
+            data, status = ApiController.get_toilets('0,50,1,40')
+            self.assertEqual(status, 400)
+    
+    def test_toilet_grid_cell_kept_in_sync(self):
+        """Test the spatial index cell follows the toilet coordinates."""
+        from app.utils.geo import grid_cell
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            toilet = Toilet(latitude=42.6977, longitude=23.3219,
+                            description='Test toilet', user_id=user.id)
+            db.session.add(toilet)
+            db.session.commit()
+            self.assertEqual(toilet.grid_cell, grid_cell(42.6977, 23.3219))
+            
+            toilet.latitude = 43.2141
+            db.session.commit()
+            self.assertEqual(toilet.grid_cell, grid_cell(43.2141, 23.3219))
+    
+    def test_api_nearest_toilets(self):
+        """Test nearest toilets endpoint orders by distance and applies filters."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            ToiletController.add_toilet('42.6977', '23.3219', 'Center', False, True, '2')
+            ToiletController.add_toilet('42.7000', '23.3300', 'Nearby', True, False, '5')
+            ToiletController.add_toilet('42.1354', '24.7453', 'Plovdiv', True, True, '4')
+            
+            data, status = ApiController.get_nearest_toilets('42.6980', '23.3220', 2)
+            self.assertEqual(status, 200)
+            self.assertEqual([t['description'] for t in data['toilets']], ['Center', 'Nearby'])
+            self.assertLess(data['toilets'][0]['distance_km'], data['toilets'][1]['distance_km'])
+            
+            data, status = ApiController.get_nearest_toilets(
+                '42.6980', '23.3220', 2, accessible='true', min_cleanliness='4')
+            self.assertEqual([t['description'] for t in data['toilets']], ['Nearby', 'Plovdiv'])
+            
+            # Reviews update the indexed consensus values
+            nearby = Toilet.query.filter_by(description='Nearby').first()
+            ToiletController.add_review(nearby.id, False, False, '1', '')
+            ToiletController.add_review(nearby.id, False, False, '1', '')
+            data, status = ApiController.get_nearest_toilets(
+                '42.6980', '23.3220', 1, accessible='true')
+            self.assertEqual([t['description'] for t in data['toilets']], ['Plovdiv'])
+    
+    def test_api_nearest_toilets_invalid_parameters(self):
+        """Test nearest toilets endpoint rejects invalid parameters."""
+        with self.app.test_request_context():
+            from flask import session
+            session['user_id'] = 1
+            
+            data, status = ApiController.get_nearest_toilets('999', '0')
+            self.assertEqual(status, 400)
+            data, status = ApiController.get_nearest_toilets('42', '23', 0)
+            self.assertEqual(status, 400)
+            data, status = ApiController.get_nearest_toilets('42', '23', 5, min_cleanliness='9')
+            self.assertEqual(status, 400)
+            # Integer parameters all answer in the same words, not Python's
+            for call, message in (
+                (lambda: ApiController.get_nearest_toilets('42', '23', 'abc'), 'k must be an integer'),
+                (lambda: ApiController.get_nearest_toilets('42', '23', 5, min_cleanliness='x'),
+                 'min_cleanliness must be an integer'),
+                (lambda: ApiController.get_toilet_clusters('abc'), 'z must be an integer'),
+                (lambda: ApiController.get_toilets(limit='abc'), 'limit must be an integer'),
+                (lambda: ApiController.get_toilets(limit='0'), 'limit must be between 1 and 1000')
+            ):
+                self.assertEqual(call(), ({'error': message}, 400))
+    
+    def test_review_updates_stored_aggregates(self):
+        """Test reviews keep the stored aggregates equal to a full recompute."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            ToiletController.add_toilet('42.6977', '23.3219', 'Test toilet', True, False, '2')
+            toilet = Toilet.query.first()
+            for cleanliness in ['5', '5', '1', '4']:
+                ToiletController.add_review(toilet.id, False, True, cleanliness, '')
+            
+            toilet = Toilet.query.first()
+            self.assertEqual(toilet.review_count, 4)
+            self.assertEqual(toilet.stored_aggregates(), toilet.compute_aggregates())
+            self.assertEqual(toilet.get_median_cleanliness(), 4)  # Median of [2,5,5,1,4]
+            self.assertFalse(toilet.get_accessibility_consensus())  # 1/5 say accessible
+            self.assertTrue(toilet.get_toilet_paper_consensus())    # 4/5 say has paper
+    
+    def test_rebuild_and_check_aggregates_commands(self):
+        """Test the aggregate consistency checker and rebuild commands."""
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            toilet = Toilet(latitude=42.6977, longitude=23.3219,
+                            description='Test toilet', cleanliness=3, user_id=user.id)
+            db.session.add(toilet)
+            db.session.commit()
+            db.session.add(Review(cleanliness=5, accessible=True, user_id=user.id, toilet_id=toilet.id))
+            db.session.commit()
+            
+            # Simulate aggregates that drifted from the reviews
+            toilet.review_count = 7
+            toilet.cleanliness_5 = 0
+            db.session.commit()
+            toilet_id = toilet.id
+        
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['check-aggregates'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn(f'Toilet {toilet_id}', result.output)
+        
+        result = runner.invoke(args=['rebuild-aggregates'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('1 toilet(s) updated', result.output)
+        
+        result = runner.invoke(args=['check-aggregates'])
+        self.assertEqual(result.exit_code, 0)
+        
+        with self.app.app_context():
+            toilet = db.session.get(Toilet, toilet_id)
+            self.assertEqual(toilet.review_count, 1)
+            self.assertEqual(toilet.get_median_cleanliness(), 4)  # Median of [3,5]
+    
+    def test_api_query_budgets(self):
+        """Test API endpoints run a fixed number of queries regardless of data size."""
+        from app.utils.query_counter import QueryCounter
+        with self.app.test_request_context():
+            users = []
+            for i in range(3):
+                user = User(username=f'testuser{i}', email=f'test{i}@example.com')
+                user.set_password('password123')
+                db.session.add(user)
+                users.append(user)
+            db.session.commit()
+            
+            for i in range(5):
+                toilet = Toilet(latitude=42.69 + i / 1000, longitude=23.32,
+                                description=f'Toilet {i}', user_id=users[i % 3].id)
+                db.session.add(toilet)
+                db.session.commit()
+                for user in users:
+                    db.session.add(Review(cleanliness=4, user_id=user.id, toilet_id=toilet.id))
+                db.session.commit()
+            toilet_id = toilet.id
+            
+            from flask import session
+            session['user_id'] = users[0].id
+            db.session.expunge_all()
+            
+            with QueryCounter() as counter:
+                data, status = ApiController.get_toilets()
+            self.assertEqual(len(data['toilets']), 5)
+            self.assertEqual(counter.count, 1)
+            
+            db.session.expunge_all()
+            with QueryCounter() as counter:
+                data, status = ApiController.get_toilet_details(toilet_id)
+            self.assertEqual(len(data['reviews']), 3)
+            self.assertEqual({r['author'] for r in data['reviews']}, {'testuser0', 'testuser1', 'testuser2'})
+            self.assertEqual(counter.count, 2)
+    
+    def test_query_budget_guard(self):
+        """Test the query budget guard rejects views that go over budget in strict mode."""
+        from app.utils.query_counter import query_budget
+        
+        @query_budget(1)
+        def chatty_view():
+            User.query.all()
+            User.query.all()
+            return 'ok'
+        
+        with self.app.test_request_context():
+            self.assertEqual(chatty_view(), 'ok')
+            self.app.config['SQL_QUERY_BUDGET_STRICT'] = True
+            with self.assertRaises(RuntimeError):
+                chatty_view()
+    
+    def test_api_toilets_conditional_get_and_cache(self):
+        """Test toilet list responses are cached per dataset version and revalidated with ETags."""
+        from app.utils.response_cache import get_response_cache
+        from datetime import timedelta
+        from werkzeug.http import http_date
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Toilet(latitude=42.6977, longitude=23.3219,
+                                  description='Test toilet', user_id=user.id))
+            db.session.commit()
+            user_id = user.id
+        
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        
+        first = self.client.get('/api/toilets')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        etag = first.headers['ETag']
+        self.assertIsNotNone(first.headers.get('Last-Modified'))
+        
+        second = self.client.get('/api/toilets')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.get_json(), first.get_json())
+        
+        not_modified = self.client.get('/api/toilets', headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+        # Only dates a whole second after the last write are known to be current
+        last_modified = first.last_modified
+        self.assertEqual(self.client.get('/api/toilets', headers={
+            'If-Modified-Since': http_date(last_modified + timedelta(seconds=1))}).status_code, 304)
+        self.assertEqual(self.client.get('/api/toilets', headers={
+            'If-Modified-Since': http_date(last_modified)}).status_code, 200)
+        
+        # Other query parameters are cached separately
+        bbox = self.client.get('/api/toilets?bbox=0,0,1,1')
+        self.assertEqual(bbox.headers['X-Cache'], 'MISS')
+        self.assertNotEqual(bbox.headers['ETag'], etag)
+        
+        # A review bumps the dataset version and invalidates the cached list
+        with self.app.test_request_context():
+            from flask import session
+            session['user_id'] = user_id
+            ToiletController.add_review(Toilet.query.first().id, True, True, '5', '')
+        
+        changed = self.client.get('/api/toilets', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        # Even when the review landed in the same second as the cached copy
+        changed_since = self.client.get('/api/toilets', headers={'If-Modified-Since': first.headers['Last-Modified']})
+        self.assertEqual(changed_since.status_code, 200)
+        self.assertEqual(changed.headers['X-Cache'], 'MISS')
+        self.assertEqual(changed.get_json()['toilets'][0]['review_count'], 1)
+        
+        with self.app.app_context():
+            stats = get_response_cache().stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 3)
+    
+    def test_api_toilets_keyset_pagination(self):
+        """Test toilet listing pages through every toilet exactly once."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            for i in range(7):
+                db.session.add(Toilet(latitude=42.69, longitude=23.32,
+                                      description=f'Toilet {i}', user_id=user.id))
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            seen = []
+            cursor = None
+            while True:
+                data, status = ApiController.get_toilets(limit='3', cursor=cursor)
+                self.assertEqual(status, 200)
+                self.assertLessEqual(len(data['toilets']), 3)
+                seen.extend(t['description'] for t in data['toilets'])
+                cursor = data['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(seen, [f'Toilet {i}' for i in range(7)])
+            
+            data, status = ApiController.get_toilets(cursor='not-a-cursor')
+            self.assertEqual(status, 400)
+            data, status = ApiController.get_toilets(limit='0')
+            self.assertEqual(status, 400)
+            
+            # Values SQLite can't hold are invalid cursors, not database errors
+            import base64
+            from app.utils.pagination import encode_cursor
+            toilet_id = Toilet.query.first().id
+            infinite = base64.urlsafe_b64encode(b'{"after":1,"key":Infinity}').decode()
+            for cursor in (encode_cursor(2 ** 70), encode_cursor(-1), encode_cursor(True)):
+                self.assertEqual(ApiController.get_toilets(limit='3', cursor=cursor)[1], 400)
+                self.assertEqual(ApiController.get_toilet_details(toilet_id, cursor=cursor)[1], 400)
+            for cursor in (encode_cursor(1, 10 ** 30), encode_cursor(2 ** 63, 3), infinite):
+                self.assertEqual(ApiController.get_toilets(limit='3', cursor=cursor, sort='rating')[1], 400)
+            self.assertEqual(ApiController.get_toilets(limit='3', cursor=encode_cursor(1, 3), sort='rating')[1], 200)
+    
+    def test_api_toilet_details_review_pagination(self):
+        """Test toilet details return reviews one page at a time."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            toilet = Toilet(latitude=42.69, longitude=23.32,
+                            description='Popular toilet', user_id=user.id)
+            db.session.add(toilet)
+            db.session.commit()
+            for i in range(25):
+                db.session.add(Review(cleanliness=3, comment=f'Review {i}',
+                                      user_id=user.id, toilet_id=toilet.id))
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            data, status = ApiController.get_toilet_details(toilet.id)
+            self.assertEqual(data['review_count'], 25)
+            self.assertEqual(len(data['reviews']), 20)
+            self.assertIsNotNone(data['next_cursor'])
+            
+            rest, status = ApiController.get_toilet_details(toilet.id, cursor=data['next_cursor'])
+            self.assertEqual([r['comment'] for r in rest['reviews']], [f'Review {i}' for i in range(20, 25)])
+            self.assertIsNone(rest['next_cursor'])
+    
+    def test_api_toilet_clusters(self):
+        """Test cluster endpoint aggregates at low zoom and returns toilets at high zoom."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            ToiletController.add_toilet('42.6977', '23.3219', 'Sofia 1', False, True, '2')
+            ToiletController.add_toilet('42.6980', '23.3225', 'Sofia 2', True, False, '4')
+            ToiletController.add_toilet('51.5072', '-0.1276', 'London', False, False, '3')
+            
+            data, status = ApiController.get_toilet_clusters('5')
+            self.assertEqual(status, 200)
+            clusters = sorted(data['clusters'], key=lambda c: c['count'])
+            self.assertEqual([c['count'] for c in clusters], [1, 2])
+            self.assertEqual(clusters[1]['best_cleanliness'], 4)
+            self.assertTrue(clusters[1]['any_accessible'])
+            self.assertAlmostEqual(clusters[1]['latitude'], (42.6977 + 42.6980) / 2)
+            
+            data, status = ApiController.get_toilet_clusters('5', '20,40,30,45')
+            self.assertEqual([c['count'] for c in data['clusters']], [2])
+            
+            # Reviews move toilets between rating buckets of their cluster
+            sofia = Toilet.query.filter_by(description='Sofia 2').first()
+            ToiletController.add_review(sofia.id, False, False, '1', '')
+            ToiletController.add_review(sofia.id, False, False, '1', '')
+            data, status = ApiController.get_toilet_clusters('5', '20,40,30,45')
+            self.assertEqual(data['clusters'][0]['best_cleanliness'], 2)
+            self.assertFalse(data['clusters'][0]['any_accessible'])
+            
+            data, status = ApiController.get_toilet_clusters('17', '23.3,42.6,23.4,42.8')
+            self.assertNotIn('clusters', data)
+            self.assertEqual(len(data['toilets']), 2)
+            
+            data, status = ApiController.get_toilet_clusters(None)
+            self.assertEqual(status, 400)
+    
+    def test_api_toilets_compact_format(self):
+        """Test the compact toilet list decodes back to the regular one."""
+        from app.utils.compact import decode_compact
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            ToiletController.add_toilet('42.69771', '23.32192', 'Sofia', True, False, '4')
+            ToiletController.add_toilet('51.50722', '-0.12758', 'London', False, True, '2')
+            ToiletController.add_toilet('42.69901', '23.31005', 'Sofia 2', True, True, '5')
+            
+            regular, status = ApiController.get_toilets()
+            compact, status = ApiController.get_toilets(output_format='compact')
+            self.assertEqual(status, 200)
+            self.assertEqual(compact['format'], 'compact')
+            self.assertEqual(compact['authors'], ['testuser'])
+            self.assertEqual(sorted(decode_compact(compact), key=lambda t: t['id']), regular['toilets'])
+            
+            data, status = ApiController.get_toilets(output_format='xml')
+            self.assertEqual(status, 400)
+    
+    def test_api_toilet_changes_feed(self):
+        """Test the change feed returns only toilets changed after a version."""
+        from app.models.dataset import get_dataset_version
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            ToiletController.add_toilet('42.6977', '23.3219', 'First', False, True, '2')
+            ToiletController.add_toilet('42.7000', '23.3300', 'Second', True, False, '5')
+            version, _ = get_dataset_version()
+            
+            data, status = ApiController.get_toilet_changes(str(version))
+            self.assertEqual(data, {'version': version, 'reset': False, 'toilets': []})
+            
+            first = Toilet.query.filter_by(description='First').first()
+            ToiletController.add_review(first.id, True, True, '5', '')
+            ToiletController.add_review(first.id, True, True, '5', '')
+            
+            data, status = ApiController.get_toilet_changes(str(version))
+            self.assertEqual(status, 200)
+            self.assertFalse(data['reset'])
+            self.assertEqual(data['version'], version + 2)
+            self.assertEqual([t['description'] for t in data['toilets']], ['First'])
+            self.assertEqual(data['toilets'][0]['review_count'], 2)
+            
+            data, status = ApiController.get_toilet_changes('-1')
+            self.assertEqual(status, 400)
+    
+    def test_api_toilet_changes_reset_after_compaction(self):
+        """Test clients are told to reload once the change log was compacted."""
+        from app.models.dataset import compact_changes, get_dataset_version
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            for i in range(3):
+                ToiletController.add_toilet('42.6977', '23.3219', f'Toilet {i}', False, True, '2')
+            version, _ = get_dataset_version()
+            
+            self.assertEqual(compact_changes(keep_versions=1), 2)
+            data, status = ApiController.get_toilet_changes('0')
+            self.assertEqual(data, {'version': version, 'reset': True, 'toilets': []})
+            data, status = ApiController.get_toilet_changes(str(version - 1))
+            self.assertFalse(data['reset'])
+    
+    def test_indexes_catch_up_with_changes_from_other_processes(self):
+        """Test the in-memory indexes pick up rows written outside this process's controllers."""
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            
+            from flask import session
+            session['user_id'] = user.id
+            
+            # Written directly, as another worker process would
+            db.session.add(Toilet(latitude=42.6977, longitude=23.3219,
+                                  description='Elsewhere', user_id=user.id))
+            db.session.commit()
+            
+            data, status = ApiController.get_nearest_toilets('42.6977', '23.3219', 1)
+            self.assertEqual([t['description'] for t in data['toilets']], ['Elsewhere'])
+            data, status = ApiController.get_toilet_clusters('3')
+            self.assertEqual([c['count'] for c in data['clusters']], [1])
+    
+    def test_api_response_compression(self):
+        """Test large API responses are compressed per Accept-Encoding and small ones are not."""
+        import gzip
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            for i in range(50):
+                db.session.add(Toilet(latitude=42.69, longitude=23.32,
+                                      description=f'Toilet number {i}', user_id=user.id))
+            db.session.commit()
+            user_id = user.id
+        
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        
+        plain = self.client.get('/api/toilets')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        
+        compressed = self.client.get('/api/toilets', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertTrue(compressed.headers['ETag'].startswith('W/'))
+        
+        # The compressed bytes are reused for the same dataset version
+        again = self.client.get('/api/toilets', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(again.data, compressed.data)
+        self.assertEqual(self.app.extensions['compression_cache'].stats()['hits'], 1)
+        
+        not_modified = self.client.get('/api/toilets', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        
+        # Small bodies and already-compressed images are sent as they are
+        small = self.client.get('/api/toilets/changes?since=999999', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', small.headers)
+        image = self.client.get('/static/base.png', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', image.headers)
+        image.close()
+    
+    def test_sqlite_connection_pragmas(self):
+        """Test SQLite connections are opened in WAL mode with the configured tuning."""
+        from sqlalchemy import text
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+                # NORMAL
+                self.assertEqual(connection.execute(text('PRAGMA synchronous')).scalar(), 1)
+                self.assertEqual(connection.execute(text('PRAGMA busy_timeout')).scalar(),
+                                 self.app.config['SQLITE_BUSY_TIMEOUT_MS'])
+                self.assertEqual(connection.execute(text('PRAGMA cache_size')).scalar(),
+                                 -self.app.config['SQLITE_CACHE_SIZE_KB'])
+    
+        # Settings can be overridden when creating the app
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.db_path}',
+                          'SQLITE_JOURNAL_MODE': 'DELETE'})
+        with app.app_context():
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(text('PRAGMA journal_mode')).scalar(), 'delete')
+    
+    def test_import_toilets_command(self):
+        """Test bulk import from CSV and GeoJSON with validation, de-duplication and resume."""
+        import json
+        from app.models.dataset import get_changed_toilet_ids, get_dataset_version
+        from app.utils.importer import _save_checkpoint, checkpoint_path, load_checkpoint
+        with self.app.app_context():
+            user = User(username='importer', email='importer@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Toilet(latitude=42.6977, longitude=23.3219, description='Existing', user_id=user.id))
+            db.session.commit()
+            version_before, _ = get_dataset_version()
+    
+        directory = tempfile.mkdtemp()
+        csv_path = os.path.join(directory, 'toilets.csv')
+        with open(csv_path, 'w') as f:
+            f.write('lat,lon,name,wheelchair,cleanliness\n'
+                    '42.70,23.33,Station,yes,5\n'
+                    '42.69770,23.32191,Next to existing,no,4\n'  # ~1m from the existing toilet
+                    '999,23.33,Broken,no,4\n'
+                    '42.71,23.34,Park,no,\n')
+    
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['import-toilets', csv_path, '--user', 'importer', '--batch-size', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 2 toilet(s): 1 duplicate(s), 1 invalid record(s)', result.output)
+        self.assertFalse(os.path.exists(checkpoint_path(csv_path)))
+    
+        with self.app.app_context():
+            station = Toilet.query.filter_by(description='Station').one()
+            self.assertTrue(station.get_accessibility_consensus())
+            self.assertEqual(station.get_median_cleanliness(), 5)
+            self.assertEqual(station.cleanliness_5, 1)
+            self.assertIsNotNone(station.grid_cell)
+            self.assertEqual(Toilet.query.filter_by(description='Park').one().cleanliness, 3)
+            # A single version bump that sends change feed clients to a full reload
+            self.assertEqual(get_dataset_version()[0], version_before + 1)
+            self.assertIsNone(get_changed_toilet_ids(version_before)[1])
+    
+        geojson_path = os.path.join(directory, 'toilets.geojson')
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [23.30 + i / 100, 42.60]},
+                     'properties': {'amenity': 'toilets', 'name': f'OSM {i}'}} for i in range(3)]
+        with open(geojson_path, 'w') as f:
+            f.write('\n'.join(json.dumps(feature) for feature in features))
+        # Pretend an earlier run stopped after the first record
+        _save_checkpoint(geojson_path, 1)
+        self.assertEqual(load_checkpoint(geojson_path), 1)
+    
+        result = runner.invoke(args=['import-toilets', geojson_path, '--user', 'importer'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Resuming after record 1', result.output)
+        with self.app.app_context():
+            names = {toilet.description for toilet in Toilet.query.filter(Toilet.description.like('OSM %'))}
+            self.assertEqual(names, {'OSM 1', 'OSM 2'})
+            # The in-memory index was rebuilt with the imported toilets
+            nearest_id, _ = self.app.extensions['nearest_toilet_index'].nearest(42.60, 23.32, 1)[0]
+            self.assertEqual(db.session.get(Toilet, nearest_id).description, 'OSM 2')
+            # Every imported description is searchable, and indexed once
+            from app.models.search import SEARCH_TABLE, search_supported, search_rowid
+            if search_supported(db.session.connection()):
+                rowids = db.session.execute(db.text(f'SELECT rowid FROM {SEARCH_TABLE} ORDER BY rowid')).scalars().all()
+                self.assertEqual(rowids, [search_rowid(toilet.id) for toilet in Toilet.query.order_by(Toilet.id)])
+    
+        result = runner.invoke(args=['import-toilets', csv_path, '--user', 'nobody'])
+        self.assertNotEqual(result.exit_code, 0)
+
+        # FeatureCollections are streamed a feature at a time, across chunk borders
+        from app.utils import importer
+        collection_path = os.path.join(directory, 'collection.geojson')
+        with open(collection_path, 'w') as f:
+            f.write(json.dumps({'type': 'FeatureCollection', 'name': 'toilets', 'bbox': [23.3, 42.6, 23.33, 42.6],
+                                'features': features, 'count': 12345}, indent=1))
+        original_chunk_size = importer.GEOJSON_CHUNK_SIZE
+        importer.GEOJSON_CHUNK_SIZE = 7
+        try:
+            records = list(importer.read_geojson(collection_path))
+            self.assertEqual([(record['name'], record['longitude']) for record in records],
+                             [(f'OSM {i}', feature['geometry']['coordinates'][0]) for i, feature in enumerate(features)])
+            # Features before a broken tail come out before the error
+            with open(collection_path, 'w') as f:
+                f.write('{"type": "FeatureCollection", "features": [' + json.dumps(features[0]) + ', {"type": ')
+            records = importer.read_geojson(collection_path)
+            self.assertEqual(next(records)['name'], 'OSM 0')
+            with self.assertRaises(ValueError):
+                next(records)
+            with open(geojson_path, 'w') as f:
+                f.write(''.join('\x1e' + json.dumps(feature) + '\n' for feature in features))
+            self.assertEqual([record['name'] for record in importer.read_geojson(geojson_path)],
+                             ['OSM 0', 'OSM 1', 'OSM 2'])
+        finally:
+            importer.GEOJSON_CHUNK_SIZE = original_chunk_size
+    
+    def test_export_toilets_streams_ndjson_and_geojson(self):
+        """Test the export endpoint and command stream the same toilets as the list endpoint."""
+        import json
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            for i in range(5):
+                db.session.add(Toilet(latitude=42.69 + i / 100, longitude=23.32, accessible=True,
+                                      description=f'Toilet {i}', cleanliness=i + 1, user_id=user.id))
+            db.session.commit()
+            db.session.add(Review(cleanliness=1, accessible=False, user_id=user.id, toilet_id=1))
+            db.session.commit()
+            user_id = user.id
+    
+        self.assertEqual(self.client.get('/api/toilets/export').status_code, 401)
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+    
+        expected = self.client.get('/api/toilets').get_json()['toilets']
+    
+        response = self.client.get('/api/toilets/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertEqual([json.loads(line) for line in response.data.decode().splitlines()], expected)
+    
+        response = self.client.get('/api/toilets/export?format=geojson')
+        self.assertEqual(response.mimetype, 'application/geo+json')
+        collection = json.loads(response.data)
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual(len(collection['features']), 5)
+        feature = collection['features'][0]
+        self.assertEqual(feature['geometry']['coordinates'], [expected[0]['longitude'], expected[0]['latitude']])
+        self.assertEqual(feature['properties']['cleanliness'], expected[0]['cleanliness'])
+        self.assertEqual(feature['properties']['review_count'], 1)
+    
+        self.assertEqual(self.client.get('/api/toilets/export?format=csv').status_code, 400)
+    
+        # Chunks don't change the output, and the command writes the same bytes
+        from app.utils.export import export_toilets
+        with self.app.app_context():
+            self.assertEqual(''.join(export_toilets('geojson', chunk_size=2)), response.data.decode())
+        result = self.app.test_cli_runner().invoke(args=['export-toilets', '--format', 'geojson'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output, response.data.decode())
+    
+    def test_snapshot_publisher(self):
+        """Test snapshots are published on version changes, debounced and served as immutable gzip files."""
+        import gzip
+        import json
+        from app.utils.compact import decode_compact
+        from app.utils.snapshot import SnapshotPublisher, publish_snapshot, read_manifest
+        directory = tempfile.mkdtemp()
+        self.app.config['SNAPSHOT_DIR'] = directory
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Toilet(latitude=42.6977, longitude=23.3219, description='Test toilet',
+                                  has_toilet_paper=True, cleanliness=4, user_id=user.id))
+            db.session.commit()
+            user_id = user.id
+    
+            publisher = SnapshotPublisher(self.app, debounce=10, max_delay=60)
+            # The first change is held back until the version stays put for `debounce` seconds
+            self.assertIsNone(publisher.check(now=100))
+            manifest = publisher.check(now=110)
+            self.assertEqual(manifest['count'], 1)
+            self.assertIsNone(publisher.check(now=120))
+    
+            # Unchanged data republishes nothing, and the file name is a content hash
+            self.assertEqual(publish_snapshot(directory), manifest)
+            self.assertEqual(publish_snapshot(directory, force=True)['file'], manifest['file'])
+    
+            with gzip.open(os.path.join(directory, manifest['file'])) as f:
+                payload = json.load(f)
+            self.assertEqual(payload['version'], manifest['version'])
+            toilet = decode_compact(payload)[0]
+            self.assertEqual((toilet['description'], toilet['cleanliness'], toilet['has_toilet_paper']),
+                             ('Test toilet', 4, True))
+    
+            # Changes that keep coming are published after max_delay at the latest
+            for now in range(130, 200, 5):
+                db.session.add(Review(cleanliness=1, user_id=user_id, toilet_id=toilet['id']))
+                db.session.commit()
+                if publisher.check(now=now):
+                    break
+            self.assertEqual(now, 190)
+            self.assertNotEqual(read_manifest(directory)['file'], manifest['file'])
+            manifest = read_manifest(directory)
+    
+        url = f"/snapshots/{manifest['file']}"
+        self.assertEqual(self.client.get(url).status_code, 401)
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+    
+        self.assertIn(url, self.client.get('/main').get_data(as_text=True))
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(json.loads(gzip.decompress(response.data))['version'], manifest['version'])
+        response.close()
+    
+        plain = self.client.get(url)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.get_json()['version'], manifest['version'])
+        self.assertEqual(self.client.get('/snapshots/toilets-missing.json.gz').status_code, 404)
+        self.assertEqual(self.client.get('/snapshots/latest.json').status_code, 404)
+    
+    def test_password_hashing_pool(self):
+        """Test logins rehash outdated hashes, signup checks duplicates in one query and overload gives 503."""
+        import threading
+        from app.utils.password_hashing import PasswordHasher, PasswordHashingBusy
+        from app.utils.query_counter import QueryCounter
+        with self.app.test_request_context():
+            with QueryCounter() as counter:
+                self.assertTrue(AuthController.signup('testuser', 'test@example.com', 'password123'))
+            # One lookup for username and email, one insert
+            self.assertEqual(counter.count, 2)
+    
+            # A cheaper configured cost is picked up on the next successful login
+            self.app.extensions['password_hasher'] = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+            self.assertFalse(AuthController.login('testuser', 'wrongpassword'))
+            self.assertTrue(User.query.one().password_hash.startswith('scrypt:'))
+            self.assertTrue(AuthController.login('testuser', 'password123'))
+            self.assertTrue(User.query.one().password_hash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(AuthController.login('testuser', 'password123'))
+    
+        # With the worker busy and no queue, further hashes are refused
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_queue=0)
+        self.app.extensions['password_hasher'] = hasher
+        release = threading.Event()
+        started = threading.Event()
+        worker = threading.Thread(target=hasher.submit, args=(lambda: (started.set(), release.wait()),))
+        worker.start()
+        started.wait()
+        try:
+            with self.assertRaises(PasswordHashingBusy):
+                hasher.hash('password123')
+            response = self.client.post('/login', data={'username': 'testuser', 'password': 'password123'})
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+        finally:
+            release.set()
+            worker.join()
+    
+        response = self.client.post('/login', data={'username': 'testuser', 'password': 'password123'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(hasher.rejected, 2)
+    
+        # A full pool skips the rehash instead of failing a correct login
+        hasher = PasswordHasher('pbkdf2:sha256:2000', workers=1)
+        def busy(password):
+            raise PasswordHashingBusy()
+        hasher.hash = busy
+        self.app.extensions['password_hasher'] = hasher
+        with self.app.test_request_context():
+            self.assertTrue(AuthController.login('testuser', 'password123'))
+            self.assertTrue(User.query.one().password_hash.startswith('pbkdf2:sha256:1000$'))
+    
+    def test_startup_schema_check_and_lazy_api_docs(self):
+        """Test the schema check skips create_all when up to date and API docs are built on first use."""
+        from app.models.schema import SCHEMA_VERSION, ensure_schema, get_schema_version
+        from app.utils.query_counter import QueryCounter
+        with self.app.app_context():
+            self.assertEqual(get_schema_version(), SCHEMA_VERSION)
+            with QueryCounter() as counter:
+                ensure_schema()
+            self.assertEqual(counter.count, 1)
+    
+        docs = self.app.wsgi_app
+        self.assertIsNone(docs._docs_app)
+        spec = self.client.get('/apispec_1.json').get_json()
+        self.assertIn('/api/toilets/nearest', spec['paths'])
+        self.assertEqual(self.client.get('/apidocs/').status_code, 200)
+        self.assertIsNotNone(docs._docs_app)
+    
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.db_path}', 'API_DOCS': False})
+        self.assertEqual(app.test_client().get('/apidocs/').status_code, 404)
+    
+    def test_db_upgrade_migrates_legacy_database(self):
+        """Test migrations bring a pre-versioning database to the current schema and indexes."""
+        import sqlite3
+        from sqlalchemy import inspect
+        from app.migrations import pending_migrations, upgrade
+        from app.models.schema import SCHEMA_VERSION, get_schema_version
+    
+        # The original user/toilet/review layout, without schema_version
+        connection = sqlite3.connect(self.db_path)
+        connection.executescript("""
+            CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE,
+                               email VARCHAR(120) NOT NULL UNIQUE, password_hash VARCHAR(128));
+            CREATE TABLE toilet (id INTEGER PRIMARY KEY, latitude FLOAT NOT NULL, longitude FLOAT NOT NULL,
+                                 description VARCHAR(200), accessible BOOLEAN, has_toilet_paper BOOLEAN,
+                                 cleanliness INTEGER, timestamp DATETIME,
+                                 user_id INTEGER NOT NULL REFERENCES user (id));
+            CREATE TABLE review (id INTEGER PRIMARY KEY, accessible BOOLEAN, has_toilet_paper BOOLEAN,
+                                 cleanliness INTEGER, comment VARCHAR(200), timestamp DATETIME,
+                                 user_id INTEGER NOT NULL REFERENCES user (id),
+                                 toilet_id INTEGER NOT NULL REFERENCES toilet (id));
+            INSERT INTO user VALUES (1, 'legacy', 'legacy@example.com', 'x');
+            INSERT INTO toilet VALUES (1, 42.6977, 23.3219, 'Old', 1, 0, 2, NULL, 1);
+            INSERT INTO review VALUES (1, 1, 1, 5, 'Clean now', NULL, 1, 1);
+            INSERT INTO review VALUES (2, 0, 1, 5, 'Fine', NULL, 1, 1);
+        """)
+        connection.close()
+    
+        # Without auto upgrade the app starts and leaves the tables alone
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.db_path}',
+                          'SCHEMA_AUTO_UPGRADE': False, 'API_DOCS': False})
+        with app.app_context():
+            self.assertIsNone(get_schema_version())
+            self.assertEqual([migration.version for migration in pending_migrations()],
+                             list(range(1, SCHEMA_VERSION + 1)))
+    
+            applied = upgrade()
+            self.assertEqual([migration.version for migration in applied], list(range(1, SCHEMA_VERSION + 1)))
+            self.assertEqual(get_schema_version(), SCHEMA_VERSION)
+            self.assertEqual(upgrade(), [])
+    
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('review')}
+            self.assertTrue({'ix_review_toilet_id_id', 'ix_review_user_id'} <= indexes)
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('toilet')}
+            self.assertTrue({'ix_toilet_grid_cell', 'ix_toilet_user_id', 'ix_toilet_latitude_longitude',
+                             'ix_toilet_consensus', 'ix_toilet_median_cleanliness'} <= indexes)
+    
+            # New columns are backfilled
+            toilet = db.session.get(Toilet, 1)
+            self.assertIsNotNone(toilet.grid_cell)
+            self.assertEqual(toilet.stored_aggregates(), toilet.compute_aggregates())
+            self.assertEqual(toilet.review_count, 2)
+            self.assertEqual(toilet.cleanliness_5, 2)
+            self.assertEqual(toilet.toilet_paper_votes, 2)
+            self.assertEqual(toilet.median_cleanliness, 5)
+            self.assertTrue(toilet.accessible_consensus and toilet.toilet_paper_consensus)
+    
+            # The in-memory indexes skipped at startup are built on first use
+            self.assertNotIn('toilet_index_version', app.extensions)
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+            response = client.get('/api/toilets/nearest', query_string={'lat': 42.6977, 'lng': 23.3219})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([toilet['id'] for toilet in response.get_json()['toilets']], [1])
+            response = client.get('/api/toilets/clusters', query_string={'z': 18, 'bbox': '23.3,42.6,23.4,42.7'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(client.get('/main').status_code, 200)
+            db.session.remove()
+            db.engine.dispose()
+    
+        # A new database is created with the same indexes
+        with self.app.app_context():
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('toilet')}
+            self.assertTrue({'ix_toilet_grid_cell', 'ix_toilet_user_id', 'ix_toilet_latitude_longitude',
+                             'ix_toilet_consensus', 'ix_toilet_median_cleanliness'} <= indexes)
+    
+    def test_metrics_endpoint_and_slow_request_profiles(self):
+        """Test per-endpoint request, SQL and cache metrics on /metrics and slow request profiles."""
+        import re
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(Toilet(latitude=42.6977, longitude=23.3219,
+                                  description='Test toilet', user_id=user.id))
+            db.session.commit()
+            user_id = user.id
+    
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        self.client.get('/api/toilets')
+        self.client.get('/api/toilets')
+        self.client.get('/no-such-page')
+    
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_requests_total{endpoint="api.get_toilets",method="GET",status="200"} 2', text)
+        self.assertIn('http_requests_total{endpoint="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="api.get_toilets",method="GET"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="api.get_toilets",method="GET",le="+Inf"} 2',
+                      text)
+        self.assertIn('http_response_size_bytes_count{endpoint="api.get_toilets",method="GET"} 2', text)
+        # The scrape itself is in flight
+        self.assertIn('http_requests_in_flight{endpoint="metrics.metrics"} 1', text)
+        self.assertIn('http_requests_in_flight{endpoint="api.get_toilets"} 0', text)
+        statements = re.search(r'http_request_sql_statements_sum\{endpoint="api.get_toilets",method="GET"\} (\S+)', text)
+        self.assertGreaterEqual(float(statements.group(1)), 2)
+        self.assertRegex(text, r'sql_statements_total \d+')
+        self.assertIn('response_cache_hits_total 1', text)
+        self.assertIn('response_cache_misses_total 1', text)
+    
+        # Without a token only local, unproxied scrapes are served
+        remote = {'REMOTE_ADDR': '203.0.113.5'}
+        self.assertEqual(self.client.get('/metrics', environ_base=remote).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.5'}).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', environ_base={'REMOTE_ADDR': '::1'}).status_code, 200)
+    
+        # Scraping can require a bearer token, from anywhere
+        self.app.config['METRICS_TOKEN'] = 'scrape-secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer \u00e9'}).status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}, environ_base=remote)
+        self.assertEqual(response.status_code, 200)
+    
+        # Requests over the threshold get a cProfile dump
+        directory = tempfile.mkdtemp()
+        app = create_app({'PROFILE_SLOW_REQUESTS_MS': 0.001, 'PROFILE_DIR': directory, 'API_DOCS': False})
+        app.test_client().get('/login')
+        profiles = os.listdir(directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertIn('auth.login', profiles[0])
+        self.assertTrue(profiles[0].endswith('.prof'))
+        self.assertIn('http_slow_request_profiles_total{endpoint="auth.login"} 1',
+                      app.extensions['metrics'].render())
+    
+    def test_benchmark_dataset_and_baseline_comparison(self):
+        """Test the benchmark data generator is deterministic and consistent, and regressions are flagged."""
+        from benchmarks.datasets import Scale, generate
+        from benchmarks.suite import compare
+        from app.utils.aggregates import check_aggregates
+        scale = Scale('tiny', users=5, toilets=20, reviews=200)
+        with self.app.app_context():
+            generate(scale, seed=1)
+            self.assertEqual(Toilet.query.count(), 20)
+            self.assertEqual(Review.query.count(), 200)
+            # Stored aggregates match what the mapper events would have written
+            self.assertEqual(check_aggregates(), [])
+            # Reviews are skewed towards a few popular toilets
+            counts = sorted((toilet.review_count for toilet in Toilet.query), reverse=True)
+            self.assertGreater(sum(counts[:4]), 100)
+            first = [(t.latitude, t.longitude, t.review_count) for t in Toilet.query.order_by(Toilet.id)]
+            self.assertTrue(db.session.get(User, 1).check_password('password123'))
+    
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+            generate(scale, seed=1)
+            second = [(t.latitude, t.longitude, t.review_count) for t in Toilet.query.order_by(Toilet.id)]
+            self.assertEqual(first, second)
+    
+        baseline = {'results': {'small': {'api_toilets': {'median_ms': 10.0}, 'login': {'median_ms': 100.0}}}}
+        results = {'small': {'api_toilets': {'median_ms': 21.0}, 'login': {'median_ms': 110.0},
+                             'new_benchmark': {'median_ms': 1.0}}}
+        rows = {row[1]: row for row in compare(results, baseline, threshold=1.5)}
+        self.assertTrue(rows['api_toilets'][5])
+        self.assertAlmostEqual(rows['api_toilets'][4], 2.1)
+        self.assertFalse(rows['login'][5])
+        self.assertIsNone(rows['new_benchmark'][2])
+        self.assertFalse(rows['new_benchmark'][5])
+    
+    def test_group_commit_writer(self):
+        """Test reviews and toilets submitted through the group commit writer are batched and failures isolated."""
+        import threading
+        import time
+        from sqlalchemy.exc import IntegrityError
+        from flask import session
+        from app.utils.group_commit import GroupCommitBusy
+        app = create_app({'GROUP_COMMIT': True, 'GROUP_COMMIT_MAX_DELAY_MS': 50, 'API_DOCS': False})
+        writer = app.extensions['group_commit']
+        with app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            toilet = Toilet(latitude=42.6977, longitude=23.3219, description='Test toilet',
+                            cleanliness=1, user_id=user.id)
+            db.session.add(toilet)
+            db.session.commit()
+            user_id, toilet_id = user.id, toilet.id
+    
+        results = []
+        def submit_review():
+            with app.test_request_context():
+                session['user_id'] = user_id
+                results.append(ToiletController.add_review(toilet_id, True, True, '5', 'Batched'))
+        threads = [threading.Thread(target=submit_review) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(writer.committed, 8)
+        self.assertLess(writer.batches, 8)
+    
+        with app.test_request_context():
+            session['user_id'] = user_id
+            self.assertTrue(ToiletController.add_toilet('42.70', '23.33', 'Queued toilet', False, True, '3'))
+            toilet = db.session.get(Toilet, toilet_id)
+            self.assertEqual(toilet.review_count, 8)
+            self.assertEqual(toilet.get_median_cleanliness(), 5)
+            self.assertEqual(Toilet.query.filter_by(description='Queued toilet').count(), 1)
+    
+            # A failing row only fails its own submission
+            good = writer.enqueue(Review, dict(cleanliness=4, comment='Good', user_id=user_id, toilet_id=toilet_id))
+            bad = writer.enqueue(Review, dict(cleanliness=4, comment='Bad', user_id=None, toilet_id=toilet_id))
+            self.assertIsInstance(good.result(timeout=5), int)
+            with self.assertRaises(IntegrityError):
+                bad.result(timeout=5)
+            self.assertEqual(writer.failed, 1)
+            self.assertEqual(Review.query.filter_by(comment='Good').count(), 1)
+            self.assertEqual(Review.query.filter_by(comment='Bad').count(), 0)
+    
+            # A batch the writer itself fails on fails its submissions, and the writer carries on
+            write = writer._write
+            def failing_write(batch):
+                raise RuntimeError('disk I/O error')
+            writer._write = failing_write
+            lost = writer.enqueue(Review, dict(cleanliness=4, comment='Lost', user_id=user_id, toilet_id=toilet_id))
+            with self.assertRaises(RuntimeError):
+                lost.result(timeout=5)
+            writer._write = write
+            self.assertIsInstance(writer.submit(Review, dict(cleanliness=4, comment='After', user_id=user_id,
+                                                             toilet_id=toilet_id)), int)
+    
+            # Waiting too long is a 503; a row still queued by then isn't written
+            release = threading.Event()
+            def slow_write(batch):
+                release.wait(5)
+                write(batch)
+            writer._write = slow_write
+            writer.result_timeout = 0.1
+            slow = writer.enqueue(Review, dict(cleanliness=4, comment='Slow', user_id=user_id, toilet_id=toilet_id))
+            time.sleep(0.2)
+            with self.assertRaises(GroupCommitBusy):
+                ToiletController.add_review(toilet_id, True, True, '4', 'Timed out')
+            release.set()
+            self.assertIsInstance(slow.result(timeout=5), int)
+            writer.stop()
+            self.assertEqual(Review.query.filter_by(comment='Timed out').count(), 0)
+            self.assertEqual(Review.query.filter_by(comment='Slow').count(), 1)
+        with app.test_request_context():
+            response = app.make_response(app.handle_user_exception(GroupCommitBusy()))
+            self.assertEqual(response.status_code, 503)
+    
+    def test_main_page_embeds_initial_markers(self):
+        """Test the map page embeds the markers around the last viewed area instead of loading every toilet."""
+        import json
+        import re
+        from app.utils.map_bootstrap import DEFAULT_MAP_VIEW, parse_map_view, viewport_bbox
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add_all([
+                Toilet(latitude=42.6977, longitude=23.3219, description='Sofia </script>', user_id=user.id),
+                Toilet(latitude=51.5, longitude=-0.1, description='London', user_id=user.id)
+            ])
+            db.session.commit()
+            user_id = user.id
+    
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        self.app.config['SQL_QUERY_BUDGET_STRICT'] = True
+    
+        def bootstrap(response):
+            self.assertEqual(response.status_code, 200)
+            html = response.get_data(as_text=True)
+            self.assertNotIn('Sofia </script>', html)
+            match = re.search(r'<script type="application/json" id="map-bootstrap">(.*?)</script>', html, re.S)
+            return json.loads(match.group(1))
+    
+        # Default view: clusters for the area around London
+        data = bootstrap(self.client.get('/main'))
+        self.assertEqual(data['data']['zoom'], DEFAULT_MAP_VIEW['zoom'])
+        self.assertEqual(sum(cluster['count'] for cluster in data['data']['clusters']), 1)
+        west, south, east, north = data['bbox']
+        self.assertTrue(west < DEFAULT_MAP_VIEW['longitude'] < east and south < DEFAULT_MAP_VIEW['latitude'] < north)
+    
+        # Zoomed in on the last viewed area: the individual toilets, compact encoded
+        self.client.set_cookie('map_view', '42.69770,23.32190,16')
+        data = bootstrap(self.client.get('/main'))
+        self.assertEqual(data['data']['zoom'], 16)
+        self.assertEqual(data['data']['count'], 1)
+        # Escaped so it can't close the script tag early
+        self.assertEqual(data['data']['description'], ['Sofia </script>'])
+        cache = self.app.extensions['response_cache']
+        hits = cache.stats()['hits']
+        self.client.get('/main')
+        self.assertEqual(cache.stats()['hits'], hits + 1)
+    
+        # Views a few pixels apart share one payload; junk falls back to the default
+        self.assertEqual(viewport_bbox({'latitude': 42.6977, 'longitude': 23.3219, 'zoom': 16}),
+                         viewport_bbox({'latitude': 42.6978, 'longitude': 23.3220, 'zoom': 16}))
+        self.assertEqual(parse_map_view('91,0,5'), DEFAULT_MAP_VIEW)
+        self.assertEqual(parse_map_view('nonsense'), DEFAULT_MAP_VIEW)
+    
+        self.app.config['MAP_BOOTSTRAP'] = False
+        self.assertNotIn('id="map-bootstrap"', self.client.get('/main').get_data(as_text=True))
+    
+    def test_batch_submission_with_idempotency_keys(self):
+        """Test a batch of toilets and reviews is added in one go and retried items aren't added twice."""
+        from app.models.idempotency import IdempotencyKey, prune_idempotency_keys
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            toilet = Toilet(latitude=42.6977, longitude=23.3219, description='Test toilet', user_id=user.id)
+            db.session.add(toilet)
+            db.session.commit()
+            user_id, toilet_id = user.id, toilet.id
+    
+        items = [
+            {'type': 'toilet', 'key': 't1', 'latitude': 42.70, 'longitude': 23.33,
+             'description': '<b>New</b>', 'cleanliness': 4, 'accessible': True},
+            {'type': 'review', 'key': 'r1', 'toilet_key': 't1', 'cleanliness': 2, 'comment': 'Offline'},
+            {'type': 'review', 'key': 'r2', 'toilet_id': toilet_id, 'cleanliness': '5', 'has_toilet_paper': True},
+            {'type': 'review', 'key': 'r2', 'toilet_id': toilet_id, 'cleanliness': 5},
+            {'type': 'review', 'toilet_id': 9999, 'cleanliness': 3},
+            {'type': 'toilet', 'latitude': 100, 'longitude': 0, 'description': 'Nowhere', 'cleanliness': 3},
+            {'type': 'review', 'toilet_id': toilet_id, 'cleanliness': 6},
+            {'type': 'sink'}
+        ]
+        self.assertEqual(self.client.post('/api/batch', json=items).status_code, 401)
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        self.assertEqual(self.client.post('/api/batch', data='items').status_code, 415)
+        self.assertEqual(self.client.post('/api/batch', json={'items': 'x'}).status_code, 400)
+        # Ids SQLite can't hold are rejected per item rather than failing the batch
+        response = self.client.post('/api/batch', json=[
+            {'type': 'review', 'toilet_id': toilet_id_value, 'cleanliness': 3} for toilet_id_value in (10 ** 30, 2 ** 63, 0, -1)
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.get_json()['results']], ['invalid'] * 4)
+    
+        response = self.client.post('/api/batch', json={'items': items})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'created', 'created', 'duplicate', 'not_found', 'invalid', 'invalid', 'invalid'])
+        self.assertEqual(results[3]['id'], results[2]['id'])
+        self.assertEqual(response.get_json()['counts'], {'created': 3, 'duplicate': 1, 'not_found': 1, 'invalid': 3})
+        with self.app.app_context():
+            new_toilet = db.session.get(Toilet, results[0]['id'])
+            self.assertEqual(new_toilet.description, '&lt;b&gt;New&lt;/b&gt;')
+            self.assertEqual(db.session.get(Review, results[1]['id']).toilet_id, new_toilet.id)
+            self.assertEqual(db.session.get(Toilet, toilet_id).review_count, 1)
+            self.assertEqual(new_toilet.review_count, 1)
+    
+        # Retrying the whole batch adds nothing; a later batch can refer to the new toilet by key
+        response = self.client.post('/api/batch', json=items[:3] + [
+            {'type': 'review', 'key': 'r3', 'toilet_key': 't1', 'cleanliness': 5},
+            {'type': 'toilet', 'key': 'r1', 'latitude': 1, 'longitude': 1, 'description': 'Reused', 'cleanliness': 3}
+        ])
+        results2 = response.get_json()['results']
+        self.assertEqual([result['status'] for result in results2], ['duplicate'] * 3 + ['created', 'invalid'])
+        self.assertEqual([result['id'] for result in results2[:3]], [result['id'] for result in results[:3]])
+        with self.app.app_context():
+            self.assertEqual(Toilet.query.count(), 2)
+            self.assertEqual(Review.query.count(), 3)
+            self.assertEqual(db.session.get(Review, results2[3]['id']).toilet_id, results[0]['id'])
+            self.assertEqual(prune_idempotency_keys(30), 0)
+            self.assertEqual(prune_idempotency_keys(-1), 4)
+            self.assertEqual(IdempotencyKey.query.count(), 0)
+    
+    def test_toilet_list_attribute_filters_and_sorting(self):
+        """Test the toilet list filters and sorts on the stored consensus and median columns."""
+        with self.app.app_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            # (lat, lng, initial cleanliness, accessible, paper, review cleanliness ratings)
+            specs = [
+                (42.6977, 23.3219, 5, True, True, [5, 4]),
+                (42.6990, 23.3230, 2, True, True, [5, 5, 5]),
+                (42.7100, 23.3400, 4, True, False, []),
+                (42.6500, 23.2900, 1, False, True, [1])
+            ]
+            ids = []
+            for lat, lng, cleanliness, accessible, paper, ratings in specs:
+                toilet = Toilet(latitude=lat, longitude=lng, description='Test toilet', cleanliness=cleanliness,
+                                accessible=accessible, has_toilet_paper=paper, user_id=user.id)
+                db.session.add(toilet)
+                db.session.commit()
+                for rating in ratings:
+                    db.session.add(Review(toilet_id=toilet.id, user_id=user.id, cleanliness=rating,
+                                          accessible=accessible, has_toilet_paper=paper))
+                    db.session.commit()
+                ids.append(toilet.id)
+            # The relative UPDATE keeps the stored values equal to a recompute
+            for toilet in Toilet.query:
+                self.assertEqual(toilet.stored_aggregates(), toilet.compute_aggregates())
+            self.assertEqual(db.session.get(Toilet, ids[1]).median_cleanliness, 5)
+            user_id = user.id
+    
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        self.app.config['SQL_QUERY_BUDGET_STRICT'] = True
+    
+        def listed(**params):
+            response = self.client.get('/api/toilets', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            return response.get_json()
+    
+        def toilet_ids(**params):
+            return [toilet['id'] for toilet in listed(**params)['toilets']]
+    
+        # Unpaginated and unsorted lists come in index order
+        self.assertEqual(sorted(toilet_ids(accessible='true', has_toilet_paper='true')), ids[:2])
+        self.assertEqual(sorted(toilet_ids(accessible='true', min_cleanliness=4)), ids[:3])
+        self.assertEqual(sorted(toilet_ids(min_review_count=2)), ids[:2])
+        self.assertEqual(sorted(toilet_ids(accessible='false')), ids)
+        self.assertEqual(toilet_ids(accessible='true', limit=10), ids[:3])
+        # Combined with a viewport
+        self.assertEqual(sorted(toilet_ids(accessible='true', bbox='23.30,42.69,23.33,42.70')), ids[:2])
+    
+        # Highest rated first, ties by id in the same direction; pages continue where they left off
+        self.assertEqual(toilet_ids(sort='rating'), [ids[1], ids[0], ids[2], ids[3]])
+        self.assertIs(listed(sort='rating')['toilets'][-1]['accessible'], False)
+        first = listed(sort='rating', limit=2)
+        second = listed(sort='rating', limit=2, cursor=first['next_cursor'])
+        self.assertEqual([toilet['id'] for toilet in first['toilets'] + second['toilets']],
+                         [ids[1], ids[0], ids[2], ids[3]])
+        self.assertIsNone(second['next_cursor'])
+    
+        # Nearest first, from a point or the middle of the viewport
+        data = listed(sort='distance', lat=42.7100, lng=23.3400, has_toilet_paper='true')
+        self.assertEqual([toilet['id'] for toilet in data['toilets']], [ids[1], ids[0], ids[3]])
+        self.assertLess(data['toilets'][0]['distance_km'], data['toilets'][1]['distance_km'])
+        pages, cursor = [], None
+        while True:
+            page = listed(sort='distance', lat=42.7100, lng=23.3400, limit=1, **({'cursor': cursor} if cursor else {}))
+            pages += [toilet['id'] for toilet in page['toilets']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(pages, [ids[2], ids[1], ids[0], ids[3]])
+        self.assertEqual(toilet_ids(sort='distance', bbox='23.28,42.64,23.30,42.66'), [ids[3]])
+        # A viewport crossing the antimeridian is centered near 180, not on the prime meridian
+        from app.utils.geo import bbox_center
+        self.assertEqual(bbox_center(170.0, -10.0, -170.0, 10.0), (0.0, 180.0))
+        self.assertEqual(bbox_center(175.0, 0.0, -165.0, 0.0), (0.0, -175.0))
+        self.assertEqual(bbox_center(23.28, 42.64, 23.30, 42.66), ((42.64 + 42.66) / 2, (23.28 + 23.30) / 2))
+        # Compact responses keep the sort order and the distances
+        from app.utils.compact import decode_compact
+        compact = decode_compact(listed(sort='distance', lat=42.7100, lng=23.3400, has_toilet_paper='true',
+                                        format='compact'))
+        self.assertEqual([(toilet['id'], toilet['distance_km']) for toilet in compact],
+                         [(toilet['id'], toilet['distance_km']) for toilet in data['toilets']])
+        compact = decode_compact(listed(sort='rating', limit=2, format='compact'))
+        self.assertEqual([toilet['id'] for toilet in compact], [ids[1], ids[0]])
+    
+        for params in ({'min_cleanliness': 6}, {'min_review_count': 'x'}, {'min_review_count': 10 ** 30},
+                       {'sort': 'name'}, {'sort': 'distance'},
+                       {'sort': 'rating', 'cursor': first['next_cursor'].replace('e', 'x')}):
+            self.assertEqual(self.client.get('/api/toilets', query_string=params).status_code, 400)
+    
+    def test_full_text_search(self):
+        """Test /api/search ranks toilets by their descriptions and review comments and stays in sync."""
+        from flask import session
+        from app.models.search import SEARCH_TABLE
+        from app.utils.search import parse_query, search_toilets
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            session['user_id'] = user.id
+            ToiletController.add_toilet('42.6977', '23.3219', 'Central station, platform 1', True, True, '4')
+            ToiletController.add_toilet('42.6500', '23.2900', 'Shopping mall', False, True, '3')
+            ToiletController.add_toilet('42.7100', '23.3400', 'Park kiosk', False, False, '2')
+            station, mall, park = [toilet.id for toilet in Toilet.query.order_by(Toilet.id)]
+            ToiletController.add_review(park, False, True, '4', 'Free & clean, next to the bus stations')
+            ToiletController.add_review(mall, True, True, '5', "Free, but don't go at noon")
+            user_id = user.id
+    
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        self.app.config['SQL_QUERY_BUDGET_STRICT'] = True
+    
+        def found(**params):
+            response = self.client.get('/api/search', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            return [toilet['id'] for toilet in response.get_json()['toilets']]
+    
+        # Descriptions and comments, with stemming ("stations" in a comment matches "station")
+        self.assertEqual(found(q='station'), [station, park])
+        self.assertEqual(sorted(found(q='free')), [mall, park])
+        self.assertEqual(found(q='free clean'), [park])
+        self.assertEqual(found(q='"central station"'), [station])
+        self.assertEqual(found(q='"station central"'), [])
+        self.assertEqual(found(q='station', bbox='23.33,42.70,23.35,42.72'), [park])
+        self.assertEqual(found(q='station', limit=1), [station])
+        # FTS5 syntax in the query is taken literally
+        self.assertEqual(found(q='station OR mall'), [])
+        self.assertEqual(found(q='NEAR(station mall) body:mall *'), [])
+        self.assertEqual(parse_query('"central  station" free -- !'), ['central station', 'free'])
+        # Indexed as typed, not as the HTML-escaped text that is stored
+        self.assertEqual(found(q="don't"), [mall])
+        self.assertEqual(found(q='"free & clean"'), [park])
+        self.assertEqual(found(q='39'), [])
+        self.assertEqual(found(q='amp'), [])
+        for params in ({}, {'q': '  '}, {'q': 'free', 'limit': 0}, {'q': 'free', 'bbox': 'x'}):
+            self.assertEqual(self.client.get('/api/search', query_string=params).status_code, 400)
+    
+        with self.app.app_context():
+            # The LIKE fallback for backends without FTS5 finds the same toilets
+            self.assertEqual(sorted(search_toilets('free', full_text=False)), [mall, park])
+            self.assertEqual(search_toilets("don't", full_text=False), [mall])
+            self.assertEqual(search_toilets('100%', full_text=False), [])
+    
+            # Bulk inserts bypass the index until it is rebuilt
+            db.session.execute(db.text(f'DELETE FROM {SEARCH_TABLE}'))
+            db.session.commit()
+            self.assertEqual(search_toilets('station'), [])
+        result = self.app.test_cli_runner().invoke(args=['rebuild-search-index'])
+        self.assertIn('Indexed 5', result.output)
+        self.assertEqual(found(q='stations'), [station, park])
+        self.assertEqual(found(q="don't"), [mall])
+        self.assertEqual(found(q='"free & clean"'), [park])
+        self.assertEqual(found(q='39'), [])
+    
+    def test_serving_warm_up_and_fork_hooks(self):
+        """Test the warm-up fills the response cache and a forked worker starts clean but warm."""
+        from flask import session
+        from app.utils.serving import after_fork, before_fork, warm_up
+        with self.app.test_request_context():
+            user = User(username='testuser', email='test@example.com')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            session['user_id'] = user.id
+            ToiletController.add_toilet('42.6977', '23.3219', 'Central station', True, True, '4')
+            user_id = user.id
+    
+        results = warm_up(self.app)
+        self.assertEqual(results, {path: 200 for path in self.app.config['WARM_UP_PATHS']})
+        self.assertEqual(warm_up(self.app, paths=[]), {})
+        metrics = self.app.extensions['metrics']
+        self.assertIn('endpoint="main.main"', metrics.render())
+    
+        # Cached by the warm-up, so the first real request is a hit
+        cache = self.app.extensions['response_cache']
+        hits = cache.stats()['hits']
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        response = self.client.get('/api/toilets')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.stats()['hits'], hits + 1)
+    
+        before_fork(self.app)
+        if not hasattr(os, 'fork'):
+            return
+        pid = os.fork()
+        if pid == 0:
+            # Worker: fresh metrics and connections, the parent's caches
+            status = 1
+            try:
+                after_fork(self.app)
+                hits = cache.stats()['hits']
+                ok = (self.client.get('/api/toilets?format=compact').status_code == 200
+                      and cache.stats()['hits'] == hits + 1
+                      and 'endpoint="main.main"' not in metrics.render())
+                status = 0 if ok else 1
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        # The parent's connections were left alone
+        self.assertEqual(self.client.get('/api/toilets/nearest?lat=42.6977&lng=23.3219').status_code, 200)
+    
     def test_main_route_requires_login(self):
         """Test that main route requires authentication."""
         response = self.client.get('/main')
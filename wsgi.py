@@ -0,0 +1,13 @@
+"""Entry point for production WSGI servers, with the settings in
+gunicorn.conf.py:
+
+    gunicorn wsgi:app
+
+`python app.py` runs the development server instead."""
+from app import create_app
+from app.utils.serving import warm_up
+
+app = create_app()
+# In the gunicorn master with preload_app, so every worker is forked warm;
+# otherwise in each worker before it accepts connections
+warm_up(app)